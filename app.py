@@ -1,3 +1,4 @@
+import glob
 import os.path
 import shutil
 import sys
@@ -31,7 +32,14 @@ class app():
         if self.conv.retrieval:
                 self.conv.programmer.messages[0]["content"] += KNOWLEDGE_INTEGRATION_SYSTEM
                 print(self.conv.programmer.messages[0]["content"])
+        self.warmed_up = False
 
+    def warm_up(self):
+        # called when the UI is loaded: the retrieval stack is loaded in the background, once
+        if self.conv.retrieval and self.config.get('retrieval_warm_up', True) and not self.warmed_up:
+            self.warmed_up = True
+            from knw_in import warm_up
+            warm_up()
 
     def init_local_cache_path(self, project_cache_path):
         current_fold = time.strftime('%Y-%m-%d', time.localtime())
@@ -41,21 +49,96 @@ class app():
             os.makedirs(session_cache_path)
         return session_cache_path
 
-    def open_board(self):
-        return self.conv.show_data()
+    def view_page(self, source, variable, columns, sort_by, descending, filter_column, filter_op, filter_value, page,
+                  page_size):
+        """
+        One page of the data viewer, filtered, sorted and projected on the server.
+        """
+        page, page_size = max(int(page or 1), 1), max(int(page_size or 100), 1)
+        filters = [(filter_column, filter_op, filter_value)] if filter_column and str(filter_value) != "" else None
+        variable = variable if source == "Kernel variable" else None
+        try:
+            window, total, all_columns = self.conv.view_data(offset=(page - 1) * page_size, limit=page_size,
+                                                             sort_by=sort_by or None, ascending=not descending,
+                                                             filters=filters, columns=columns or None,
+                                                             variable=variable)
+        except Exception as e:
+            print(f"Error in showing data: {e}")
+            return [gr.Dataframe(), f"{e}", gr.Dropdown(), gr.Dropdown(), gr.Dropdown(), page]
+        pages = max((total - 1) // page_size + 1, 1)
+        info = f"Rows {min((page - 1) * page_size + 1, total)}-{min(page * page_size, total)} of {total} (page {page}/{pages})"
+        return [window, info, gr.Dropdown(choices=all_columns), gr.Dropdown(choices=all_columns),
+                gr.Dropdown(choices=all_columns), page]
+
+    def turn_page(self, page, step):
+        return max(int(page or 1) + step, 1)
 
 
     def add_file(self, files):
-        file_path = files.name
+        files = files if isinstance(files, list) else [files]
+        if len(files) > 1:
+            # several files are one dataset, gathered in a folder of the session
+            folder = os.path.join(self.session_cache_path, time.strftime('upload-%H%M%S', time.localtime()))
+            os.makedirs(folder, exist_ok=True)
+            for file in files:
+                shutil.copy(file.name, folder)
+            return self.add_path(folder)
+        file_path = files[0].name
         shutil.copy(file_path, self.session_cache_path)
         filename = os.path.basename(file_path)
         self.conv.add_data(file_path)
         self.conv.file_list.append(filename)
         local_cache_path = os.path.join(self.session_cache_path,filename)
-        gen_info = self.conv.my_data_cache.get_description()
-        self.conv.programmer.messages[0]["content"] += f"\nNow, user uploads the data in {local_cache_path}\n, and here is the general information of the dataset:\n {gen_info}. \nYou should care about the missing values and type of each column in your later processing."
+        self.conv.speculator.add_file(local_cache_path)
+        self.describe_upload(filename, local_cache_path)
         print(f"Upload file in gradio path: {file_path}, local cache path: {local_cache_path}")
 
+    def add_path(self, path):
+        """
+        Load a folder, zip archive or glob pattern of files on the server as one dataset.
+        """
+        path = path.strip().rstrip(os.sep)
+        if not path:
+            return
+        if not self.allowed_path(path):
+            message = f"{path} is outside the data folder of the server, it cannot be loaded."
+            print(message)
+            gr.Warning(message)
+            return
+        self.conv.add_data(path)
+        filename = os.path.basename(path)
+        self.conv.file_list.append(filename)
+        if os.path.exists(path):
+            self.conv.speculator.add_file(path)
+        self.describe_upload(filename, path)
+        print(f"Load dataset from {path}: {len(self.conv.my_data_cache.files)} files")
+
+    def allowed_path(self, path) -> bool:
+        # only the session cache and the configured data_root can be read, after resolving links and '..'
+        roots = [self.session_cache_path] + ([self.config['data_root']] if self.config.get('data_root') else [])
+        roots = [os.path.realpath(root) for root in roots]
+        paths = [path]
+        if glob.has_magic(path):
+            base = path
+            while glob.has_magic(base):
+                base = os.path.dirname(base)
+            paths = [base or '.'] + glob.glob(path, recursive=True)
+        return all(any(os.path.commonpath([os.path.realpath(p), root]) == root for root in roots) for p in paths)
+
+    def describe_upload(self, filename, local_cache_path):
+        gen_info = self.conv.my_data_cache.get_schema(max_tokens=self.config.get('schema_max_tokens', 1500))
+        self.conv.programmer.messages[0]["content"] += f"\nNow, user uploads the data in {local_cache_path}\n, and here is the general information of the dataset:\n{gen_info}\nYou should care about the missing values and type of each column in your later processing."
+        if filename in self.conv.sql_tables:
+            self.conv.programmer.messages[0]["content"] += OUT_OF_CORE_PROMPT.format(
+                filename=filename, table=self.conv.sql_tables[filename],
+                size_mb=os.path.getsize(local_cache_path) // (1024 * 1024))
+        elif self.conv.my_data_cache.columnar_path:
+            self.conv.programmer.messages[0]["content"] += DATA_LOADER_PROMPT.format(filename=filename)
+            if self.config.get('compact_dtypes', False):
+                self.conv.programmer.messages[0]["content"] += COMPACT_PROMPT
+            if self.conv.my_data_cache.shared_memory:
+                self.conv.programmer.messages[0]["content"] += SHARED_DATA_PROMPT.format(filename=filename)
+
     def rendering_code(self):
         return self.conv.rendering_code()
 
@@ -76,6 +159,8 @@ class app():
     def chat_streaming(self, message, chat_history, code=None):
         if not code:
             my_app.conv.programmer.messages.append({"role": "user", "content": message})
+            if self.conv.retrieval:  # the knowledge search overlaps with the preparation of the request
+                self.conv.programmer.start_retrieval(message, self.conv.kernel)
         else:
             message = code
         return "", chat_history + [[message, None]]
@@ -104,9 +189,12 @@ with gr.Blocks(theme=gr.themes.Soft(), css=css, js=js) as demo:
     chatbot = gr.Chatbot(value=my_app.conv.chat_history, height=600, label="LAMBDA", show_copy_button=True)
     with gr.Group():
         with gr.Row():
-            upload_btn = gr.UploadButton(label="Upload Data", file_types=["csv", "xlsx"], scale=1)
+            upload_btn = gr.UploadButton(label="Upload Data", file_types=["csv", "xlsx", "xls", "zip"], file_count="multiple", scale=1)
             msg = gr.Textbox(show_label=False, placeholder="Sent message to LLM", scale=6, elem_id="chatbot_input")
             submit = gr.Button("Submit", scale=1)
+        with gr.Row():
+            data_path = gr.Textbox(show_label=False, placeholder="Or load a folder, zip or glob on the server, e.g. data/sales/2023-*.csv", scale=7)
+            load_btn = gr.Button("Load Data", scale=1)
     with gr.Row():
         board = gr.Button(value="Show/Update DataFrame", elem_id="df_btn", elem_classes="df_btn")
         export_notebook = gr.Button(value="Notebook")
@@ -124,16 +212,50 @@ with gr.Blocks(theme=gr.themes.Soft(), css=css, js=js) as demo:
             code_btn = gr.Button("Submit Code", scale=1)
     code_btn.click(fn=my_app.chat_streaming, inputs=[msg, chatbot, code], outputs=[msg, chatbot]).then(my_app.conv.stream_workflow, inputs=[chatbot, code], outputs=chatbot)
 
-    df = gr.Dataframe(visible=False, elem_id="df", elem_classes="df")
+    with gr.Column(visible=False, elem_id="df", elem_classes="df"):
+        with gr.Row():
+            view_source = gr.Radio(["Uploaded data", "Kernel variable"], value="Uploaded data", label="Source", scale=2)
+            view_variable = gr.Textbox(value="data", label="Variable", scale=1)
+            view_columns = gr.Dropdown(multiselect=True, label="Columns", scale=3)
+            view_sort = gr.Dropdown(label="Sort by", scale=2)
+            view_descending = gr.Checkbox(label="Descending", scale=1)
+        with gr.Row():
+            view_filter_column = gr.Dropdown(label="Filter column", scale=2)
+            view_filter_op = gr.Dropdown(["==", "!=", ">", ">=", "<", "<=", "contains"], value="==", label="Operator", scale=1)
+            view_filter_value = gr.Textbox(label="Value", scale=2)
+            view_page_size = gr.Number(value=my_app.config.get('viewer_page_size', 100), precision=0, label="Rows per page", scale=1)
+            view_page = gr.Number(value=1, precision=0, label="Page", scale=1)
+        with gr.Row():
+            view_prev = gr.Button("Previous")
+            view_info = gr.Markdown()
+            view_next = gr.Button("Next")
+        df = gr.Dataframe()
 
     upload_btn.upload(fn=my_app.add_file, inputs=upload_btn)
+    load_btn.click(fn=my_app.add_path, inputs=data_path)
+    data_path.submit(fn=my_app.add_path, inputs=data_path)
     msg.submit(my_app.chat_streaming, [msg, chatbot], [msg, chatbot], queue=False).then(
         my_app.conv.stream_workflow, chatbot, chatbot
     )
     submit.click(my_app.chat_streaming, [msg, chatbot], [msg, chatbot], queue=False).then(
         my_app.conv.stream_workflow, chatbot, chatbot
     )
-    board.click(my_app.open_board, inputs=[], outputs=df)
+    view_inputs = [view_source, view_variable, view_columns, view_sort, view_descending, view_filter_column,
+                   view_filter_op, view_filter_value, view_page, view_page_size]
+    view_outputs = [df, view_info, view_columns, view_sort, view_filter_column, view_page]
+    board.click(my_app.view_page, inputs=view_inputs, outputs=view_outputs)
+    # a new query starts again from the first page
+    for control in [view_source, view_columns, view_sort, view_descending, view_filter_op, view_page_size]:
+        control.change(lambda: 1, inputs=None, outputs=view_page).then(
+            my_app.view_page, inputs=view_inputs, outputs=view_outputs)
+    for control in [view_variable, view_filter_value]:
+        control.submit(lambda: 1, inputs=None, outputs=view_page).then(
+            my_app.view_page, inputs=view_inputs, outputs=view_outputs)
+    view_page.submit(my_app.view_page, inputs=view_inputs, outputs=view_outputs)
+    view_prev.click(lambda page: my_app.turn_page(page, -1), inputs=view_page, outputs=view_page).then(
+        my_app.view_page, inputs=view_inputs, outputs=view_outputs)
+    view_next.click(lambda page: my_app.turn_page(page, 1), inputs=view_page, outputs=view_page).then(
+        my_app.view_page, inputs=view_inputs, outputs=view_outputs)
     edit.click(my_app.rendering_code, inputs=None, outputs=code)
     export_notebook.click(my_app.export_code, inputs=None, outputs=[export_notebook, down_notebook])
     down_notebook.click(my_app.down_notebook, inputs=None, outputs=[export_notebook, down_notebook])
@@ -141,6 +263,7 @@ with gr.Blocks(theme=gr.themes.Soft(), css=css, js=js) as demo:
     down_report.click(my_app.down_report, inputs=None, outputs=[generate_report, down_report])
     save.click(my_app.save_dialogue, inputs=chatbot)
     clear.click(fn=my_app.clear_all, inputs=[msg, chatbot], outputs=[msg, chatbot])
+    demo.load(my_app.warm_up, inputs=None, outputs=None)
 
 
 if __name__ == '__main__':
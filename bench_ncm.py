@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the Newton-CG kernels of the nearest correlation matrix knowledge (my_gradient, my_jacobian_matrix,
+my_precond_matrix): the vectorized versions of knowledge_integration/ncm.py against the former loop versions,
+kept below as the reference, with the largest difference of their results. With --eig-backends, the eigen
+backends of the solver are compared on the same matrices; with --solve, the whole solver is timed with its peak memory.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import time
+import numpy as np
+from knowledge_integration.ncm import Nearest_Correlation_Matrix
+
+
+def reference_gradient(y_input, lamb, p_input, b_0, n):
+    f = 0.0
+    Fy = np.zeros((n, 1))
+    p_input_copy = (p_input.copy()).transpose()
+    for i in range(0, n):
+        p_input_copy[i, :] = ((np.maximum(lamb[i], 0).astype(float)) ** 0.5) * p_input_copy[i, :]
+    for i in range(0, n):
+        Fy[i] = np.sum(p_input_copy[:, i] * p_input_copy[:, i])
+    for i in range(0, n):
+        f = f + np.square((np.maximum(lamb[i], 0)))
+    f = 0.5 * f - np.dot(b_0.transpose(), y_input)
+    return f, Fy
+
+
+def reference_jacobian_matrix(x, omega_12, p_input, n):
+    x_result = np.zeros((n, 1))
+    [r, s] = omega_12.shape
+    if r > 0:
+        hmat_1 = p_input[:, 0:r].copy()
+        if r < n / 2.0:
+            for i in range(0, n):
+                hmat_1[i, :] = x[i] * hmat_1[i, :]
+            omega_12 = omega_12 * (np.dot(hmat_1.transpose(), p_input[:, r:n]))
+            hmat = np.dot(hmat_1.transpose(), np.dot(p_input[:, 0:r], p_input[:, 0:r].transpose()))
+            hmat = hmat + np.dot(omega_12, p_input[:, r:n].transpose())
+            hmat = np.vstack((hmat, np.dot(omega_12.transpose(), p_input[:, 0:r].transpose())))
+            for i in range(0, n):
+                x_result[i] = np.dot(p_input[i, :], hmat[:, i])
+                x_result[i] = x_result[i] + 1.0e-10 * x[i]
+        elif r == n:
+            x_result = 1.0e-10 * x
+        else:
+            hmat_2 = p_input[:, r:n].copy()
+            for i in range(0, n):
+                hmat_2[i, :] = x[i] * hmat_2[i, :]
+            omega_12 = np.ones((r, s)) - omega_12
+            omega_12 = omega_12 * (np.dot(p_input[:, 0:r].transpose(), hmat_2))
+            hmat = np.dot(p_input[:, r:n].transpose(), hmat_2)
+            hmat = np.dot(hmat, p_input[:, r:n].transpose())
+            hmat = hmat + np.dot(omega_12.transpose(), p_input[:, 0:r].transpose())
+            hmat = np.vstack((np.dot(omega_12, p_input[:, r:n].transpose()), hmat))
+            for i in range(0, n):
+                x_result[i] = np.dot(-p_input[i, :], hmat[:, i])
+                x_result[i] = x[i] + x_result[i] + 1.0e-10 * x[i]
+    return x_result
+
+
+def reference_precond_matrix(omega_12, p_input, n):
+    [r, s] = omega_12.shape
+    c = np.ones((n, 1))
+    if r > 0:
+        hmat = (p_input.copy()).transpose()
+        hmat = hmat * hmat
+        if r < n / 2.0:
+            hmat_12 = np.dot(hmat[0:r, :].transpose(), omega_12)
+            d = np.ones((r, 1))
+            for i in range(0, n):
+                c_temp = np.dot(d.transpose(), hmat[0:r, i])
+                c_temp = c_temp * hmat[0:r, i]
+                c[i] = np.sum(c_temp)
+                c[i] = c[i] + 2.0 * np.dot(hmat_12[i, :], hmat[r:n, i])
+                if c[i] < 1.0e-8:
+                    c[i] = 1.0e-8
+        elif r < n:
+            omega_12 = np.ones((r, s)) - omega_12
+            hmat_12 = np.dot(omega_12, hmat[r:n, :])
+            d = np.ones((s, 1))
+            dd = np.ones((n, 1))
+            for i in range(0, n):
+                c_temp = np.dot(d.transpose(), hmat[r:n, i])
+                c[i] = np.sum(c_temp * hmat[r:n, i])
+                c[i] = c[i] + 2.0 * np.dot(hmat[0:r, i].transpose(), hmat_12[:, i])
+                alpha = np.sum(hmat[:, i])
+                c[i] = alpha * np.dot(hmat[:, i].transpose(), dd) - c[i]
+                if c[i] < 1.0e-8:
+                    c[i] = 1.0e-8
+    return c
+
+
+def load_kernels() -> dict:
+    # the runnable code is what the kernel executes, so the benchmark runs exactly that code
+    namespace = {}
+    exec(Nearest_Correlation_Matrix().get_runnable_function(), namespace)
+    return namespace
+
+
+def best_time(function, *args, repeat=3) -> tuple:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def max_difference(a, b) -> float:
+    a, b = np.asarray(a, dtype=float).ravel(), np.asarray(b, dtype=float).ravel()
+    return float(np.max(np.abs(a - b)) / max(1.0, float(np.max(np.abs(b)))))
+
+
+def benchmark(kernels: dict, n: int, shift: float, repeat: int, seed: int = 0) -> dict:
+    """
+    Time the three kernels on a random symmetric matrix with unit diagonal, shifted by shift * I to move the
+    number r of positive eigenvalues below or above n / 2 (the two branches of the kernels).
+    """
+    rng = np.random.default_rng(seed)
+    g = rng.standard_normal((n, n))
+    g = (g + g.transpose()) / 2.0
+    g = g - np.diag(np.diag(g)) + np.eye(n) + shift * np.eye(n)
+    p_x, lamb = kernels['my_mexeig'](g)
+    omega_12 = kernels['my_omega_mat'](p_x, lamb, n)
+    y, b, x = rng.standard_normal((n, 1)), np.ones((n, 1)), rng.standard_normal((n, 1))
+    report = {"n": n, "r": int(omega_12.shape[0])}
+    cases = {
+        "gradient": (reference_gradient, kernels['my_gradient'], (y, lamb, p_x, b, n)),
+        "jacobian": (reference_jacobian_matrix, kernels['my_jacobian_matrix'], (x, omega_12, p_x, n)),
+        "precond": (reference_precond_matrix, kernels['my_precond_matrix'], (omega_12, p_x, n)),
+    }
+    for name, (reference, vectorized, args) in cases.items():
+        old_time, old = best_time(reference, *args, repeat=repeat)
+        new_time, new = best_time(vectorized, *args, repeat=repeat)
+        if name == "gradient":
+            difference = max(max_difference(old[0], new[0]), max_difference(old[1], new[1]))
+        else:
+            difference = max_difference(old, new)
+        report[name] = {"loop_ms": 1000 * old_time, "vectorized_ms": 1000 * new_time,
+                        "speedup": old_time / new_time, "max_rel_difference": difference}
+    return report
+
+
+def benchmark_eig(kernels: dict, n: int, backends: list, repeat: int, seed: int = 0) -> dict:
+    # time of my_mexeig with each backend and the largest residual |A p - lamb p| of its eigenpairs
+    rng = np.random.default_rng(seed)
+    g = rng.standard_normal((n, n))
+    g = (g + g.transpose()) / 2.0
+    report = {"n": n}
+    for backend in backends:
+        eig_time, (p_x, lamb) = best_time(kernels['my_mexeig'], g, kernels['my_eig_backend'](backend), repeat=repeat)
+        residual = np.max(np.abs(np.dot(g, p_x) - p_x * lamb.reshape(1, n))) / np.max(np.abs(lamb))
+        report[backend] = {"eig_ms": 1000 * eig_time, "max_rel_residual": float(residual)}
+    return report
+
+
+def benchmark_solve(kernels: dict, n: int, backend: str, seed: int = 0) -> dict:
+    # the solver on the random matrix of its example, with the statistics of full_output
+    rng = np.random.default_rng(seed)
+    g = rng.standard_normal((n, n))
+    g = (g + g.transpose()) / 2.0
+    g = g - np.diag(np.diag(g)) + np.eye(n)
+    kernels['WORKSPACE_SETTINGS']['trace_memory'] = True
+    with contextlib.redirect_stdout(io.StringIO()):
+        x, y, info = kernels['NearestCorrelationMatrix'](g, np.ones((n, 1)), 0, 1.0e-6, eig_backend=backend,
+                                                         full_output=True, overwrite_g=True)
+    info["n"] = n
+    info["min_eigenvalue"] = float(np.linalg.eigvalsh(x)[0])
+    return info
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the vectorized Newton-CG kernels of the NCM knowledge.")
+    parser.add_argument('--n', type=int, nargs='+', default=[250, 500, 1000, 2000, 3000], help='matrix sizes')
+    parser.add_argument('--shifts', type=float, nargs='+', default=[-3.0, 3.0],
+                        help='diagonal shifts, negative for r < n/2 and positive for r >= n/2')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per kernel, the best one is reported')
+    parser.add_argument('--eig-backends', nargs='+', help='compare these eigen backends (numpy, scipy, float32)')
+    parser.add_argument('--solve', action='store_true', help='run the whole solver with each eigen backend')
+    parser.add_argument('--output', help='write the report as JSON')
+    args = parser.parse_args()
+
+    kernels = load_kernels()
+    reports = []
+    for n in args.n:
+        if args.solve:
+            for backend in args.eig_backends or ['scipy']:
+                report = benchmark_solve(kernels, n, backend)
+                reports.append(report)
+                print(f"n={n:5d} {backend}: {report['time']:.2f} s, eigen {report['eig_time']:.2f} s in "
+                      f"{report['eig_calls']} calls, {report['iterations']} iterations, peak memory "
+                      f"{report['peak_memory_mb']:.0f} MB ({report['peak_memory_mb'] * 2 ** 20 / (8 * n * n):.1f} n^2 floats)")
+            continue
+        if args.eig_backends:
+            report = benchmark_eig(kernels, n, args.eig_backends, args.repeat)
+            reports.append(report)
+            print(f"n={n:5d} " + "  ".join(f"{backend}: {report[backend]['eig_ms']:8.1f} ms "
+                                           f"(residual {report[backend]['max_rel_residual']:.1e})"
+                                           for backend in args.eig_backends))
+            continue
+        for shift in args.shifts:
+            # the shift is scaled with the spectrum radius (about sqrt(2n)) of the random matrix
+            report = benchmark(kernels, n, shift * np.sqrt(n / 2.0) / 3.0, args.repeat)
+            reports.append(report)
+            print(f"n={n:5d} r={report['r']:5d} " + "  ".join(
+                f"{name}: {report[name]['loop_ms']:9.1f} -> {report[name]['vectorized_ms']:7.1f} ms "
+                f"(x{report[name]['speedup']:.1f}, diff {report[name]['max_rel_difference']:.1e})"
+                for name in ("gradient", "jacobian", "precond")))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the approximate profile of cache/profile.py (profile_frame with sketches) against the exact profile
+of an in-memory dataset (describe, nunique and value_counts of every column), on a random DataFrame with numeric,
+integer and string columns. The frequent values of the sketches (Misra-Gries on hashes) are also compared with
+the former exact value_counts of every chunk, kept below as the reference.
+"""
+
+import argparse
+import json
+import time
+import numpy as np
+import pandas as pd
+from cache.profile import profile_frame
+from cache.sketch import ColumnSketch
+
+
+class ReferenceTopK:
+    # frequent values as an exact value_counts of every chunk, merged and cut to 10 * top_k
+    def __init__(self, top_k=5):
+        self.top_k = top_k
+        self.counts = pd.Series(dtype=np.int64)
+
+    def update(self, column: pd.Series):
+        counts = column.dropna().value_counts()
+        self.counts = self.counts.add(counts, fill_value=0).nlargest(10 * self.top_k).astype(np.int64)
+
+    def top(self) -> pd.Series:
+        return self.counts.head(self.top_k)
+
+
+def make_frame(rows: int, columns: int, seed: int = 0) -> pd.DataFrame:
+    # floats (all distinct), integers of low and high cardinality and strings, in turn
+    rng = np.random.default_rng(seed)
+    data = {}
+    for i in range(columns):
+        kind = i % 4
+        if kind == 0:
+            data[f"float{i}"] = rng.standard_normal(rows)
+        elif kind == 1:
+            data[f"code{i}"] = rng.integers(0, 100, rows)
+        elif kind == 2:
+            data[f"id{i}"] = rng.integers(0, rows, rows)
+        else:
+            data[f"label{i}"] = pd.Series(rng.zipf(1.5, rows) % 1000).astype(str).to_numpy(dtype=object)
+    return pd.DataFrame(data)
+
+
+def exact_profile(data: pd.DataFrame) -> dict:
+    return {"describe": data.describe(), "unique": data.nunique(),
+            "top": {name: data[name].value_counts().head(5) for name in data.columns}}
+
+
+def best_time(function, *args, repeat=3) -> tuple:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def top_k_time(sketch_class, data: pd.DataFrame, chunk_rows: int) -> float:
+    start = time.perf_counter()
+    for name in data.columns:
+        sketch = sketch_class()
+        for offset in range(0, len(data), chunk_rows):
+            sketch.update(data[name].iloc[offset:offset + chunk_rows])
+    return time.perf_counter() - start
+
+
+def benchmark(rows: int, columns: int, chunk_rows: int, repeat: int) -> dict:
+    data = make_frame(rows, columns)
+    exact_time, exact = best_time(exact_profile, data, repeat=repeat)
+    sketch_time, profile = best_time(profile_frame, data, chunk_rows, 10000, {"top_k": 5}, repeat=repeat)
+    # the largest relative error of the top count of each column
+    errors = [abs(int(profile.top_values(name).iloc[0]) - int(exact["top"][name].iloc[0])) / len(data)
+              for name in data.columns if len(profile.top_values(name))]
+    return {"rows": rows, "columns": columns, "exact_s": exact_time, "sketch_s": sketch_time,
+            "speedup": exact_time / sketch_time, "top_k_reference_s": top_k_time(ReferenceTopK, data, chunk_rows),
+            "top_k_sketch_s": top_k_time(ColumnSketch, data, chunk_rows),
+            "max_top_count_error": max(errors) if errors else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the approximate dataset profile against the exact one.")
+    parser.add_argument('--rows', type=int, nargs='+', default=[500000, 2000000], help='numbers of rows')
+    parser.add_argument('--columns', type=int, default=10, help='number of columns')
+    parser.add_argument('--chunk-rows', type=int, default=1000000, help='rows per chunk of profile_frame')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per profile, the best one is reported')
+    parser.add_argument('--output', help='write the report as JSON')
+    args = parser.parse_args()
+
+    reports = []
+    for rows in args.rows:
+        report = benchmark(rows, args.columns, args.chunk_rows, args.repeat)
+        reports.append(report)
+        print(f"{rows}x{args.columns}: exact {report['exact_s']:.2f} s, sketches {report['sketch_s']:.2f} s "
+              f"(x{report['speedup']:.1f}); top-k {report['top_k_reference_s']:.2f} -> "
+              f"{report['top_k_sketch_s']:.2f} s, top count error {report['max_top_count_error']:.1e}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,218 @@
 import pandas as pd
 import os
 import shutil
+import threading
+from cache.schema import fingerprint_file, settings_fingerprint, get_schema, encode_schema
+from cache.profile import StreamingProfile, SavedProfile, profile_frame
+from cache.columnar import convert_in_background, convert_csv, columnar_path, open_columnar, open_dataset, read_head, pa
+from cache.store import DatasetStore
+from cache.excel import is_excel, read_excel_sheets
+from cache.loader import compact
+from cache.viewer import TableView, DatasetView, view_page
+from cache.multifile import is_multifile, expand_files, fingerprint_files, read_partitions, write_partitioned
 
 
 class data_cache:
 
-    def __init__(self, file_path) -> None:
+    def __init__(self, file_path, streaming_threshold_mb=200, chunk_rows=100000, sample_rows=10000,
+                 shared_memory=False, store: DatasetStore = None, sketch: dict = None, approx_min_cells=50000000,
+                 excel_workers=4, compact_dtypes=False, file_workers=4, schema_max_tokens=1500,
+                 columnar_format='parquet') -> None:
         self.file_path = file_path
         self.data_cache_path = os.path.dirname(file_path)
-        self.data = pd.read_csv(self.file_path, encoding='utf-8')
         self.general_info = {}
+        # a zip archive, folder or glob of files is one logical table
+        self.files = []
+        self.partition_columns = []
+        self.schema_issues = []
+        if is_multifile(file_path):
+            self.root, self.files = expand_files(file_path)
+            self.fingerprint = fingerprint_files(self.files)
+        else:
+            self.fingerprint = fingerprint_file(self.file_path)
+        # the profile, columnar copy and schema depend on these settings as well as on the content
+        self.fingerprint = settings_fingerprint(self.fingerprint, {
+            "compact_dtypes": compact_dtypes, "sketch": sketch, "approx_min_cells": approx_min_cells,
+            "columnar_format": columnar_format, "shared_memory": shared_memory})
+        self.columnar_format = columnar_format
+        self.profile = None
+        self.columnar_path = None
+        self.shared_memory = shared_memory
+        self.table = None
+        self._data = None
+        self.store = store
+        self.sketch = sketch
+        self.approx_min_cells = approx_min_cells
+        self.sample_rows = sample_rows
+        self.schema_max_tokens = schema_max_tokens
+        self.summary_profile = None
+        self.sheets = {}
+        self.sheet_paths = {}
+        self.viewer = None
+        cached = store.lookup(self.fingerprint) if store else None
+        self.from_store = cached is not None
+        if self.from_store:
+            # the same content was uploaded before: reuse its columnar copy and profile instead of parsing the file
+            self.columnar_path = cached["columnar"]
+            self.general_info = cached["profile"] or {}
+            self.sheet_paths = cached.get("sheets") or {}
+            print(f"Dataset cache hit for {file_path}: {self.columnar_path}")
+        elif self.files:
+            self.data, self.partition_columns, self.schema_issues = read_partitions(self.root, self.files,
+                                                                                    workers=file_workers)
+            if compact_dtypes:
+                self.data = compact(self.data)
+        elif is_excel(file_path):
+            # every sheet of a workbook is a table, the first one is the main dataset
+            self.sheets = read_excel_sheets(file_path, workers=excel_workers)
+            if compact_dtypes:
+                self.sheets = {sheet: compact(frame) for sheet, frame in self.sheets.items()}
+            self.data = next(iter(self.sheets.values()))
+        elif os.path.getsize(file_path) > streaming_threshold_mb * 1024 * 1024:
+            # large files are read in chunks in the background, the profile is refined with every chunk
+            self.profile = StreamingProfile(sample_size=sample_rows, sketch=sketch)
+            self.first_chunk = threading.Event()
+            self.reader = threading.Thread(target=self.read_chunks, args=(chunk_rows,), daemon=True)
+            self.reader.start()
+            self.first_chunk.wait()
+        else:
+            self.data = pd.read_csv(self.file_path, encoding='utf-8')
+            if compact_dtypes:
+                self.data = compact(self.data)
+
+    def read_chunks(self, chunk_rows):
+        try:
+            for chunk in pd.read_csv(self.file_path, encoding='utf-8', chunksize=chunk_rows):
+                self.profile.update(chunk)
+                self.first_chunk.set()
+            self.profile.finish()
+            print(f"Profiling of {self.file_path} completed: {self.profile.rows} rows.")
+            if self.store:
+                # a later upload of the same file is described from these without reading it
+                self.store.save_profile(self.fingerprint, get_profile_info(self.profile))
+                self.store.save_schema(self.fingerprint, self.schema_max_tokens,
+                                       get_schema(self.data, self.fingerprint, max_tokens=self.schema_max_tokens,
+                                                  profile=self.profile))
+        except Exception as e:
+            print(f"Error in reading {self.file_path}: {e}")
+        finally:
+            self.first_chunk.set()
+
+    @property
+    def streaming(self) -> bool:
+        return self.profile is not None
+
+    @property
+    def data(self) -> pd.DataFrame:
+        # in streaming mode, the data is a reservoir sample of the rows read so far
+        if self.streaming:
+            return self.profile.sample
+        if self.attach() and self._data is None:
+            # converted once, numeric columns without nulls are zero-copy views of the memory-mapped file
+            self._data = self.table.to_pandas(split_blocks=True)
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+
+    def to_columnar(self, cache_dir, fmt=None):
+        fmt = fmt or self.columnar_format
+        if self.from_store:
+            return self.columnar_path
+        if self.store:
+            cache_dir = self.store.entry_dir(self.fingerprint)
+        if self.sheets:
+            return self.sheets_to_columnar(cache_dir, fmt)
+        if self.files:
+            return self.partitions_to_columnar(cache_dir)
+        if self.shared_memory and not self.streaming:
+            # materialize once as Arrow IPC, then release the DataFrame and share the memory-mapped file
+            self.columnar_path = convert_shared(self.file_path, columnar_path(self.file_path, cache_dir, 'arrow'),
+                                                self._data)
+            self.attach()
+            return self.columnar_path
+        # the parsed data is converted directly, large files are streamed from the csv
+        self.columnar_path = convert_in_background(self.file_path, cache_dir, fmt,
+                                                   data=None if self.streaming else self.data)
+        return self.columnar_path
+
+    def sheets_to_columnar(self, cache_dir, fmt='parquet'):
+        # each sheet is converted once to its own columnar file
+        for sheet, frame in self.sheets.items():
+            if self.shared_memory:
+                target = columnar_path(self.file_path, cache_dir, 'arrow', sheet)
+                self.sheet_paths[sheet] = convert_shared(self.file_path, target, frame)
+            else:
+                self.sheet_paths[sheet] = convert_in_background(self.file_path, cache_dir, fmt, data=frame, sheet=sheet)
+        if self.store:
+            self.store.save_sheets(self.fingerprint, self.sheet_paths)
+        self.columnar_path = next(iter(self.sheet_paths.values()))
+        if self.shared_memory and self.columnar_path:
+            self.attach()
+        return self.columnar_path
+
+    def partitions_to_columnar(self, cache_dir):
+        # written at once (the files are already parsed) as a Parquet dataset partitioned in folders
+        if pa is None:
+            print("pyarrow is not installed, the columnar cache is disabled.")
+            return None
+        target = os.path.splitext(columnar_path(self.file_path.rstrip(os.sep).replace('*', '_'), cache_dir))[0]
+        self.columnar_path = write_partitioned(self.data, target, self.partition_columns)
+        print(f"Columnar cache of {len(self.files)} files written in {self.columnar_path}")
+        self.attach()
+        return self.columnar_path
+
+    def attach(self) -> bool:
+        """
+        Attach to the columnar file of the dataset, once it is written, in shared memory mode or when the
+        dataset comes from the dataset cache. Arrow files are memory-mapped read-only.
+        """
+        if self.table is None and (self.shared_memory or self.from_store) and self.columnar_path \
+                and os.path.exists(self.columnar_path):
+            self.table = open_columnar(self.columnar_path)
+            self._data = None
+        return self.table is not None
+
+    def view(self, offset=0, limit=100, sort_by=None, ascending=True, filters=None, columns=None):
+        """
+        Window of rows for the data viewer, read from the columnar copy once it is written (the whole file, also
+        for streamed uploads), else from the data in memory. Return the window and the number of matching rows.
+        Arrow files are memory-mapped, Parquet files are read by row groups.
+        """
+        if self.viewer is None and self.columnar_path and os.path.exists(self.columnar_path):
+            if self.table is not None or self.columnar_path.endswith('.arrow'):
+                self.viewer = TableView(self.table if self.attach() else open_columnar(self.columnar_path))
+            else:
+                self.viewer = DatasetView(open_dataset(self.columnar_path))
+        return view_page(self.viewer if self.viewer is not None else self.data, offset, limit, sort_by, ascending,
+                         filters, columns)
+
+    def approximate(self) -> StreamingProfile | None:
+        """
+        Approximate profile (sketches) of an in-memory dataset with more than approx_min_cells cells, else None.
+        """
+        if self.summary_profile is None and self.sketch and not self.streaming and not self.from_store:
+            data = self.data
+            if data.shape[0] * data.shape[1] > self.approx_min_cells:
+                self.summary_profile = profile_frame(data, sketch=self.sketch)
+        return self.summary_profile
 
     def get_description(self) -> dict:
         # self.general_info["info"] = get_info(self.data)
+        if self.from_store:
+            if not self.general_info:  # the first rows of the columnar copy, not the whole table
+                sample, rows = read_head(self.columnar_path, self.sample_rows)
+                self.general_info = get_general_info(sample)
+                self.general_info["num_rows"] = rows
+                self.general_info["describe"] = sample.describe()
+            return self.general_info
+        if self.streaming or self.approximate():
+            general_info = get_profile_info(self.profile or self.summary_profile)
+            self.general_info.update(general_info)
+            if self.store and general_info["complete"]:
+                self.store.save_profile(self.fingerprint, self.general_info)
+            return self.general_info
         general_info = get_general_info(self.data)
         self.general_info["num_rows"], self.general_info["num_features"], self.general_info["features"], \
             self.general_info["col_type"], self.general_info["missing_val"] = general_info["num_rows"], \
@@ -21,10 +221,78 @@ class data_cache:
 
         self.general_info["describe"] = self.data.describe()
         # self.general_info["label_counts"] = self.data["label"].value_counts()
+        if len(self.sheets) > 1:
+            self.general_info["sheets"] = {sheet: get_general_info(frame) for sheet, frame in self.sheets.items()}
+        if self.store:
+            self.store.save_profile(self.fingerprint, self.general_info)
         return self.general_info
 
+    def get_schema(self, max_tokens=1500) -> str:
+        schema = self.store.load_schema(self.fingerprint, max_tokens) if self.store else None
+        if schema is not None:
+            return schema
+        if self.from_store:
+            schema = self.cached_schema(max_tokens)
+        elif self.streaming:
+            if not self.profile.complete:  # not cached until the whole file is profiled
+                return encode_schema(self.data, max_tokens=max_tokens, profile=self.profile)
+            schema = get_schema(self.data, self.fingerprint, max_tokens=max_tokens, profile=self.profile)
+        elif len(self.sheets) > 1:
+            schema = self.sheets_schema(max_tokens)
+        elif self.files:
+            schema = self.partitions_header() + get_schema(self.data, self.fingerprint, max_tokens=max_tokens)
+        elif self.approximate():
+            schema = get_schema(self.summary_profile.sample, self.fingerprint, max_tokens=max_tokens,
+                                profile=self.summary_profile)
+        else:
+            schema = get_schema(self.data, self.fingerprint, max_tokens=max_tokens)
+        if self.store:
+            self.store.save_schema(self.fingerprint, max_tokens, schema)
+        return schema
+
+    def cached_schema(self, max_tokens=1500) -> str:
+        # schema of a dataset cache hit from its saved profile and the first rows of its columnar copy
+        sample, rows = read_head(self.columnar_path, self.sample_rows)
+        if self.general_info:
+            return encode_schema(sample, max_tokens=max_tokens, profile=SavedProfile(self.general_info))
+        return f"rows={rows} in total, the statistics below are of the first {len(sample)} rows\n" + \
+            encode_schema(sample, max_tokens=max_tokens)
+
+    def sheets_schema(self, max_tokens=1500) -> str:
+        # one table per sheet, the token budget is shared evenly
+        budget = max_tokens // len(self.sheets)
+        name = os.path.basename(self.file_path)
+        tables = [f"Sheet {sheet!r} (load_data({name!r}, sheet={sheet!r})):\n"
+                  f"{get_schema(frame, f'{self.fingerprint}:{sheet}', max_tokens=budget)}"
+                  for sheet, frame in self.sheets.items()]
+        return f"Workbook with {len(self.sheets)} sheets, the first one is the main table.\n" + "\n\n".join(tables)
+
+    def partitions_header(self) -> str:
+        header = f"One logical table combining {len(self.files)} files of {self.root}, " \
+                 f"partition columns: {', '.join(self.partition_columns)}.\n"
+        if self.schema_issues:
+            header += "Schema inconsistencies between files: " + "; ".join(self.schema_issues[:10]) + "\n"
+        return header
+
+
+def convert_shared(file_path, target, data: pd.DataFrame):
+    # the upload goes on with the DataFrame in memory when the Arrow file cannot be written
+    if pa is None:
+        print("pyarrow is not installed, the shared memory mode is disabled.")
+        return None
+    try:
+        return convert_csv(file_path, target, 'arrow', data=data)
+    except Exception as e:
+        print(f"Error in converting {file_path} to columnar format: {e}")
+        return None
+
 
 def get_general_info(data: pd.DataFrame):
     return {"num_rows": data.shape[0], "num_features": data.shape[1], "features": data.columns,
             "col_type": data.dtypes, "missing_val": data.isnull().sum()}
 
+
+def get_profile_info(profile: StreamingProfile):
+    return {"num_rows": profile.rows, "num_features": len(profile.columns), "features": profile.columns,
+            "col_type": profile.col_types(), "missing_val": profile.null_counts(), "describe": profile.describe(),
+            "unique": profile.unique_counts(), "complete": profile.complete}
@@ -0,0 +1,143 @@
+import os
+import re
+import threading
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.dataset as pa_ds
+    import pyarrow.parquet as pq
+except ImportError:  # the columnar cache is optional
+    pa = None
+
+COLUMNAR_DIR = '.columnar'
+LOADER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'loader.py')
+CSV_COLUMN_ERROR = re.compile(r'In CSV column #(\d+)')
+
+
+def columnar_path(file_path, cache_dir, fmt='parquet', sheet=None) -> str:
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    if sheet is not None:  # one file per sheet of a workbook
+        name = name + '-' + re.sub(r'[^\w.-]', '_', str(sheet))
+    return os.path.join(cache_dir, COLUMNAR_DIR, f"{name}.{'parquet' if fmt == 'parquet' else 'arrow'}")
+
+
+def open_writer(path, schema, fmt):
+    if fmt == 'parquet':
+        return pq.ParquetWriter(path, schema)
+    return pa.ipc.new_file(path, schema)
+
+
+def write_table(table, path, fmt='parquet'):
+    with open_writer(path, table.schema, fmt) as writer:
+        writer.write_table(table)
+
+
+def convert_csv(file_path, target, fmt='parquet', data: pd.DataFrame = None):
+    """
+    Convert a csv file once to a columnar file (Parquet or uncompressed Arrow IPC). The csv is streamed block by
+    block unless the parsed DataFrame is given. The file is written under a temporary name and renamed when
+    complete, so readers never see a partial file.
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    partial = target + '.partial'
+    if data is not None:
+        write_table(pa.Table.from_pandas(data, preserve_index=False), partial, fmt)
+    else:
+        stream_csv(file_path, partial, fmt)
+    os.replace(partial, target)
+    return target
+
+
+def stream_csv(file_path, path, fmt='parquet'):
+    # the types are inferred from the first block; when a later row does not fit, the offending column is read
+    # as string and the file is streamed again, so memory stays bounded by one block
+    column_types = {}
+    while True:
+        reader = pa_csv.open_csv(file_path, convert_options=pa_csv.ConvertOptions(column_types=column_types))
+        names = reader.schema.names
+        try:
+            with open_writer(path, reader.schema, fmt) as writer:
+                for batch in reader:
+                    writer.write_batch(batch)
+            return path
+        except pa.ArrowInvalid as e:
+            match = CSV_COLUMN_ERROR.search(str(e))
+            if match is None or names[int(match.group(1))] in column_types:
+                # not a conversion error of a single column: every column is read as string
+                if len(column_types) == len(names):
+                    raise
+                column = None
+                column_types = {name: pa.string() for name in names}
+            else:
+                column = names[int(match.group(1))]
+                column_types[column] = pa.string()
+            print(f"Streaming conversion of {file_path} failed ({e}), "
+                  f"read {column if column else 'all columns'} as string.")
+
+
+def convert_in_background(file_path, cache_dir, fmt='parquet', data: pd.DataFrame = None, sheet=None):
+    """
+    Start the conversion in a thread, return the path of the columnar file (None if pyarrow is not installed).
+    """
+    if pa is None:
+        print("pyarrow is not installed, the columnar cache is disabled.")
+        return None
+    target = columnar_path(file_path, cache_dir, fmt, sheet)
+
+    def run():
+        try:
+            convert_csv(file_path, target, fmt, data)
+            print(f"Columnar cache of {file_path} written in {target}")
+        except Exception as e:
+            print(f"Error in converting {file_path} to columnar format: {e}")
+
+    threading.Thread(target=run, daemon=True).start()
+    return target
+
+
+def open_memory_map(path):
+    # the table references the pages of the file, nothing is copied into the process
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+
+def open_columnar(path):
+    if path.endswith('.arrow'):
+        return open_memory_map(path)
+    return pq.read_table(path, memory_map=True)
+
+
+def open_dataset(path):
+    # lazy dataset of a columnar file or of a partitioned folder, nothing is read until it is scanned
+    return pa_ds.dataset(path, format='ipc' if path.endswith('.arrow') else 'parquet', partitioning='hive')
+
+
+def read_head(path, rows=10000) -> tuple:
+    # the first rows of a columnar file as a DataFrame and the total row count, from the metadata
+    dataset = open_dataset(path)
+    return dataset.head(rows).to_pandas(), dataset.count_rows()
+
+
+def table_name(file_path) -> str:
+    # SQL identifier of an out-of-core dataset
+    name = re.sub(r'\W', '_', os.path.splitext(os.path.basename(file_path))[0]).lower()
+    return name if name and not name[0].isdigit() else f"t_{name}"
+
+
+def sql_table_code(name, table, settings: dict) -> str:
+    # code run in the kernel, after register_code, to query a dataset out of core with sql()
+    return f"LAMBDA_SQL_SETTINGS.update({settings!r})\nregister_table({table!r}, {name!r})"
+
+
+def kernel_helpers(compact_dtypes=False) -> str:
+    with open(LOADER_PATH, 'r', encoding='utf-8') as f:
+        return f.read() + f"\nLAMBDA_COMPACT = {bool(compact_dtypes)}\n"
+
+
+def register_code(name, file_path, columnar_file, sheets: dict = None) -> str:
+    # code run in the kernel to register an uploaded dataset for load_data(), sheets maps the sheets of a workbook
+    # to their columnar files
+    sheets = {sheet: os.path.abspath(path) if path else None for sheet, path in (sheets or {}).items()}
+    return f"LAMBDA_DATASETS[{name!r}] = {{'path': {os.path.abspath(file_path)!r}, " \
+           f"'columnar': {os.path.abspath(columnar_file) if columnar_file else None!r}, 'sheets': {sheets!r}}}"
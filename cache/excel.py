@@ -0,0 +1,56 @@
+import os
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import python_calamine  # Rust reader, much faster than openpyxl
+    EXCEL_ENGINE = 'calamine'
+except ImportError:
+    try:
+        import openpyxl
+        EXCEL_ENGINE = 'openpyxl'
+    except ImportError:
+        EXCEL_ENGINE = None
+
+EXCEL_EXTENSIONS = ('.xlsx', '.xlsm', '.xls')
+OPENPYXL_EXTENSIONS = ('.xlsx', '.xlsm')  # openpyxl does not read the binary .xls format
+
+
+def is_excel(file_path) -> bool:
+    return os.path.splitext(file_path)[1].lower() in EXCEL_EXTENSIONS
+
+
+def check_engine(file_path):
+    extension = os.path.splitext(file_path)[1].lower()
+    if EXCEL_ENGINE is None:
+        raise ValueError(f"Cannot read {os.path.basename(file_path)}: Excel files need python-calamine or openpyxl "
+                         f"(pip install python-calamine).")
+    if EXCEL_ENGINE == 'openpyxl' and extension not in OPENPYXL_EXTENSIONS:
+        raise ValueError(f"Cannot read {os.path.basename(file_path)}: {extension} workbooks need python-calamine "
+                         f"(pip install python-calamine), openpyxl only reads {', '.join(OPENPYXL_EXTENSIONS)}.")
+
+
+def sheet_names(file_path) -> list:
+    with pd.ExcelFile(file_path, engine=EXCEL_ENGINE) as book:
+        return book.sheet_names
+
+
+def read_sheet(file_path, sheet) -> pd.DataFrame:
+    return pd.read_excel(file_path, sheet_name=sheet, engine=EXCEL_ENGINE)
+
+
+def read_excel_sheets(file_path, workers=4) -> dict:
+    """
+    Read all sheets of a workbook into {sheet name: DataFrame}, with the calamine engine if installed. Sheets are
+    parsed in parallel processes when there are several of them and workers > 1; empty sheets are skipped.
+    """
+    check_engine(file_path)
+    names = sheet_names(file_path)
+    if workers > 1 and len(names) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(names))) as pool:
+            frames = list(pool.map(read_sheet, [file_path] * len(names), names))
+    else:
+        frames = [read_sheet(file_path, name) for name in names]
+    sheets = {name: frame for name, frame in zip(names, frames) if not frame.empty} or dict(zip(names, frames))
+    print(f"Read {len(sheets)} sheet(s) of {file_path} with {EXCEL_ENGINE}: {list(sheets)}")
+    return sheets
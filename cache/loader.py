@@ -0,0 +1,206 @@
+# Helpers defined in the kernel at startup, see cache/columnar.py. Keep this file self-contained.
+import importlib.util
+import os
+import re
+import numpy as np
+import pandas as pd
+
+LAMBDA_DATASETS = {}
+LAMBDA_COMPACT = False  # compact the DataFrames returned by load_data
+LAMBDA_TABLES = {}  # out-of-core datasets queried with sql()
+LAMBDA_SQL_SETTINGS = {}
+LAMBDA_SQL = None
+
+
+def compact(data, max_category_ratio=0.5, parse_dates=True, date_formats=None, report=True):
+    """
+    Shrink the memory of a DataFrame in place and return it: 64-bit integers are narrowed to int32 and floats to
+    float32 when no value changes, text columns of ISO dates (or of one of the strftime date_formats) are parsed,
+    text columns with few distinct values (at most max_category_ratio of the rows) become categoricals.
+    """
+    before = data.memory_usage(deep=True).sum()
+    for name in data.columns:
+        column = data[name]
+        if pd.api.types.is_bool_dtype(column.dtype):
+            continue
+        if pd.api.types.is_integer_dtype(column.dtype):
+            # signed with at least 32 bits, so that arithmetic on the column does not wrap around
+            info = np.iinfo(np.int32)
+            values = column.dropna()
+            if not len(values):
+                continue
+            if column.dtype.itemsize > 4 and info.min <= values.min() and values.max() <= info.max:
+                data[name] = column.astype('Int32' if pd.api.types.is_extension_array_dtype(column.dtype) else np.int32)
+        elif pd.api.types.is_float_dtype(column.dtype) and column.dtype != np.float32:
+            values = column.to_numpy(dtype=float, na_value=np.nan)
+            small = values.astype(np.float32)
+            if np.array_equal(small.astype(float), values, equal_nan=True):
+                data[name] = small
+        elif column.dtype == object or pd.api.types.is_string_dtype(column.dtype):
+            values = column.dropna()
+            if not len(values):
+                continue
+            date_format = date_column_format(values, date_formats) if parse_dates else None
+            if date_format is not None:
+                dates = pd.to_datetime(column, errors='coerce', format=date_format)
+                if dates.notna().sum() == len(values):  # no value is lost
+                    data[name] = dates
+                    continue
+            if values.nunique() <= max_category_ratio * len(column):
+                data[name] = column.astype('category')
+    after = data.memory_usage(deep=True).sum()
+    if report:
+        print(f"Memory: {before / 2 ** 20:.2f} MB -> {after / 2 ** 20:.2f} MB ({before / max(after, 1):.1f}x smaller)")
+    return data
+
+
+ISO_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:?\d{2})?)?$')
+
+
+def date_column_format(values, date_formats=None, sample=100):
+    """
+    Format of a text column of dates, checked on a sample: 'ISO8601' when every value is an ISO date, else the
+    first of date_formats that parses the sample back to the same text; None for other columns, so that ranges,
+    versions or codes like '1-2' are never taken for dates.
+    """
+    sample = values.iloc[:sample].astype(str).str.strip()
+    if sample.str.match(ISO_DATE).all():
+        dates = pd.to_datetime(sample, errors='coerce', format='ISO8601')
+        if dates.notna().all() and (dates.dt.strftime('%Y-%m-%d') == sample.str[:10]).all():
+            return 'ISO8601'
+    for date_format in date_formats or []:
+        dates = pd.to_datetime(sample, errors='coerce', format=date_format)
+        if dates.notna().all() and (dates.dt.strftime(date_format) == sample).all():
+            return date_format
+    return None
+
+
+def load_data(name=None, columns=None, writable=False, sheet=None, compact_dtypes=None):
+    """
+    Load an uploaded dataset as a DataFrame. The columnar cache is memory-mapped and only the given columns are
+    read; while the cache is not written yet, the uploaded file is parsed instead.
+    name: file name of the upload, the last upload by default. columns: list of columns to read, all by default.
+    writable: an Arrow cache is shared read-only with the app, set writable=True to get a private copy that can be
+    modified in place. sheet: name of the sheet of an Excel workbook, the first sheet by default.
+    compact_dtypes: shrink the dtypes with compact(), LAMBDA_COMPACT by default.
+    """
+    data = read_dataset(name, columns, writable, sheet)
+    if compact_dtypes is None:
+        compact_dtypes = LAMBDA_COMPACT
+    if compact_dtypes:
+        data = compact(data)
+    return data
+
+
+def read_dataset(name=None, columns=None, writable=False, sheet=None):
+    if name is None:
+        name = list(LAMBDA_DATASETS)[-1]
+    info = LAMBDA_DATASETS[os.path.basename(name)]
+    sheets = info.get('sheets') or {}
+    path = sheets.get(sheet) if sheet is not None else info.get('columnar')
+    if path and os.path.exists(path):
+        if path.endswith('.arrow'):
+            import pyarrow as pa
+            table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+            table = table.select(columns) if columns else table
+            data = table.to_pandas(split_blocks=True)  # numeric columns without nulls are not copied
+            return data.copy() if writable else data
+        import pyarrow.parquet as pq  # a Parquet file or a partitioned Parquet folder
+        return pq.read_table(path, columns=columns, memory_map=True).to_pandas()
+    if os.path.splitext(info['path'])[1].lower() in ('.xlsx', '.xlsm', '.xls'):
+        engine = 'calamine' if importlib.util.find_spec('python_calamine') else None  # as in cache/excel.py
+        return pd.read_excel(info['path'], sheet_name=sheet if sheet is not None else 0, usecols=columns,
+                             engine=engine)
+    return pd.read_csv(info['path'], usecols=columns)
+
+
+def sql_connection():
+    global LAMBDA_SQL
+    if LAMBDA_SQL is None:
+        import duckdb
+        LAMBDA_SQL = duckdb.connect()
+        for key, value in LAMBDA_SQL_SETTINGS.items():  # memory_limit, temp_directory (spilling), threads
+            LAMBDA_SQL.execute(f"SET {key} = '{str(value).replace(chr(39), chr(39) * 2)}'")
+    return LAMBDA_SQL
+
+
+def register_table(table, name):
+    LAMBDA_TABLES[table] = {'dataset': os.path.basename(name), 'source': None}
+
+
+def refresh_tables(con):
+    # a table is a view on the columnar copy once it is written, on the uploaded csv before
+    for table, entry in LAMBDA_TABLES.items():
+        info = LAMBDA_DATASETS[entry['dataset']]
+        path = info.get('columnar')
+        source = path if path and os.path.exists(path) else info['path']
+        if source == entry['source']:
+            continue
+        quoted = source.replace("'", "''")
+        if os.path.isdir(source):  # partitioned dataset, the folders give the partition columns
+            relation = f"read_parquet('{quoted}/**/*.parquet', hive_partitioning = true)"
+        elif source.endswith('.parquet'):
+            relation = f"read_parquet('{quoted}')"
+        elif source.endswith('.arrow'):
+            import pyarrow as pa
+            con.register(f"{table}_arrow", pa.ipc.open_file(pa.memory_map(source, 'r')).read_all())
+            relation = f'"{table}_arrow"'
+        else:
+            relation = f"read_csv_auto('{quoted}')"
+        con.execute(f'CREATE OR REPLACE VIEW "{table}" AS SELECT * FROM {relation}')
+        entry['source'] = source
+
+
+def sql(query, lazy=False):
+    """
+    Run a SQL query (DuckDB) on the out-of-core tables and return the result as a DataFrame, or as a lazy DuckDB
+    relation with lazy=True. Only the needed columns and row groups are scanned, and large joins, sorts and
+    aggregations spill to disk instead of running out of memory.
+    """
+    con = sql_connection()
+    refresh_tables(con)
+    relation = con.sql(query)
+    return relation if lazy else relation.df()
+
+
+VIEW_OPERATORS = {'==': 'eq', '!=': 'ne', '>': 'gt', '>=': 'ge', '<': 'lt', '<=': 'le'}
+
+
+def filter_value(series, value):
+    # the filter value comes as text from the viewer
+    if pd.api.types.is_bool_dtype(series.dtype):
+        return str(value).strip().lower() in ('true', '1', 'yes')
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        return float(value)
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return pd.Timestamp(value)
+    return str(value)
+
+
+def view_frame(frame, offset=0, limit=100, sort_by=None, ascending=True, filters=None, columns=None):
+    """
+    Window of rows of a DataFrame for the data viewer: rows matching the filters [(column, op, value)], op in
+    ==, !=, >, >=, <, <= or contains, sorted by one column, restricted to the given columns.
+    Return the window and the number of matching rows.
+    """
+    rows = np.arange(len(frame))
+    for column, op, value in filters or []:
+        series = frame[column].iloc[rows]
+        if op == 'contains':
+            mask = series.astype(str).str.contains(str(value), regex=False, na=False)
+        else:
+            mask = getattr(series, VIEW_OPERATORS[op])(filter_value(series, value)).fillna(False)
+        rows = rows[mask.to_numpy(dtype=bool)]
+    if sort_by:
+        keys = pd.Series(frame[sort_by].to_numpy()[rows])
+        rows = rows[keys.sort_values(ascending=ascending, kind='stable', na_position='last').index.to_numpy()]
+    window = frame.iloc[rows[offset:offset + limit]]
+    return (window[list(columns)] if columns else window), len(rows)
+
+
+def view_json(frame, **kwargs):
+    # window serialized for the app, which runs this in the kernel to show a live variable
+    import json
+    window, total = view_frame(frame, **kwargs)
+    return json.dumps({"total": total, "columns": [str(column) for column in frame.columns],
+                       "window": window.to_json(orient='split', date_format='iso', default_handler=str)})
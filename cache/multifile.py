@@ -0,0 +1,159 @@
+import glob
+import hashlib
+import os
+import shutil
+import zipfile
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from cache.profile import merge_dtype
+from cache.schema import fingerprint_file
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # the partitioned dataset is optional
+    pa = None
+
+DATA_EXTENSIONS = ('.csv', '.tsv', '.txt', '.parquet')
+
+
+def is_multifile(path) -> bool:
+    # a zip archive, a folder or a glob pattern of data files
+    return path.lower().endswith('.zip') or os.path.isdir(path) or glob.has_magic(path)
+
+
+def expand_files(path) -> tuple:
+    """
+    Return the root folder and the sorted data files of a zip archive (extracted next to it), a folder (searched
+    recursively) or a glob pattern.
+    """
+    if path.lower().endswith('.zip'):
+        root = os.path.splitext(path)[0] + '_unzipped'
+        with zipfile.ZipFile(path) as archive:
+            archive.extractall(root)
+        path = root
+    if os.path.isdir(path):
+        root = path
+        files = glob.glob(os.path.join(path, '**', '*'), recursive=True)
+    else:
+        files = glob.glob(path, recursive=True)
+        root = os.path.commonpath([os.path.dirname(file) for file in files]) if files else os.path.dirname(path)
+    files = sorted(file for file in files if file.lower().endswith(DATA_EXTENSIONS) and os.path.isfile(file)
+                   and '__MACOSX' not in file and not os.path.basename(file).startswith('.'))
+    if not files:
+        raise ValueError(f"No data file ({', '.join(DATA_EXTENSIONS)}) found in {path}")
+    return root, files
+
+
+def fingerprint_files(files) -> str:
+    digest = hashlib.sha1()
+    for file in files:
+        digest.update(fingerprint_file(file).encode())
+    return digest.hexdigest()
+
+
+def partition_values(root, file) -> dict:
+    """
+    Partition columns of a file from its path: hive-style folders (year=2023/month=01) give one column each,
+    otherwise the relative path of the file without extension is the 'source' column.
+    """
+    relative = os.path.relpath(file, root)
+    folders = os.path.dirname(relative).split(os.sep) if os.path.dirname(relative) else []
+    values = dict(folder.split('=', 1) for folder in folders if '=' in folder)
+    if not values:
+        values = {'source': os.path.splitext(relative)[0].replace(os.sep, '-')}
+    return values
+
+
+def read_part(file) -> pd.DataFrame:
+    if file.lower().endswith('.parquet'):
+        return pd.read_parquet(file)
+    return pd.read_csv(file, sep='\t' if file.lower().endswith('.tsv') else ',', encoding='utf-8')
+
+
+def common_dtypes(frames: dict) -> dict:
+    # dtype of each column whose dtype differs across the parts: the promoted numeric type, else text
+    dtypes = {}
+    for frame in frames.values():
+        for name, dtype in frame.dtypes.items():
+            dtypes.setdefault(name, []).append(dtype)
+    common = {}
+    for name, found in dtypes.items():
+        if len({str(dtype) for dtype in found}) > 1:
+            dtype = None
+            for item in found:
+                dtype = merge_dtype(dtype, item)
+            common[name] = dtype if dtype != object else str
+    return common
+
+
+def unify_dtypes(frames: dict, common: dict):
+    # cast in place, so that the parts can be combined and written to Parquet in one schema
+    for frame in frames.values():
+        for name, dtype in common.items():
+            if name in frame.columns:
+                column = frame[name]
+                frame[name] = column.astype(str).where(column.notna()) if dtype is str else column.astype(dtype)
+
+
+def check_schemas(frames: dict, common: dict = None) -> list:
+    """
+    Compare the columns and dtypes of the parts, return the inconsistencies as readable messages.
+    common maps the columns with different dtypes to the dtype they are cast to.
+    """
+    issues = []
+    columns = {}
+    common = common or {}
+    for frame in frames.values():
+        for name in frame.columns:
+            columns.setdefault(name, set()).add(str(frame[name].dtype))
+    for name in columns:
+        missing = [os.path.basename(file) for file, frame in frames.items() if name not in frame.columns]
+        if missing:
+            issues.append(f"column {name!r} is missing in {len(missing)} of {len(frames)} files, e.g. {missing[0]} "
+                          f"(filled with NaN)")
+    for name, dtypes in columns.items():
+        if len(dtypes) > 1:
+            target = 'text' if common.get(name) is str else str(common.get(name))
+            issues.append(f"column {name!r} has different dtypes across files {sorted(dtypes)} (cast to {target})")
+    return issues
+
+
+def read_partitions(root, files, workers=4) -> tuple:
+    """
+    Read the files in parallel processes and combine them into one DataFrame with the partition columns.
+    Return the DataFrame, the partition columns and the schema inconsistencies.
+    """
+    if workers > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(files))) as pool:
+            parts = list(pool.map(read_part, files))
+    else:
+        parts = [read_part(file) for file in files]
+    frames = dict(zip(files, parts))
+    common = common_dtypes(frames)
+    issues = check_schemas(frames, common)
+    unify_dtypes(frames, common)
+    partition_columns = []
+    for file, frame in frames.items():
+        for name, value in partition_values(root, file).items():
+            if name not in partition_columns:
+                partition_columns.append(name)
+            frame[name] = value
+    data = pd.concat(parts, ignore_index=True)
+    print(f"Read {len(files)} files from {root} into {data.shape[0]} rows, partitioned by {partition_columns}"
+          + (f", schema issues: {issues}" if issues else ""))
+    return data, partition_columns, issues
+
+
+def write_partitioned(data: pd.DataFrame, target, partition_columns) -> str:
+    """
+    Write the combined data as one Parquet dataset partitioned by folders (column=value), readable by
+    pq.read_table and DuckDB. It is written in a temporary folder and renamed when complete.
+    """
+    partial = target + '.partial'
+    shutil.rmtree(partial, ignore_errors=True)
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    pq.write_to_dataset(table, partial, partition_cols=[name for name in partition_columns if name in data.columns])
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(partial, target)
+    return target
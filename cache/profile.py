@@ -0,0 +1,179 @@
+import threading
+import numpy as np
+import pandas as pd
+from cache.sketch import SketchEngine
+
+
+def merge_dtype(old, new):
+    if old is None or old == new:
+        return new
+    if pd.api.types.is_numeric_dtype(old) and pd.api.types.is_numeric_dtype(new) \
+            and not pd.api.types.is_bool_dtype(old) and not pd.api.types.is_bool_dtype(new):
+        return np.result_type(old, new)
+    return np.dtype(object)
+
+
+class StreamingProfile:
+    """
+    Profile of a dataset that is read chunk by chunk: row count, null counts, dtypes and moments
+    (count, mean, std, min, max) of the numeric columns are computed in one pass, and a reservoir sample
+    of the rows is kept for previews. The profile can be used after the first chunk.
+    With sketch settings (see SketchEngine), approximate quartiles, distinct counts and frequent values are kept too.
+    """
+
+    def __init__(self, sample_size=10000, seed=0, sketch=None):
+        self.sample_size = sample_size
+        self.rng = np.random.default_rng(seed)
+        self.rows = 0
+        self.columns = None
+        self.dtypes = {}
+        self.nulls = None
+        self.count = None
+        self.mean = None
+        self.m2 = None
+        self.min = None
+        self.max = None
+        self.pieces = []
+        self.slot_piece = np.zeros(sample_size, dtype=np.int64)
+        self.slot_row = np.zeros(sample_size, dtype=np.int64)
+        self.complete = False
+        self.lock = threading.Lock()
+        self.sketch = SketchEngine(**sketch) if sketch else None
+
+    def update(self, chunk: pd.DataFrame):
+        with self.lock:
+            if self.columns is None:
+                self.columns = list(chunk.columns)
+                self.nulls = pd.Series(0, index=chunk.columns, dtype=np.int64)
+            for name, dtype in chunk.dtypes.items():
+                self.dtypes[name] = merge_dtype(self.dtypes.get(name), dtype)
+            self.nulls = self.nulls.add(chunk.isnull().sum(), fill_value=0).astype(np.int64)
+            self.update_moments(chunk)
+            self.update_sample(chunk)
+            if self.sketch is not None:
+                self.sketch.update(chunk)
+            self.rows += len(chunk)
+
+    def finish(self):
+        self.complete = True
+        if self.sketch is not None:
+            self.sketch.close()
+
+    def update_moments(self, chunk: pd.DataFrame):
+        numeric = chunk.select_dtypes(include='number').select_dtypes(exclude='bool')
+        count = numeric.count().astype(float)
+        mean = numeric.mean()
+        m2 = ((numeric - mean) ** 2).sum()
+        if self.count is None:
+            self.count, self.mean, self.m2 = count, mean, m2
+            self.min, self.max = numeric.min(), numeric.max()
+            return
+        # merge two sets of moments (Chan et al.), columns only seen in one of them are kept as they are
+        old_count = self.count.reindex(count.index.union(self.count.index), fill_value=0.0)
+        count = count.reindex(old_count.index, fill_value=0.0)
+        total = old_count + count
+        delta = mean.reindex(total.index).fillna(0.0) - self.mean.reindex(total.index).fillna(0.0)
+        weight = (count / total.where(total > 0)).fillna(0.0)
+        self.mean = self.mean.reindex(total.index).fillna(0.0) + delta * weight
+        self.m2 = self.m2.reindex(total.index, fill_value=0.0) + m2.reindex(total.index, fill_value=0.0) \
+            + (delta ** 2 * old_count * count / total.where(total > 0)).fillna(0.0)
+        self.count = total
+        self.min = pd.concat([self.min, numeric.min()], axis=1).min(axis=1)
+        self.max = pd.concat([self.max, numeric.max()], axis=1).max(axis=1)
+
+    def update_sample(self, chunk: pd.DataFrame):
+        # Vectorized reservoir sampling (algorithm R): row t of the stream replaces a random slot j < t.
+        position = self.rows + np.arange(1, len(chunk) + 1)
+        slots = np.where(position <= self.sample_size, position - 1, self.rng.integers(0, position))
+        accepted = slots < self.sample_size
+        if not accepted.any():
+            return
+        rows = np.flatnonzero(accepted)
+        self.pieces.append(chunk.iloc[rows].reset_index(drop=True))
+        self.slot_piece[slots[accepted]] = len(self.pieces) - 1
+        self.slot_row[slots[accepted]] = np.arange(len(rows))
+
+    @property
+    def sample(self) -> pd.DataFrame:
+        with self.lock:
+            filled = min(self.rows, self.sample_size)
+            if not filled:
+                return pd.DataFrame(columns=self.columns)
+            slot_piece, slot_row = self.slot_piece[:filled].copy(), self.slot_row[:filled].copy()
+            parts = []
+            # keep only the rows referenced by the reservoir, so that replaced rows are released
+            for i, piece in enumerate(np.unique(slot_piece)):
+                mask = slot_piece == piece
+                parts.append(self.pieces[piece].iloc[slot_row[mask]].reset_index(drop=True))
+                self.slot_piece[:filled][mask] = i
+                self.slot_row[:filled][mask] = np.arange(mask.sum())
+            self.pieces = parts
+            return pd.concat(self.pieces, ignore_index=True)
+
+    def null_counts(self) -> pd.Series:
+        return self.nulls
+
+    def col_types(self) -> pd.Series:
+        return pd.Series(self.dtypes)
+
+    def describe(self) -> pd.DataFrame:
+        std = np.sqrt(self.m2 / (self.count - 1).where(self.count > 1))
+        describe = {"count": self.count, "mean": self.mean, "std": std, "min": self.min}
+        if self.sketch is not None:
+            quartiles = pd.DataFrame({name: self.sketch.sketches[name].quantiles.quantiles([0.25, 0.5, 0.75])
+                                      for name in self.count.index
+                                      if name in self.sketch.sketches and self.sketch.sketches[name].quantiles},
+                                     index=["25%", "50%", "75%"]).transpose()
+            describe.update({key: quartiles[key] for key in quartiles.columns})
+        describe["max"] = self.max
+        return pd.DataFrame(describe).transpose()
+
+    def unique_counts(self) -> pd.Series:
+        # approximate distinct counts, only available with sketches
+        if self.sketch is None:
+            return None
+        return pd.Series({name: sketch.distinct.count() for name, sketch in self.sketch.sketches.items()})
+
+    def top_values(self, name) -> pd.Series:
+        if self.sketch is None or name not in self.sketch.sketches:
+            return None
+        return self.sketch.sketches[name].top()
+
+
+class SavedProfile:
+    """
+    Read-only view of a profile saved in the dataset cache (see get_profile_info), with the interface of
+    StreamingProfile used by the schema, so that a cached dataset is described without loading it.
+    """
+
+    def __init__(self, info: dict):
+        self.rows = info.get("num_rows", 0)
+        self.columns = list(info.get("features", []))
+        self.dtypes = dict(info["col_type"]) if info.get("col_type") is not None else {}
+        self.nulls = info["missing_val"] if info.get("missing_val") is not None else pd.Series(dtype=np.int64)
+        self.moments = info.get("describe")
+        self.unique = info.get("unique")
+        self.complete = True
+        self.sketch = self.unique  # distinct counts are only saved with sketches
+
+    def describe(self) -> pd.DataFrame:
+        if self.moments is None or not {"min", "mean", "max", "std"} <= set(self.moments.index):
+            return pd.DataFrame()
+        return self.moments
+
+    def unique_counts(self) -> pd.Series:
+        return self.unique
+
+    def top_values(self, name) -> pd.Series:
+        return None
+
+
+def profile_frame(data: pd.DataFrame, chunk_rows=1000000, sample_size=10000, sketch=None) -> StreamingProfile:
+    """
+    Profile an in-memory DataFrame chunk by chunk, for datasets too large for an exact describe().
+    """
+    profile = StreamingProfile(sample_size=sample_size, sketch=sketch)
+    for start in range(0, max(len(data), 1), chunk_rows):
+        profile.update(data.iloc[start:start + chunk_rows])
+    profile.finish()
+    return profile
@@ -0,0 +1,149 @@
+import hashlib
+import os
+import re
+import pandas as pd
+
+SCHEMA_CACHE = {}
+
+
+def fingerprint_file(file_path, block_size=65536, num_blocks=8) -> str:
+    """
+    Fingerprint of a file from its size and the hash of a few blocks sampled evenly over the file.
+    """
+    size = os.path.getsize(file_path)
+    digest = hashlib.sha1(str(size).encode())
+    with open(file_path, 'rb') as f:
+        if size <= block_size * num_blocks:
+            digest.update(f.read())
+        else:
+            step = (size - block_size) // (num_blocks - 1)
+            for i in range(num_blocks):
+                f.seek(i * step)
+                digest.update(f.read(block_size))
+    return digest.hexdigest()
+
+
+def settings_fingerprint(fingerprint: str, settings: dict) -> str:
+    """
+    Fingerprint of a file read with the given settings, so that the artifacts cached for other settings (dtypes,
+    profile or columnar format) are not reused.
+    """
+    return hashlib.sha1(f"{fingerprint}:{sorted(settings.items())!r}".encode()).hexdigest()
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def format_value(value) -> str:
+    if isinstance(value, float):
+        return f"{value:.4g}"
+    text = str(value)
+    return text if len(text) <= 20 else text[:17] + '...'
+
+
+def column_summary(column: pd.Series, num_samples=3) -> dict:
+    non_null = column.dropna()
+    summary = {
+        "dtype": str(column.dtype),
+        "null": 100.0 * (len(column) - len(non_null)) / max(len(column), 1),
+        "unique": int(non_null.nunique()),
+        "samples": [format_value(v) for v in non_null.drop_duplicates().head(num_samples)],
+    }
+    if pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column) and len(non_null):
+        summary["stats"] = {"min": float(non_null.min()), "mean": float(non_null.mean()),
+                            "max": float(non_null.max()), "std": float(non_null.std()) if len(non_null) > 1 else 0.0}
+    elif len(non_null):
+        top = non_null.value_counts().head(1)
+        summary["stats"] = {"top": f"{format_value(top.index[0])}({top.iloc[0]})"}
+    else:
+        summary["stats"] = {}
+    return summary
+
+
+def format_stats(stats: dict) -> str:
+    return ' '.join(f"{k}={format_value(v)}" for k, v in stats.items())
+
+
+def format_column(name, summary: dict) -> str:
+    return f"{name} | {summary['dtype']} | {summary['null']:.1f} | {summary['unique']} | " \
+           f"{', '.join(summary['samples'])} | {format_stats(summary['stats'])}"
+
+
+def group_columns(summaries: dict) -> list:
+    # Columns of the same dtype whose names only differ in a number (e.g. pixel0 ... pixel783) form one group.
+    groups = {}
+    for name, summary in summaries.items():
+        stem = re.sub(r'\d+', '#', str(name))
+        groups.setdefault((stem, summary["dtype"]), []).append(name)
+    return list(groups.values())
+
+
+def format_group(names: list, summaries: dict) -> str:
+    if len(names) == 1:
+        return format_column(names[0], summaries[names[0]])
+    members = [summaries[name] for name in names]
+    nulls = [m["null"] for m in members]
+    uniques = [m["unique"] for m in members]
+    line = f"{names[0]}..{names[-1]} ({len(names)} columns) | {members[0]['dtype']} | " \
+           f"{min(nulls):.1f}-{max(nulls):.1f} | {min(uniques)}-{max(uniques)} | {', '.join(members[0]['samples'])} |"
+    numeric = [m["stats"] for m in members if "mean" in m["stats"]]
+    if numeric:
+        line += f" min={format_value(min(s['min'] for s in numeric))} max={format_value(max(s['max'] for s in numeric))}"
+    return line
+
+
+def apply_profile(summaries: dict, profile) -> None:
+    # exact null counts, dtypes and moments of a streaming profile replace the values of the sample
+    moments = profile.describe()
+    for name, summary in summaries.items():
+        summary["dtype"] = str(profile.dtypes.get(name, summary["dtype"]))
+        summary["null"] = 100.0 * profile.nulls.get(name, 0) / max(profile.rows, 1)
+        if name in moments.columns:
+            summary["stats"] = {key: float(moments.at[key, name]) for key in ("min", "mean", "max", "std")}
+        elif profile.top_values(name) is not None and len(profile.top_values(name)):
+            top = profile.top_values(name)
+            summary["stats"] = {"top": f"{format_value(top.index[0])}({top.iloc[0]})"}
+    unique = profile.unique_counts()
+    if unique is not None:
+        for name, summary in summaries.items():
+            summary["unique"] = int(unique.get(name, summary["unique"]))
+
+
+def encode_schema(data: pd.DataFrame, max_tokens=1500, num_samples=3, profile=None) -> str:
+    """
+    Compact description of the dataset for the prompt: one line per column with dtype, null %, cardinality,
+    sample values and key statistics. Wide datasets are shortened by grouping similar columns and then by
+    truncating the column list, so that the description stays under max_tokens.
+    With a streaming profile, data is the sample of the profile; cardinality and frequent values come from the
+    sketches of the profile if any, else from the sample.
+    """
+    summaries = {name: column_summary(data[name], num_samples) for name in data.columns}
+    if profile is not None:
+        apply_profile(summaries, profile)
+        state = "" if profile.complete else ", still reading, the numbers are of the rows read so far"
+        estimate = "approximate" if profile.sketch is not None else f"estimated from a sample of {data.shape[0]} rows"
+        header = f"rows={profile.rows}, columns={data.shape[1]} (unique counts are {estimate}{state})"
+    else:
+        header = f"rows={data.shape[0]}, columns={data.shape[1]}"
+    header += "\ncolumn | dtype | null% | unique | samples | stats"
+    lines = [format_column(name, summary) for name, summary in summaries.items()]
+    if estimate_tokens('\n'.join([header] + lines)) > max_tokens:
+        lines = [format_group(names, summaries) for names in group_columns(summaries)]
+    text = '\n'.join([header] + lines)
+    if estimate_tokens(text) > max_tokens:
+        kept = [header]
+        for i, line in enumerate(lines):
+            if estimate_tokens('\n'.join(kept + [line])) > max_tokens - 50:
+                kept.append(f"... {len(lines) - i} more column groups are omitted, check them with data.columns.")
+                break
+            kept.append(line)
+        text = '\n'.join(kept)
+    return text
+
+
+def get_schema(data: pd.DataFrame, fingerprint: str, max_tokens=1500, profile=None) -> str:
+    key = (fingerprint, max_tokens)
+    if key not in SCHEMA_CACHE:
+        SCHEMA_CACHE[key] = encode_schema(data, max_tokens=max_tokens, profile=profile)
+    return SCHEMA_CACHE[key]
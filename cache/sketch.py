@@ -0,0 +1,245 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch (KLL-style compactors of capacity 2k). Items at level i stand for 2^i values;
+    a full level is sorted and every other item, from a random offset, is promoted to the next level.
+    The rank error is about log2(n / k) / k, e.g. below 1% for k=200 up to a billion values.
+    """
+
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.rng = np.random.default_rng(seed)
+        self.levels = [np.empty(0)]
+        self.n = 0
+
+    def update(self, values: np.ndarray):
+        self.levels[0] = np.concatenate([self.levels[0], values.astype(float)])
+        self.n += len(values)
+        self.compress()
+
+    def merge(self, other: 'QuantileSketch'):
+        for i, level in enumerate(other.levels):
+            if i == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[i] = np.concatenate([self.levels[i], level])
+        self.n += other.n
+        self.compress()
+
+    def compress(self):
+        i = 0
+        while i < len(self.levels):
+            level = self.levels[i]
+            if len(level) > 2 * self.k:
+                level = np.sort(level)
+                keep = level[len(level) - len(level) % 2:]  # an odd item stays at this level
+                promoted = level[self.rng.integers(2):len(level) - len(level) % 2:2]
+                if i + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[i] = keep
+                self.levels[i + 1] = np.concatenate([self.levels[i + 1], promoted])
+            i += 1
+
+    def quantiles(self, qs) -> np.ndarray:
+        values = np.concatenate(self.levels)
+        if not len(values):
+            return np.full(len(qs), np.nan)
+        weights = np.concatenate([np.full(len(level), 2.0 ** i) for i, level in enumerate(self.levels)])
+        order = np.argsort(values)
+        cumulative = np.cumsum(weights[order])
+        positions = np.searchsorted(cumulative, np.asarray(qs) * cumulative[-1], side='left')
+        return values[order][np.minimum(positions, len(values) - 1)]
+
+
+def bit_length(x: np.ndarray) -> np.ndarray:
+    # exact bit length of uint64 values, computed on the 32-bit halves which are exact in float64
+    high = (x >> np.uint64(32)).astype(np.float64)
+    low = (x & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    length_high = np.where(high > 0, np.frexp(high)[1], 0)
+    length_low = np.where(low > 0, np.frexp(low)[1], 0)
+    return np.where(length_high > 0, 32 + length_high, length_low)
+
+
+class HyperLogLog:
+    """
+    HyperLogLog distinct counter with 2^p registers, the relative error is about 1.04 / sqrt(2^p)
+    (1.6% for p=12).
+    """
+
+    def __init__(self, p=12):
+        self.p = p
+        self.registers = np.zeros(2 ** p, dtype=np.uint8)
+
+    def update(self, hashes: np.ndarray):
+        index = (hashes >> np.uint64(64 - self.p)).astype(np.int64)
+        rest = hashes << np.uint64(self.p)
+        rank = np.minimum(64 - bit_length(rest) + 1, 64 - self.p + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other: 'HyperLogLog'):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(2.0 ** -self.registers.astype(float))
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and zeros:  # small range correction by linear counting
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+
+def first_positions(hashes: np.ndarray, targets: np.ndarray, block=4096) -> dict:
+    # position of the first occurrence of each target, searched in blocks growing 4 times, as frequent values
+    # occur early
+    positions = {}
+    start = 0
+    while len(targets) and start < len(hashes):
+        found, index = np.unique(hashes[start:start + block], return_index=True)
+        slots = np.minimum(np.searchsorted(found, targets), len(found) - 1)
+        hit = found[slots] == targets
+        positions.update(zip(targets[hit].tolist(), (start + index[slots[hit]]).tolist()))
+        targets = targets[~hit]
+        start, block = start + block, 4 * block
+    return positions
+
+
+class FrequentValues:
+    """
+    Misra-Gries summary of the most frequent values in capacity counters, keyed by 64-bit hashes of the values
+    (one representative value is kept per counter). Counts are lower bounds, too low by at most n / (capacity + 1).
+    A chunk is counted exactly on its hashes, reduced to capacity counters and merged into the summary.
+    """
+
+    def __init__(self, capacity=50):
+        self.capacity = capacity
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.values = np.empty(0, dtype=object)
+
+    def reduce(self, counts) -> np.ndarray:
+        # mask of the counters above the (capacity + 1)-th largest count, the counts are decremented by it
+        if len(counts) <= self.capacity:
+            return np.ones(len(counts), dtype=bool)
+        threshold = np.partition(counts, len(counts) - self.capacity - 1)[len(counts) - self.capacity - 1]
+        counts -= threshold
+        return counts > 0
+
+    def update(self, values: np.ndarray, hashes: np.ndarray):
+        unique, counts = np.unique(hashes, return_counts=True)
+        kept = self.reduce(counts)
+        unique, counts = unique[kept], counts[kept]
+        # a representative value is only looked up for the hashes not yet in the summary
+        representatives = dict(zip(self.hashes.tolist(), self.values))
+        for h, position in first_positions(hashes, unique[~np.isin(unique, self.hashes)]).items():
+            representatives[h] = values[position]
+        self.add(unique, counts, [representatives[h] for h in unique.tolist()])
+
+    def add(self, hashes, counts, values):
+        hashes = np.concatenate([self.hashes, hashes])
+        values = np.concatenate([self.values, np.asarray(values, dtype=object)])
+        unique, first, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+        counts = np.bincount(inverse, weights=np.concatenate([self.counts, counts])).astype(np.int64)
+        kept = self.reduce(counts)
+        self.hashes, self.counts, self.values = unique[kept], counts[kept], values[first][kept]
+
+    def merge(self, other: 'FrequentValues'):
+        self.add(other.hashes, other.counts, other.values)
+
+    def top(self, k) -> pd.Series:
+        order = np.argsort(-self.counts, kind='stable')[:k]
+        return pd.Series(self.counts[order], index=self.values[order], dtype=np.int64)
+
+
+class ColumnSketch:
+    """
+    Approximate profile of one column: quantiles (numeric columns), distinct count and the most frequent values
+    (10 * top_k Misra-Gries counters, their counts are lower bounds). The values are hashed once for both.
+    Numeric columns with more distinct values than half of their values stop tracking frequent values.
+    """
+
+    def __init__(self, quantile_k=200, hll_precision=12, top_k=5):
+        self.top_k = top_k
+        self.quantiles = None
+        self.distinct = HyperLogLog(hll_precision)
+        self.frequent = FrequentValues(10 * top_k)
+        self.quantile_k = quantile_k
+        self.n = 0
+
+    def update(self, column: pd.Series):
+        values = column.dropna()
+        if not len(values):
+            return
+        numeric = pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values)
+        values = values.to_numpy()
+        if numeric:
+            if self.quantiles is None:
+                self.quantiles = QuantileSketch(self.quantile_k)
+            self.quantiles.update(values)
+        hashes = pd.util.hash_array(values)
+        self.distinct.update(hashes)
+        self.n += len(values)
+        if numeric and self.distinct.count() > self.n / 2:
+            self.frequent = None
+        if self.frequent is not None:
+            self.frequent.update(values, hashes)
+
+    def merge(self, other: 'ColumnSketch'):
+        if other.quantiles is not None:
+            if self.quantiles is None:
+                self.quantiles = QuantileSketch(self.quantile_k)
+            self.quantiles.merge(other.quantiles)
+        self.distinct.merge(other.distinct)
+        self.n += other.n
+        if self.frequent is not None and other.frequent is not None:
+            self.frequent.merge(other.frequent)
+        else:
+            self.frequent = None
+
+    def top(self) -> pd.Series:
+        if self.frequent is None:
+            return pd.Series(dtype=np.int64)
+        return self.frequent.top(self.top_k)
+
+
+def sketch_columns(frame: pd.DataFrame, settings: dict) -> dict:
+    sketches = {}
+    for name in frame.columns:
+        sketch = ColumnSketch(**settings)
+        sketch.update(frame[name])
+        sketches[name] = sketch
+    return sketches
+
+
+class SketchEngine:
+    """
+    Sketch the columns of each chunk in batches of column_batch columns, in a process pool when workers > 0,
+    and merge the results into one ColumnSketch per column.
+    """
+
+    def __init__(self, quantile_k=200, hll_precision=12, top_k=5, workers=0, column_batch=64):
+        self.settings = {"quantile_k": quantile_k, "hll_precision": hll_precision, "top_k": top_k}
+        self.column_batch = column_batch
+        self.pool = ProcessPoolExecutor(max_workers=workers) if workers else None
+        self.sketches = {}
+
+    def update(self, chunk: pd.DataFrame):
+        batches = [chunk.iloc[:, i:i + self.column_batch] for i in range(0, chunk.shape[1], self.column_batch)]
+        if self.pool is not None and len(batches) > 1:
+            results = self.pool.map(sketch_columns, batches, [self.settings] * len(batches))
+        else:
+            results = (sketch_columns(batch, self.settings) for batch in batches)
+        for result in results:
+            for name, sketch in result.items():
+                if name in self.sketches:
+                    self.sketches[name].merge(sketch)
+                else:
+                    self.sketches[name] = sketch
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+            self.pool = None
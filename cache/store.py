@@ -0,0 +1,104 @@
+import glob
+import os
+import pickle
+import shutil
+import time
+from cache.columnar import COLUMNAR_DIR
+
+
+class DatasetStore:
+    """
+    Project-level cache of the artifacts computed for an uploaded dataset (profile, columnar conversion and
+    compact schema), keyed by the fingerprint of the file content and of the read settings, so that re-uploading a
+    file in another session skips the parse. The least recently used entries are evicted when the cache exceeds its
+    size or entry limit.
+    """
+
+    def __init__(self, path, max_size_mb=10240, max_entries=100):
+        self.path = path
+        self.max_size = max_size_mb * 1024 * 1024
+        self.max_entries = max_entries
+        os.makedirs(self.path, exist_ok=True)
+
+    def entry_dir(self, fingerprint) -> str:
+        path = os.path.join(self.path, fingerprint)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def touch(self, fingerprint):
+        # the modification time of the entry folder marks its last use
+        path = os.path.join(self.path, fingerprint)
+        if os.path.isdir(path):
+            now = time.time()
+            os.utime(path, (now, now))
+
+    def lookup(self, fingerprint) -> dict | None:
+        """
+        Return the cached artifacts {"columnar": path, "profile": dict or None, "sheets": {sheet: path} or None}
+        of the dataset, None on a miss.
+        """
+        columnar = self.find_columnar(fingerprint)
+        if columnar is None:
+            return None
+        self.touch(fingerprint)
+        sheets = self.load(fingerprint, 'sheets.pkl')
+        if sheets:  # the first sheet of a workbook is the main table
+            columnar = next(iter(sheets.values()))
+        return {"columnar": columnar, "profile": self.load(fingerprint, 'profile.pkl'), "sheets": sheets}
+
+    def find_columnar(self, fingerprint) -> str | None:
+        # a file, or a folder for a partitioned dataset, skipping conversions still being written
+        files = [file for file in glob.glob(os.path.join(self.path, fingerprint, COLUMNAR_DIR, '*'))
+                 if not file.endswith('.partial')]
+        return files[0] if files else None
+
+    def load(self, fingerprint, name):
+        path = os.path.join(self.path, fingerprint, name)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except Exception as e:
+            print(f"Error in loading {path} from the dataset cache: {e}")
+            return None
+
+    def save(self, fingerprint, name, value):
+        path = os.path.join(self.entry_dir(fingerprint), name)
+        with open(path + '.partial', 'wb') as f:
+            pickle.dump(value, f)
+        os.replace(path + '.partial', path)
+        self.evict(keep=fingerprint)
+
+    def save_profile(self, fingerprint, profile: dict):
+        self.save(fingerprint, 'profile.pkl', profile)
+
+    def save_sheets(self, fingerprint, sheets: dict):
+        self.save(fingerprint, 'sheets.pkl', sheets)
+
+    def load_schema(self, fingerprint, max_tokens) -> str | None:
+        return self.load(fingerprint, f'schema_{max_tokens}.pkl')
+
+    def save_schema(self, fingerprint, max_tokens, schema: str):
+        self.save(fingerprint, f'schema_{max_tokens}.pkl', schema)
+
+    def evict(self, keep=None):
+        entries = []
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if os.path.isdir(path):
+                size = sum(os.path.getsize(os.path.join(root, file))
+                           for root, _, files in os.walk(path) for file in files)
+                entries.append((os.path.getmtime(path), size, name))
+        entries.sort()  # least recently used first
+        total = sum(size for _, size, _ in entries)
+        count = len(entries)
+        for _, size, name in entries:
+            if total <= self.max_size and count <= self.max_entries:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+            print(f"Dataset cache: evicted {name}")
+            total -= size
+            count -= 1
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+from cache.loader import view_frame
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # the columnar viewer is optional
+    pa = None
+
+ARROW_OPERATORS = {'==': 'equal', '!=': 'not_equal', '>': 'greater', '>=': 'greater_equal', '<': 'less',
+                   '<=': 'less_equal'}
+
+
+class TableView:
+    """
+    Paginated view of a (memory-mapped) Arrow table. Filters and sorting are computed with pyarrow on the needed
+    columns only; the selected row indices of the last query are kept, so turning pages only takes the rows of
+    the window.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.query = None
+        self.rows = None
+
+    @property
+    def columns(self) -> list:
+        return self.table.column_names
+
+    @property
+    def num_rows(self) -> int:
+        return self.table.num_rows
+
+    def column(self, name):
+        return self.table.column(name)
+
+    def select(self, sort_by=None, ascending=True, filters=None):
+        query = (sort_by, ascending, tuple(tuple(item) for item in filters or []))
+        if query == self.query:
+            return self.rows
+        rows = None  # None stands for all the rows in order
+        for column, op, value in filters or []:
+            values = self.column(column) if rows is None else self.column(column).take(rows)
+            if op == 'contains':
+                mask = pc.match_substring(pc.cast(values, pa.string()), str(value))
+            else:
+                scalar = pc.cast(pa.scalar(str(value)), values.type)
+                mask = getattr(pc, ARROW_OPERATORS[op])(values, scalar)
+            selected = pc.indices_nonzero(pc.fill_null(mask, False))
+            rows = selected if rows is None else rows.take(selected)
+        if sort_by:
+            values = self.column(sort_by) if rows is None else self.column(sort_by).take(rows)
+            order = pc.array_sort_indices(values, order="ascending" if ascending else "descending")
+            rows = order if rows is None else rows.take(order)
+        self.query, self.rows = query, rows
+        return rows
+
+    def page(self, offset=0, limit=100, sort_by=None, ascending=True, filters=None, columns=None):
+        """
+        Return the window of rows as a DataFrame and the number of matching rows.
+        """
+        rows = self.select(sort_by, ascending, filters)
+        table = self.table.select(list(columns)) if columns else self.table
+        total = self.num_rows if rows is None else len(rows)
+        window = table.slice(offset, limit) if rows is None else table.take(rows.slice(offset, limit))
+        return window.to_pandas(), total
+
+
+class DatasetView(TableView):
+    """
+    Paginated view of a Parquet file or partitioned folder opened with pyarrow.dataset, without reading it whole:
+    a page reads only the row groups holding its rows, filters and sorting read only their own columns.
+    """
+
+    def __init__(self, dataset):
+        super().__init__(None)
+        self.dataset = dataset
+        self.groups = [group for fragment in dataset.get_fragments() for group in fragment.split_by_row_group()]
+        sizes = [sum(info.num_rows for info in group.row_groups) for group in self.groups]
+        self.starts = np.cumsum([0] + sizes)  # position of the first row of each row group
+        self.loaded = {}
+
+    @property
+    def columns(self) -> list:
+        return self.dataset.schema.names
+
+    @property
+    def num_rows(self) -> int:
+        return int(self.starts[-1])
+
+    def column(self, name):
+        if name not in self.loaded:
+            self.loaded[name] = self.dataset.to_table(columns=[name]).column(name)
+        return self.loaded[name]
+
+    def read_rows(self, positions: np.ndarray, columns=None):
+        # the rows at the given positions, in that order, from the row groups that hold them
+        groups = np.searchsorted(self.starts, positions, side='right') - 1
+        order = np.argsort(groups, kind='stable')
+        pieces = [self.groups[group].to_table(schema=self.dataset.schema, columns=columns)
+                  .take(positions[order][groups[order] == group] - self.starts[group]) for group in np.unique(groups)]
+        if not pieces:
+            return self.dataset.schema.empty_table().select(columns or self.columns)
+        return pa.concat_tables(pieces).take(np.argsort(order, kind='stable'))
+
+    def page(self, offset=0, limit=100, sort_by=None, ascending=True, filters=None, columns=None):
+        rows = self.select(sort_by, ascending, filters)
+        total = self.num_rows if rows is None else len(rows)
+        if rows is None:
+            positions = np.arange(min(offset, total), min(offset + limit, total))
+        else:
+            positions = rows.slice(offset, limit).to_numpy()
+        window = self.read_rows(positions.astype(np.int64), list(columns) if columns else None)
+        return window.to_pandas(), total
+
+
+def view_page(source, offset=0, limit=100, sort_by=None, ascending=True, filters=None, columns=None):
+    # source is a TableView of the columnar copy or a DataFrame held in memory
+    if isinstance(source, TableView):
+        return source.page(offset, limit, sort_by, ascending, filters, columns)
+    return view_frame(source, offset, limit, sort_by, ascending, filters, columns)
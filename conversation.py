@@ -1,10 +1,18 @@
 import os
 import openai
 import json
+import keyword
+import io
 from programmer import Programmer
 from inspector import Inspector
+from router import ModelRouter
+from streaming import ChatStream
+from speculation import Speculator
 from cache.cache import *
+from cache.columnar import kernel_helpers, register_code, table_name, sql_table_code
+from cache.store import DatasetStore
 from prompt_engineering.prompts import *
+import time
 import warnings
 import traceback
 import zipfile
@@ -24,34 +32,99 @@ class Conversation():
         self.model = config['conv_model']
         self.programmer = Programmer(api_key=config['api_key'], model=config['programmer_model'],
                                      base_url=config['base_url_programmer'])
+        self.programmer.retrieval_budget = config.get('retrieval_budget', 0.3)
         self.inspector = Inspector(api_key=config['api_key'], model=config['inspector_model'],
                                    base_url=config['base_url_inspector'])
+        self.router = ModelRouter(config)
+        self.programmer_tier = None
         self.session_cache_path = config["session_cache_path"]
         self.messages = []
         self.chat_history = []
         self.retrieval = self.config['retrieval']
+        self.stream_interval = config.get('stream_frame_interval', 0.05)
+        self.stream_chars = config.get('stream_frame_chars', 512)
         self.kernel = CodeKernel(session_cache_path=self.session_cache_path, max_exe_time=config['max_exe_time'])
         self.max_attempts = config['max_attempts']
+        self.patch_repair = config.get('patch_repair', False)
+        self.last_code = None
         self.error_count = 0
         self.repair_count = 0
         self.file_list = []
         self.figure_list = []
         self.function_repository = {}
         self.my_data_cache = None
+        store = config.get('dataset_store') or {}
+        self.dataset_store = DatasetStore(store['path'], max_size_mb=store.get('max_size_mb', 10240),
+                                          max_entries=store.get('max_entries', 100)) if store.get('enable') else None
+        self.executed_cells = []
+        self.sql_tables = {}  # uploads queried out of core in the kernel, file name -> table
+        self.speculator = Speculator(config, self.programmer, self.session_cache_path)
         # self.oss_dir = None
         self.run_code(IMPORT)
+        self.run_code(kernel_helpers(self.config.get('compact_dtypes', False)))
+        self.preload_knowledge()
 
 
 
+    def preload_knowledge(self):
+        # knowledge_preload: True for all the core-mode knowledge, or a list of knowledge names
+        preload = self.config.get('knowledge_preload', False)
+        if self.retrieval and self.config.get('knowledge_dirs'):
+            from knw_in import add_knowledge_dirs
+            add_knowledge_dirs(self.config['knowledge_dirs'])
+        if self.retrieval and preload:
+            from knw_in import preload_knowledge
+            preload_knowledge(self.kernel, None if preload is True else preload)
+
     def add_functions(self, function_lib: dict) -> None:
         self.function_repository = function_lib
 
     def add_data(self, data_path) -> None:
-        self.my_data_cache = data_cache(data_path)
+        data_path = data_path.rstrip(os.sep)
+        out_of_core = self.out_of_core(data_path)
+        streaming_threshold_mb = self.config.get('streaming_threshold_mb', 200)
+        if out_of_core:  # never parse an out-of-core upload in full
+            streaming_threshold_mb = min(streaming_threshold_mb, self.config['out_of_core'].get('threshold_mb', 2048))
+        self.my_data_cache = data_cache(data_path, streaming_threshold_mb=streaming_threshold_mb,
+                                        chunk_rows=self.config.get('chunk_rows', 100000),
+                                        sample_rows=self.config.get('sample_rows', 10000),
+                                        shared_memory=self.config.get('shared_memory', False),
+                                        store=self.dataset_store, sketch=self.sketch_settings(),
+                                        approx_min_cells=self.config.get('approximate_profile', {}).get('min_cells', 50000000),
+                                        excel_workers=self.config.get('excel_workers', 4),
+                                        compact_dtypes=self.config.get('compact_dtypes', False),
+                                        file_workers=self.config.get('file_workers', 4),
+                                        schema_max_tokens=self.config.get('schema_max_tokens', 1500),
+                                        columnar_format=self.config.get('columnar_format', 'parquet'))
+        if self.config.get('columnar_cache', False) or self.config.get('shared_memory', False):
+            self.my_data_cache.to_columnar(self.session_cache_path)
+        filename = os.path.basename(data_path)
+        self.run_code(register_code(filename, os.path.join(self.session_cache_path, filename),
+                                    self.my_data_cache.columnar_path, self.my_data_cache.sheet_paths))
+        if out_of_core:
+            settings = self.config['out_of_core']
+            sql_settings = {key: settings[key] for key in ('memory_limit', 'threads') if settings.get(key)}
+            if settings.get('temp_directory'):
+                sql_settings['temp_directory'] = os.path.abspath(settings['temp_directory'])
+            self.sql_tables[filename] = table_name(filename)
+            self.run_code(sql_table_code(filename, self.sql_tables[filename], sql_settings))
+
+    def out_of_core(self, data_path) -> bool:
+        # large csv uploads are queried with DuckDB in the kernel instead of pandas
+        settings = self.config.get('out_of_core') or {}
+        return bool(settings.get('enable')) and not is_excel(data_path) and not is_multifile(data_path) and \
+            os.path.getsize(data_path) > settings.get('threshold_mb', 2048) * 1024 * 1024
+
+    def sketch_settings(self):
+        settings = self.config.get('approximate_profile') or {}
+        if not settings.get('enable'):
+            return None
+        return {key: settings[key] for key in ('quantile_k', 'hll_precision', 'top_k', 'workers', 'column_batch')
+                if key in settings}
 
     def check_folder(self):
         current_files = os.listdir(self.session_cache_path)
-        new_files = set(current_files) - set(self.file_list)
+        new_files = {file for file in set(current_files) - set(self.file_list) if not file.startswith('.')}
         self.file_list = current_files
         display = False
         display_link = ''
@@ -76,6 +149,7 @@ class Conversation():
         with open(os.path.join(self.session_cache_path, 'inspector_msg.json'), 'w') as f:
             json.dump(self.inspector.messages, f, indent=4)
             f.close()
+        self.router.save(os.path.join(self.session_cache_path, 'routing_stats.json'))
         print(f"Conversation saved in {os.path.join(self.session_cache_path, 'programmer_msg.json')}")
         print(f"Conversation saved in {os.path.join(self.session_cache_path, 'inspector_msg.json')}")
 
@@ -83,9 +157,45 @@ class Conversation():
         self.programmer.messages.append(message)
 
     def add_programmer_repair_msg(self, bug_code: str, error_msg: str, fix_method: str, role="user"):
-        message = {"role": role,
-                   "content": CODE_FIX.format(bug_code=bug_code, error_message=error_msg, fix_method=fix_method)}
-        self.programmer.messages.append(message)
+        if self.patch_repair:
+            content = CODE_FIX_PATCH.format(bug_code=number_code_lines(bug_code), error_message=error_msg,
+                                            fix_method=fix_method)
+        else:
+            content = CODE_FIX.format(bug_code=bug_code, error_message=error_msg, fix_method=fix_method)
+        self.programmer.messages.append({"role": role, "content": content})
+
+    def extract_repaired_code(self, response: str, bug_code: str) -> tuple[bool, str]:
+        # A diff is applied to the bug code locally, a full rewrite in ```python``` is used as it is.
+        has_patch, patch = extract_patch(response)
+        if has_patch:
+            applied, code = apply_patch(bug_code, patch)
+            if applied and check_syntax(code):
+                return True, code
+            print("Patch can not be applied to the bug code:\n", patch)
+            return False, ''
+        return extract_code(response)
+
+    def call_programmer_streaming(self, task: str, attempt=0, **kwargs):
+        tier = self.router.route(task, self.programmer.messages, attempt)
+        start = time.time()
+        response = []
+        for message in self.programmer._call_chat_model_streaming(model=self.router.model("programmer", tier), **kwargs):
+            response.append(message)
+            yield message
+        response = ''.join(response)
+        self.router.record_call(tier, time.time() - start, self.programmer.messages, response)
+        if task == 'summary':
+            self.router.record_outcome(tier, bool(response))
+        self.programmer_tier = tier
+
+    def call_inspector(self, attempt=0):
+        tier = self.router.route('hint', self.inspector.messages, attempt)
+        start = time.time()
+        response = self.inspector._call_chat_model(model=self.router.model("inspector", tier))
+        content = response.choices[0].message.content if response else ''
+        self.router.record_call(tier, time.time() - start, self.inspector.messages, content)
+        self.router.record_outcome(tier, bool(content))
+        return content
 
     def add_inspector_msg(self, bug_code: str, error_msg: str, role="user"):
         message = {"role": role, "content": CODE_INSPECT.format(bug_code=bug_code, error_message=error_msg)}
@@ -97,10 +207,46 @@ class Conversation():
         except Exception as e:  # this error is due to the outer programme, not the error in the kernel
             print(f'Error in executing code (outer): {e}')
             sign, msg_llm, exe_res = 'text', f'{e}\nThis error is due to the outer programme, not the error in the kernel, you should tell the user to check the system code.', str(e) # tell the user, the code have problems.
+        else:
+            if 'error' not in sign:  # cells without output (imports, helpers, assignments) are replayed as well
+                self.executed_cells.append(code)
 
         return sign, msg_llm, exe_res
 
+    def start_speculation(self, suggestions):
+        model = self.router.model("programmer", self.router.route('code', self.programmer.messages))
+        self.speculator.start(self.programmer.messages, suggestions, self.executed_cells, model=model,
+                              modules=self.kernel.modules)
+
+    def replay_speculation(self, out, speculation):
+        # show the pre-computed answer at once, then run the code in the session kernel to keep its state
+        self.add_programmer_msg({"role": "assistant", "content": speculation["response"]})
+        out.append(speculation["response"])
+        out.append('\n🖥️ Execute code...')
+        out.append(display_exe_results(speculation["exe_res"]))
+        out.append(speculation["summary"])
+        yield out.flush()
+        code = speculation["code"]
+        self.last_code = code
+        sign, msg_llm, exe_res = self.run_code(code)
+        self.add_programmer_msg({"role": "user", "content": RESULT_PROMPT.format(msg_llm)})
+        if sign and 'error' not in sign:
+            self.add_programmer_msg({"role": "assistant", "content": speculation["summary"]})
+            display, link_info = self.check_folder()
+            out.append(f"{link_info}" if display else '')
+            suggests = extract_suggestion(speculation["summary"])
+            if suggests:
+                out.append(display_suggestions(suggests))
+                self.start_speculation(suggests)
+        else:
+            note = "The pre-computed result could not be reproduced in the session, here is the executing result."
+            self.add_programmer_msg({"role": "assistant", "content": note})
+            out.append(f"\n⚠️ {note}" + display_exe_results(exe_res or msg_llm))
+        yield out.flush()
+
     def rendering_code(self):
+        if self.last_code is not None:
+            return self.last_code
         for i in range(len(self.programmer.messages) - 1, 0, -1):
             if self.programmer.messages[i]["role"] == "assistant":
                 is_python, code = extract_code(self.programmer.messages[i]["content"])
@@ -108,8 +254,33 @@ class Conversation():
                     return code
         return None
 
-    def show_data(self) -> pd.DataFrame:
-        return self.my_data_cache.data
+    def view_data(self, offset=0, limit=100, sort_by=None, ascending=True, filters=None, columns=None,
+                  variable=None):
+        """
+        Window of rows for the data viewer, from the uploaded dataset or from a DataFrame variable of the kernel.
+        Return the window, the number of matching rows and all the column names.
+        """
+        query = dict(offset=offset, limit=limit, sort_by=sort_by, ascending=ascending, filters=filters,
+                     columns=columns)
+        if variable:
+            if not variable.isidentifier() or keyword.iskeyword(variable):
+                raise ValueError(f"Cannot show {variable!r}: not a variable name")
+            # run outside of the notebook export and of the replayed cells
+            code = f"import json\ntry:\n    print(view_json({variable}, **{query!r}))\n" \
+                   f"except Exception as e:\n    print(json.dumps({{'error': f'{{type(e).__name__}}: {{e}}'}}))"
+            try:
+                outputs = self.kernel.execute_code_(code, lock_timeout=self.config.get('viewer_kernel_wait', 1))
+            except TimeoutError:
+                raise ValueError(f"Cannot show {variable}: the kernel is busy, try again when the running cell ends")
+            output = ''.join(text for mark, text in outputs if mark == 'stdout')
+            result = json.loads(output) if output.strip() else {"error": "no output"}
+            if "error" in result:
+                raise ValueError(f"Cannot show {variable}: {result['error']}")
+            window = pd.read_json(io.StringIO(result["window"]), orient='split')
+            return window, result["total"], result["columns"]
+        window, total = self.my_data_cache.view(**query)
+        return window, total, [str(column) for column in (self.my_data_cache.viewer.columns
+                                                          if self.my_data_cache.viewer else self.my_data_cache.data.columns)]
 
     def document_generation(self):
         print("Report generating...")
@@ -155,82 +326,104 @@ class Conversation():
         self.messages = []
         self.programmer.clear()
         self.inspector.clear()
+        self.speculator.shutdown()
+        self.executed_cells = []
         self.kernel.shutdown()
         del self.kernel
         self.kernel = CodeKernel(session_cache_path=self.session_cache_path, max_exe_time=self.config['max_exe_time'])
+        self.run_code(kernel_helpers(self.config.get('compact_dtypes', False)))
+        self.preload_knowledge()
         self.my_data_cache = None
+        self.last_code = None
 
     def stream_workflow(self, chat_history, code=None) -> object:
+        chat_history[-1][1] = ""
+        out = ChatStream(chat_history, interval=self.stream_interval, max_chars=self.stream_chars)
         try:
-            chat_history[-1][1] = ""
             if code is not None:
                 prog_response1_content = HUMAN_LOOP.format(code=code)
                 self.add_programmer_msg({"role": "user", "content": prog_response1_content})
+                code_tier = None
             else:
-                prog_response1_content = ''
-                for message in self.programmer._call_chat_model_streaming(retrieval=self.retrieval, kernel=self.kernel):
-                    chat_history[-1][1] += message
-                    prog_response1_content += message
-                    yield chat_history
+                speculation = self.speculator.pop(self.programmer.messages[-1]["content"])
+                if speculation:
+                    yield from self.replay_speculation(out, speculation)
+                    return
+                self.router.begin_turn(self.programmer.messages[-1]["content"])
+                response = []
+                yield from out.stream(self.call_programmer_streaming('code', retrieval=self.retrieval, kernel=self.kernel), response)
+                prog_response1_content = ''.join(response)
                 self.add_programmer_msg({"role": "assistant", "content": prog_response1_content})
+                code_tier = self.programmer_tier
 
             is_python, code = extract_code(prog_response1_content)
             print("is_python:", is_python)
 
             if is_python:
-                chat_history[-1][1] += '\n🖥️ Execute code...'
-                yield chat_history
+                self.last_code = code
+                out.append('\n🖥️ Execute code...')
+                yield out.flush()
                 sign, msg_llm, exe_res = self.run_code(code)
                 print("Executing result:", exe_res)
+                if code_tier is not None:
+                    self.router.record_outcome(code_tier, bool(sign) and 'error' not in sign)
                 if sign and 'error' not in sign:
                     display, link_info = self.check_folder()
-                    chat_history[-1][1] += display_exe_results(exe_res)
-                    yield chat_history
+                    out.append(display_exe_results(exe_res))
+                    yield out.flush()
                     self.add_programmer_msg({"role": "user", "content": RESULT_PROMPT.format(msg_llm)})
 
-                    prog_response2 = ''
-                    for message in self.programmer._call_chat_model_streaming():
-                        chat_history[-1][1] += message
-                        prog_response2 += message
-                        yield chat_history
+                    response = []
+                    yield from out.stream(self.call_programmer_streaming('summary'), response)
+                    prog_response2 = ''.join(response)
 
                     self.add_programmer_msg({"role": "assistant", "content": prog_response2})
-                    chat_history[-1][1] += f"{link_info}" if display else ''
-                    yield chat_history
+                    out.append(f"{link_info}" if display else '')
+                    yield out.flush()
 
                     #show suggestion
                     suggests = extract_suggestion(prog_response2)
                     if suggests:
                         suggestions = display_suggestions(suggests)
-                        chat_history[-1][1] += suggestions
-                        yield chat_history
+                        out.append(suggestions)
+                        yield out.flush()
+                        self.start_speculation(suggests)
 
                 else:
                     self.error_count += 1
                     round = 0
                     while 'error' in sign and round < self.max_attempts:
-                        chat_history[-1][1] = f'⭕ Execution error, try to repair the code, attempts: {round + 1}....\n'
-                        yield chat_history
+                        out.set(f'⭕ Execution error, try to repair the code, attempts: {round + 1}....\n')
+                        yield out.flush()
                         self.add_inspector_msg(code, msg_llm)
                         if round == 3:
                             insp_response1_content = "Try other packages or methods."
                         else:
-                            insp_response1 = self.inspector._call_chat_model()
-                            insp_response1_content = insp_response1.choices[0].message.content
+                            insp_response1_content = self.call_inspector(attempt=round)
                         self.inspector.messages.append({"role": "assistant", "content": insp_response1_content})
 
                         self.add_programmer_repair_msg(code, msg_llm, insp_response1_content)
-                        prog_response1_content = ''
-                        for message in self.programmer._call_chat_model_streaming():
-                            chat_history[-1][1] += message
-                            prog_response1_content += message
-                            yield chat_history
-                        chat_history[-1][1] += '\n🖥️ Execute code...\n'
-                        yield chat_history
+                        response = []
+                        yield from out.stream(self.call_programmer_streaming('repair', attempt=round + 1), response)
+                        prog_response1_content = ''.join(response)
+                        out.append('\n🖥️ Execute code...\n')
+                        yield out.flush()
                         self.add_programmer_msg({"role": "assistant", "content": prog_response1_content})
-                        is_python, code = extract_code(prog_response1_content)
+                        is_python, new_code = self.extract_repaired_code(prog_response1_content, code)
+                        if not is_python and self.patch_repair:  # fall back to a full rewrite
+                            self.add_programmer_msg({"role": "user", "content": CODE_FIX_FALLBACK})
+                            response = []
+                            yield from out.stream(self.call_programmer_streaming('repair', attempt=round + 1), response)
+                            prog_response1_content = ''.join(response)
+                            out.append('\n🖥️ Execute code...\n')
+                            yield out.flush()
+                            self.add_programmer_msg({"role": "assistant", "content": prog_response1_content})
+                            is_python, new_code = extract_code(prog_response1_content)
                         if is_python:
+                            code = new_code
+                            self.last_code = code
                             sign, msg_llm, exe_res = self.run_code(code)
+                            self.router.record_outcome(self.programmer_tier, bool(sign) and 'error' not in sign)
                             if sign and 'error' not in sign:
                                 self.repair_count += 1
                                 break
@@ -240,18 +433,16 @@ class Conversation():
 
                     display, link_info = self.check_folder()
                     print("Executing results:", exe_res)
-                    chat_history[-1][1] += display_exe_results(exe_res)
-                    yield chat_history
+                    out.append(display_exe_results(exe_res))
+                    yield out.flush()
                     self.add_programmer_msg({"role": "user", "content": RESULT_PROMPT.format(msg_llm)})
-                    prog_response2 = ''
-                    for message in self.programmer._call_chat_model_streaming():
-                        chat_history[-1][1] += message
-                        prog_response2 += message
-                        yield chat_history
+                    response = []
+                    yield from out.stream(self.call_programmer_streaming('summary'), response)
+                    prog_response2 = ''.join(response)
 
                     self.add_programmer_msg({"role": "assistant", "content": prog_response2})
-                    chat_history[-1][1] += f"{link_info}" if display else ''
-                    yield chat_history
+                    out.append(f"{link_info}" if display else '')
+                    yield out.flush()
             # else:
             #     chat_history[-1][1] += "\nNo code detected or code is not python code."  # todo : delete printing this?
             #     yield chat_history
@@ -260,8 +451,8 @@ class Conversation():
             #         self.programmer.messages[-1]["content"] = final_response
 
         except Exception as e:
-            chat_history[-1][1] += "\nSorry, there is an error in the program, please try again."
-            yield chat_history
+            out.append("\nSorry, there is an error in the program, please try again.")
+            yield out.flush()
             print(f"An error occurred: {e}")
             traceback.print_exc()
             if self.programmer.messages[-1]["role"] == "user":
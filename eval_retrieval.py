@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Offline evaluation of the knowledge retrieval: recall@k and latency on a labeled query set, for several weights
+of the lexical (BM25) score in the hybrid retriever. Queries labeled with "expected": null must not retrieve any
+knowledge; their share above the retrieval threshold is reported as false accepts.
+"""
+
+import argparse
+import json
+import time
+import numpy as np
+import knw_in
+from knw_index import KnowledgeIndex
+
+
+def accept_rates(labeled: list, results: list, names: dict, threshold: float) -> tuple:
+    # right top-1 above the threshold among the positive queries, any top-1 above it among the negative ones
+    accepted, false_accepts = [], []
+    for item, result in zip(labeled, results):
+        above = bool(result) and result[0][1] > threshold
+        if item["expected"] is None:
+            false_accepts.append(above)
+        else:
+            accepted.append(above and names[result[0][0]] == item["expected"])
+    return float(np.mean(accepted)) if accepted else 0.0, float(np.mean(false_accepts)) if false_accepts else 0.0
+
+
+def evaluate(index: KnowledgeIndex, labeled: list, ks: list, thresholds: list = None) -> dict:
+    names = {key: knw_in.KNW_INJECTION[key].name for key in index.keys}
+    queries = [item["query"] for item in labeled]
+    index.query_cache.clear()
+    cold, warm, results = [], [], []
+    for query in queries:  # one query at a time, like the chat
+        start = time.perf_counter()
+        results.append(index.search(query, k=max(ks)))
+        cold.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        index.search(query, k=max(ks))  # the query embedding is cached now
+        warm.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    index.search_batch(queries, k=max(ks))
+    batch = time.perf_counter() - start
+    report = {}
+    positives = [(item, result) for item, result in zip(labeled, results) if item["expected"] is not None]
+    for k in ks:
+        hits = [item["expected"] in [names[key] for key, _ in result[:k]] for item, result in positives]
+        report[f"recall@{k}"] = float(np.mean(hits)) if hits else 0.0
+    report["accepted@1"], report["false_accepts"] = accept_rates(labeled, results, names, knw_in.KNOWLEDGE_THRESHOLD)
+    for threshold in thresholds or []:
+        report[f"accepted@1 (threshold {threshold})"], report[f"false_accepts (threshold {threshold})"] = \
+            accept_rates(labeled, results, names, threshold)
+    report.update({"latency_ms_p50": 1000 * float(np.median(cold)), "latency_ms_p95": 1000 * float(np.percentile(cold, 95)),
+                   "cached_latency_ms_p50": 1000 * float(np.median(warm)),
+                   "batch_latency_ms_per_query": 1000 * batch / len(queries)})
+    misses = [{"query": item["query"], "expected": item["expected"], "got": [names[key] for key, _ in result[:1]]}
+              for item, result in positives if not result or names[result[0][0]] != item["expected"]]
+    report["misses@1"] = misses
+    report["false_accepts@1"] = [{"query": item["query"], "got": names[result[0][0]], "score": result[0][1]}
+                                 for item, result in zip(labeled, results) if item["expected"] is None and result
+                                 and result[0][1] > knw_in.KNOWLEDGE_THRESHOLD]
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the knowledge retrieval on a labeled query set.")
+    parser.add_argument('--queries', default='knowledge_queries.json',
+                        help='JSON list of {"query": ..., "expected": knowledge name or null for no knowledge}')
+    parser.add_argument('--k', type=int, nargs='+', default=[1, 3], help='cut-offs of recall@k')
+    parser.add_argument('--lexical-weights', type=float, nargs='+', default=[0.0, knw_in.LEXICAL_WEIGHT],
+                        help='weights of the lexical score to compare (0 is embedding only)')
+    parser.add_argument('--thresholds', type=float, nargs='+',
+                        help='also report accepted@1 and false accepts at these retrieval thresholds')
+    parser.add_argument('--output', help='write the report as JSON')
+    args = parser.parse_args()
+
+    with open(args.queries, 'r', encoding='utf-8') as f:
+        labeled = json.load(f)
+    knw_in.knowledge_register()
+    keys = list(knw_in.KNW_INJECTION.keys())
+    metadata = [knw_in.knowledge_metadata(knw) for knw in knw_in.KNW_INJECTION.values()]
+    model = knw_in.get_embedding_model()
+    reports = {}
+    for weight in args.lexical_weights:
+        index = KnowledgeIndex(knw_in.KNOWLEDGE_INDEX_PATH, model, knw_in.EMBEDDING_MODEL,
+                               embedding_weight=knw_in.EMBEDDING_WEIGHT, lexical_weight=weight,
+                               lexical_saturation=knw_in.LEXICAL_SATURATION)
+        index.build(keys, metadata)
+        reports[f"lexical_weight={weight}"] = evaluate(index, labeled, args.k, args.thresholds)
+
+    print(f"{len(labeled)} queries, {len(keys)} knowledge entries")
+    for name, report in reports.items():
+        print(f"\n{name}")
+        for metric, value in report.items():
+            if metric not in ("misses@1", "false_accepts@1"):
+                print(f"  {metric}: {value:.3f}")
+        for miss in report["misses@1"]:
+            print(f"  miss: {miss['query']!r} expected {miss['expected']}, got {miss['got']}")
+        for accept in report["false_accepts@1"]:
+            print(f"  false accept: {accept['query']!r} got {accept['got']} ({accept['score']:.3f})")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, indent=4)
+        print(f"\nReport saved in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
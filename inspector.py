@@ -13,9 +13,9 @@ class Inspector:
     def add_functions(self, function_lib: dict) -> None:
         self.function_repository = function_lib
 
-    def _call_chat_model(self, functions=None, include_functions=False):
+    def _call_chat_model(self, functions=None, include_functions=False, model=None):
         params = {
-            "model": self.model,
+            "model": model or self.model,
             "messages": self.messages,
         }
 
@@ -13,6 +13,8 @@ from pprint import pprint
 import nbformat
 from nbformat import v4 as nbf
 import time
+import hashlib
+import threading
 import ansi2html
 
 IPYKERNEL = os.environ.get('IPYKERNEL', 'lambda')
@@ -43,6 +45,9 @@ class CodeKernel(object):
         self.nb_path = os.path.join(session_cache_path, 'notebook.ipynb')
         self.verbose = verbose
         self.interrupt_signal = False
+        self.modules = {}  # code defined once in the namespace (e.g. knowledge), name -> (code hash, code)
+        # one request at a time, e.g. the data viewer waits for a running chat cell instead of taking its outputs
+        self.lock = threading.Lock()
 
         if python_path is None and ipython_path is None:
             env = None
@@ -70,21 +75,29 @@ class CodeKernel(object):
         self.kernel.start_channels()
         print("Code kernel started.")
 
-    def execute_code_(self, code):
-        msg_id = self.kernel.execute(code)
-        # Get the output of the code
-        msg_list = []
-        while True:
-            try:
-                iopub_msg = self.kernel.get_iopub_msg(timeout=self.max_exe_time)
-                msg_list.append(iopub_msg)
-                if iopub_msg['msg_type'] == 'status' and iopub_msg['content'].get('execution_state') == 'idle':
-                    break
-            except:
-                if self.interrupt_signal:
-                    self.kernel_manager.interrupt_kernel()
-                    self.interrupt_signal = False
-                continue
+    def execute_code_(self, code, lock_timeout=-1):
+        # with a lock_timeout, give up when another cell keeps the kernel busy for longer
+        if not self.lock.acquire(timeout=lock_timeout):
+            raise TimeoutError("the kernel is busy running another cell")
+        try:
+            msg_id = self.kernel.execute(code)
+            # Get the output of the code
+            msg_list = []
+            while True:
+                try:
+                    iopub_msg = self.kernel.get_iopub_msg(timeout=self.max_exe_time)
+                    if iopub_msg['parent_header'].get('msg_id') != msg_id:  # left over from an earlier request
+                        continue
+                    msg_list.append(iopub_msg)
+                    if iopub_msg['msg_type'] == 'status' and iopub_msg['content'].get('execution_state') == 'idle':
+                        break
+                except:
+                    if self.interrupt_signal:
+                        self.kernel_manager.interrupt_kernel()
+                        self.interrupt_signal = False
+                    continue
+        finally:
+            self.lock.release()
 
         all_output = []
         # sign = None
@@ -245,6 +258,29 @@ class CodeKernel(object):
         # Restart the backend kernel
         self.kernel_manager.restart_kernel()
         print("Backend kernel restarted.")
+        self.restore_modules()
+
+    def load_module(self, name, code) -> bool:
+        """
+        Define a module of code (e.g. the runnable code of a knowledge) in the kernel namespace, unless the same
+        code, by hash, is already defined. Return True if the code was executed.
+        """
+        code_hash = hashlib.sha1(code.encode('utf-8')).hexdigest()
+        if self.modules.get(name, (None,))[0] == code_hash:
+            return False
+        sign, msg_llm, exe_res = execute(code, self)
+        if 'error' in sign:
+            print(f"Error in loading {name} into the kernel: {exe_res}")
+            self.modules.pop(name, None)
+        else:
+            self.modules[name] = (code_hash, code)
+        return True
+
+    def restore_modules(self):
+        # a restart clears the namespace, the loaded modules are defined again
+        modules, self.modules = self.modules, {}
+        for name, (_, code) in modules.items():
+            self.load_module(name, code)
 
     def start(self):
         # Initialize the code kernel
@@ -32,14 +32,33 @@ class Nearest_Correlation_Matrix(knw):
         import scipy.io as sio
         import scipy
         import sys
+        import scipy.linalg
         import time
-
-        def NearestCorrelationMatrix(g_input, b_input=None, tau=None, tol=None):
+        import tracemalloc
+
+        # eigen backend of the solver: 'scipy' (LAPACK driver chosen by size), 'numpy', 'float32' (float32
+        # decomposition refined in float64), or any function (x, overwrite_a) -> (ascending eigenvalues, eigenvectors)
+        # evd needs about 2 n^2 extra workspace, evr is used above evd_max_n to keep the memory at about 3 n^2 floats
+        EIG_SETTINGS = {'backend': 'scipy', 'evr_max_n': 200, 'evd_max_n': 8000, 'refine_steps': 1}
+        # rows per block of the O(n^2) steps, their temporaries are block_rows x n instead of n x n; trace_memory
+        # measures the peak memory of the solver with tracemalloc, which slows down the allocations
+        WORKSPACE_SETTINGS = {'block_rows': 256, 'trace_memory': False}
+
+        def NearestCorrelationMatrix(g_input, b_input=None, tau=None, tol=None, eig_backend=None, full_output=False,
+                                     overwrite_g=False):
+            # full_output=True also returns a dict with the eigen times per iteration, the peak memory and the other
+            # statistics; overwrite_g=True symmetrizes and shifts a float64 g_input in place instead of copying it
             print('-- Semismooth Newton-CG method starts --\n')
             [n, m] = g_input.shape
-            g_input = g_input.copy()
+            # a trace started by the caller is only read: its peak, less the memory traced at the start, bounds the
+            # peak of the solver
+            tracing = tracemalloc.is_tracing()
+            if WORKSPACE_SETTINGS['trace_memory'] and not tracing:
+                tracemalloc.start()
+            traced_start = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+            g_input = np.asarray(g_input, dtype=float) if overwrite_g else np.array(g_input, dtype=float)
             t0 = time.time()  # time start
-            g_input = (g_input + g_input.transpose()) / 2.0
+            my_symmetrize(g_input)
             b_g = np.ones((n, 1))
             error_tol = 1.0e-6
             if b_input is None:
@@ -49,10 +68,10 @@ class Nearest_Correlation_Matrix(knw):
                 tau = 0
             elif tol is None:
                 b_g = b_input.copy() - tau * np.ones((n, 1))
-                g_input = g_input - tau * np.eye(n, n)
+                g_input.flat[::n + 1] -= tau
             else:
                 b_g = b_input.copy() - tau * np.ones((n, 1))
-                g_input = g_input - tau * np.eye(n, n)
+                g_input.flat[::n + 1] -= tau
                 error_tol = np.maximum(1.0e-12, tol)
 
             res_b = np.zeros((300, 1))
@@ -72,19 +91,29 @@ class Nearest_Correlation_Matrix(knw):
             prec_time = 0
             pcg_time = 0
             eig_time = 0
+            eig_times = []  # eigen time of the initial point and of each iteration, line search steps included
+            eig_calls = 0
+            eig_function = my_eig_backend(eig_backend)
+            # x_result is the only n x n buffer besides g_input and the eigenvectors: it holds g_input + diag(y), is
+            # overwritten by the eigen decomposition, then holds the PCA solution, and is the Jacobian scratch in CG
+            x_result = np.empty((n, n))
+            workspace = {}  # buffers of the Jacobian and the preconditioner, reused across the CG iterations
             c = np.ones((n, 1))
             d = np.zeros((n, 1))
-            val_g = np.sum((g_input.astype(float)) * (g_input.astype(float)))
+            val_g = np.vdot(g_input, g_input)
             val_g = val_g * 0.5
-            x_result = g_input + np.diagflat(y)
-            x_result = (x_result + x_result.transpose()) / 2.0
+            my_diag_update(g_input, y, x_result)
             eig_time0 = time.time()
-            [p_x, lamb] = my_mexeig(x_result)
-            eig_time = eig_time + (time.time() - eig_time0)
+            [p_x, lamb] = my_mexeig(x_result, eig_function, overwrite=True)
+            eig_times.append(time.time() - eig_time0)
+            eig_calls = eig_calls + 1
+            eig_time = eig_time + eig_times[-1]
             [f_0, f_y] = my_gradient(y, lamb, p_x, b_g, n)
             initial_f = val_g - f_0
-            x_result = my_pca(x_result, lamb, p_x, b_g, n)
-            val_obj = np.sum(((x_result - g_input) * (x_result - g_input))) / 2.0
+            x_result = my_own_buffer(x_result, p_x)
+            x_result = my_pca(my_diag_update(g_input, y, x_result), lamb, p_x, b_g, n, out=x_result)
+            val_obj = my_half_sq_dist(x_result, g_input)
+            my_share_buffer(workspace, x_result)
             gap = (val_obj - initial_f) / (1.0 + np.abs(initial_f) + np.abs(val_obj))
             f = f_0.copy()
             f_eval = f_eval + 1
@@ -97,17 +126,19 @@ class Nearest_Correlation_Matrix(knw):
             print('Newton-CG: Norm of Gradient: %s \n' % norm_b)
             print('Newton-CG: computing time used so far: %s \n' % time_used)
 
-            omega_12 = my_omega_mat(p_x, lamb, n)
+            omega_12 = my_omega_mat(p_x, lamb, n, workspace)
             x0 = y.copy()
 
             while np.abs(gap) > error_tol and norm_b / (1 + norm_b0) > error_tol and k < iter_whole:
                 prec_time0 = time.time()
-                c = my_precond_matrix(omega_12, p_x, n)
+                c = my_precond_matrix(omega_12, p_x, n, workspace)
                 prec_time = prec_time + (time.time() - prec_time0)
 
                 pcg_time0 = time.time()
-                [d, flag, relres, iterk] = my_pre_cg(b_input, tol_cg, maxit, c, omega_12, p_x, n)
+                [d, flag, relres, iterk] = my_pre_cg(b_input, tol_cg, maxit, c, omega_12, p_x, n, workspace)
                 pcg_time = pcg_time + (time.time() - pcg_time0)
+                omega_12 = None  # released before the eigen decompositions of the line search
+                workspace.pop('omega_complement', None)
                 print('Newton-CG: Number of CG Iterations=== %s \n' % iterk)
                 if flag == 1:
                     print('=== Not a completed Newton-CG step === \n')
@@ -115,30 +146,35 @@ class Nearest_Correlation_Matrix(knw):
                 slope = np.dot((f_y - b_g).transpose(), d)
 
                 y = (x0 + d).copy()
-                x_result = g_input + np.diagflat(y)
-                x_result = (x_result + x_result.transpose()) / 2.0
+                p_x = None  # the previous eigenvectors are released before the next decomposition
+                my_diag_update(g_input, y, x_result)
                 eig_time0 = time.time()
-                [p_x, lamb] = my_mexeig(x_result)
-                eig_time = eig_time + (time.time() - eig_time0)
+                [p_x, lamb] = my_mexeig(x_result, eig_function, overwrite=True)
+                eig_times.append(time.time() - eig_time0)
+                eig_calls = eig_calls + 1
                 [f, f_y] = my_gradient(y, lamb, p_x, b_g, n)
 
                 k_inner = 0
                 while k_inner <= iter_inner and f > f_0 + sigma_1 * (np.power(0.5, k_inner)) * slope + 1.0e-6:
                     k_inner = k_inner + 1
                     y = x0 + (np.power(0.5, k_inner)) * d
-                    x_result = g_input + np.diagflat(y)
-                    x_result = (x_result + x_result.transpose()) / 2.0
+                    p_x = None
+                    my_diag_update(g_input, y, x_result)
                     eig_time0 = time.time()
-                    [p_x, lamb] = my_mexeig(x_result)
-                    eig_time = eig_time + (time.time() - eig_time0)
+                    [p_x, lamb] = my_mexeig(x_result, eig_function, overwrite=True)
+                    eig_times[-1] = eig_times[-1] + (time.time() - eig_time0)
+                    eig_calls = eig_calls + 1
                     [f, f_y] = my_gradient(y, lamb, p_x, b_g, n)
 
                 f_eval = f_eval + k_inner + 1
+                eig_time = eig_time + eig_times[-1]
                 x0 = y.copy()
                 f_0 = f.copy()
                 val_dual = val_g - f_0
-                x_result = my_pca(x_result, lamb, p_x, b_g, n)
-                val_obj = np.sum((x_result - g_input) * (x_result - g_input)) / 2.0
+                x_result = my_own_buffer(x_result, p_x)
+                x_result = my_pca(my_diag_update(g_input, y, x_result), lamb, p_x, b_g, n, out=x_result)
+                val_obj = my_half_sq_dist(x_result, g_input)
+                my_share_buffer(workspace, x_result)
                 gap = (val_obj - val_dual) / (1 + np.abs(val_dual) + np.abs(val_obj))
                 print('Newton-CG: The relative duality gap: %s \n' % gap)
                 print('Newton-CG: The Dual objective function value: %s \n' % val_dual)
@@ -151,15 +187,22 @@ class Nearest_Correlation_Matrix(knw):
                 print('Newton-CG: Norm of Gradient: %s \n' % norm_b)
                 print('Newton-CG: Norm of Relative Gradient: %s \n' % rel_norm_b)
                 print('Newton-CG: Computing time used so for %s \n' % time_used)
+                print('Newton-CG: Eigenvalue decomposition time of the iteration: %s \n' % eig_times[-1])
                 res_b[k] = norm_b
                 k = k + 1
-                omega_12 = my_omega_mat(p_x, lamb, n)
+                omega_12 = my_omega_mat(p_x, lamb, n, workspace)
 
             position_rank = np.maximum(lamb, 0) > 0
             rank_x = (np.maximum(lamb, 0)[position_rank]).size
             final_f = val_g - f
-            x_result = x_result + tau * (np.eye(n))
+            x_result.flat[::n + 1] += tau
             time_used = time.time() - t0
+            peak_memory = None
+            if tracemalloc.is_tracing():
+                peak_memory = max(tracemalloc.get_traced_memory()[1] - traced_start, 0)
+            if WORKSPACE_SETTINGS['trace_memory'] and not tracing:
+                tracemalloc.stop()
+            workspace_memory = x_result.nbytes + sum(buffer.nbytes for buffer in workspace.values() if buffer.base is None)
             print('\n')
 
             print('Newton-CG: Number of iterations: %s \n' % k)
@@ -172,64 +215,119 @@ class Nearest_Correlation_Matrix(knw):
             print('Newton-CG: computing time for linear system solving (cgs time): %s \n' % pcg_time)
             print('Newton-CG: computing time for eigenvalue decompositions: =============== %s \n' % eig_time)
             print('Newton-CG: computing time used for equal weight calibration ============ %s \n' % time_used)
-
+            if peak_memory is not None:
+                print('Newton-CG: peak memory of the arrays allocated by the solver: %.1f MB \n' % (peak_memory / 2 ** 20))
+
+            if full_output:
+                info = {'iterations': k, 'function_evaluations': f_eval, 'eig_calls': eig_calls,
+                        'eig_backend': getattr(eig_function, '__name__', str(eig_function)),
+                        'eig_time': eig_time, 'eig_times': eig_times, 'prec_time': prec_time, 'pcg_time': pcg_time,
+                        'time': time_used, 'gap': float(np.ravel(gap)[0]), 'rank': rank_x,
+                        'peak_memory_mb': None if peak_memory is None else peak_memory / 2 ** 20,
+                        'workspace_mb': workspace_memory / 2 ** 20}
+                return x_result, y, info
             return x_result, y
 
-        def my_gradient(y_input, lamb, p_input, b_0, n):
-            f = 0.0
-            Fy = np.zeros((n, 1))
-            p_input_copy = (p_input.copy()).transpose()
-            for i in range(0, n):
-                p_input_copy[i, :] = ((np.maximum(lamb[i], 0).astype(float)) ** 0.5) * p_input_copy[i, :]
+        # workspace: blocks of rows and buffers reused across iterations
+
+
+        def my_row_blocks(n):
+            step = WORKSPACE_SETTINGS['block_rows']
+            for start in range(0, n, step):
+                yield slice(start, min(start + step, n))
+
+
+        def my_buffer(workspace, name, shape):
+            # C-contiguous array of the given shape on a buffer of the workspace, reallocated only when too small
+            size = int(np.prod(shape))
+            if workspace is None:
+                return np.empty(shape)
+            buffer = workspace.get(name)
+            if buffer is None or buffer.size < size:
+                buffer = workspace[name] = np.empty(size)
+            return buffer[:size].reshape(shape)
+
+
+        def my_own_buffer(buffer, p_x):
+            # evd returns the eigenvectors in its overwritten input, a new buffer then takes the next results
+            return np.empty_like(buffer) if np.may_share_memory(buffer, p_x) else buffer
+
 
-            for i in range(0, n):
-                Fy[i] = np.sum(p_input_copy[:, i] * p_input_copy[:, i])
+        def my_share_buffer(workspace, buffer):
+            # the n x r (n x s) Jacobian buffers are the two halves of an n x n buffer that CG does not read
+            half = buffer.size // 2
+            workspace['hmat'] = buffer.reshape(-1)[0:half]
+            workspace['mmat'] = buffer.reshape(-1)[half:2 * half]
 
-            for i in range(0, n):
-                f = f + np.square((np.maximum(lamb[i], 0)))
 
-            f = 0.5 * f - np.dot(b_0.transpose(), y_input)
+        def my_symmetrize(x_input):
+            # x = (x + x^T) / 2 in place, block by block
+            n = x_input.shape[0]
+            for rows in my_row_blocks(n):
+                for cols in my_row_blocks(n):
+                    if cols.start >= rows.start:
+                        block = (x_input[rows, cols] + x_input[cols, rows].transpose()) / 2.0
+                        x_input[rows, cols] = block
+                        x_input[cols, rows] = block.transpose()
+            return x_input
+
+
+        def my_diag_update(g_input, y, out):
+            # out = g + diag(y), without the n x n diagonal matrix
+            np.copyto(out, g_input)
+            out.flat[::out.shape[0] + 1] += np.ravel(y)
+            return out
+
+
+        def my_half_sq_dist(x_input, g_input):
+            # ||x - g||_F^2 / 2 by blocks of rows
+            total = 0.0
+            for rows in my_row_blocks(x_input.shape[0]):
+                diff = x_input[rows] - g_input[rows]
+                total = total + np.vdot(diff, diff)
+            return total / 2.0
+
+
+        def my_gradient(y_input, lamb, p_input, b_0, n):
+            # Fy = diag(P max(lamb, 0) P^T), by blocks of rows of P * P; the eigenvalues are in descending order
+            lamb_p = np.maximum(np.asarray(lamb, dtype=float).reshape(n), 0)
+            r = np.count_nonzero(lamb_p)
+            Fy = np.empty((n, 1))
+            for rows in my_row_blocks(n):
+                Fy[rows, 0] = np.dot(p_input[rows, 0:r] * p_input[rows, 0:r], lamb_p[0:r])
+            f = 0.5 * np.sum(lamb_p * lamb_p) - np.dot(b_0.transpose(), y_input)
 
             return f, Fy
 
 
         # use PCA to generate a primal feasible solution checked
 
-        def my_pca(x_input, lamb, p_input, b_0, n):
-            x_pca = x_input
-            lamb = np.asarray(lamb)
-            lp = lamb > 0
-            r = lamb[lp].size
+        def my_pca(x_input, lamb, p_input, b_0, n, out=None):
+            # out may be x_input itself, which is then updated in place
+            lamb = np.asarray(lamb).reshape(n)
+            r = np.count_nonzero(lamb > 0)
+            x_pca = np.empty((n, n)) if out is None else out
             if r == 0:
-                x_pca = np.zeros((n, n))
+                x_pca.fill(0.0)
             elif r == n:
-                x_pca = x_input
+                if x_pca is not x_input:
+                    np.copyto(x_pca, x_input)
             elif r < (n / 2.0):
-                lamb1 = lamb[lp].copy()
-                lamb1 = lamb1.transpose()
-                lamb1 = np.sqrt(lamb1.astype(float))
-                P1 = p_input[:, 0:r].copy()
-                if r > 1:
-                    P1 = np.dot(P1, np.diagflat(lamb1))
-                    x_pca = np.dot(P1, P1.transpose())
-                else:
-                    x_pca = np.dot(np.dot(np.square(lamb1), P1), P1.transpose())
-
+                p_1 = p_input[:, 0:r] * np.sqrt(lamb[0:r].astype(float))
+                for rows in my_row_blocks(n):
+                    np.dot(p_1[rows], p_1.transpose(), out=x_pca[rows])
             else:
-                lamb2 = -lamb[r:n].copy()
-                lamb2 = np.sqrt(lamb2.astype(float))
-                p_2 = p_input[:, r:n]
-                p_2 = np.dot(p_2, np.diagflat(lamb2))
-                x_pca = x_pca + np.dot(p_2, p_2.transpose())
+                p_2 = p_input[:, r:n] * np.sqrt(-lamb[r:n].astype(float))
+                for rows in my_row_blocks(n):
+                    x_pca[rows] = x_input[rows] + np.dot(p_2[rows], p_2.transpose())
 
             # To make x_pca positive semidefinite with diagonal elements exactly b0
-            d = x_pca.diagonal()
-            d = d.reshape((d.size, 1))
-            d = np.maximum(d, b_0.reshape(d.shape))
-            x_pca = x_pca - np.diagflat(x_pca.diagonal()) + np.diagflat(d)
-            d = d.astype(float) ** (-0.5)
-            d = d * ((np.sqrt(b_0.astype(float))).reshape(d.shape))
-            x_pca = x_pca * (np.dot(d, d.reshape(1, d.size)))
+            b_0 = np.ravel(b_0).astype(float)
+            d = np.maximum(x_pca.diagonal(), b_0)
+            x_pca.flat[::n + 1] = d
+            d = d ** (-0.5) * np.sqrt(b_0)
+            x_pca *= d[:, np.newaxis]
+            x_pca *= d[np.newaxis, :]
 
             return x_pca
 
@@ -240,79 +338,70 @@ class Nearest_Correlation_Matrix(knw):
         # To generate the first order essential part of d
 
 
-        def my_omega_mat(p_input, lamb, n):
-            idx_idp = np.where(lamb > 0)
-            idx_idp = idx_idp[0]
-            idx_idm = np.setdiff1d(range(0, n), idx_idp)
-            n = lamb.size
-            r = idx_idp.size
-            if r > 0:
-                if r == n:
-                    omega_12 = np.ones((n, n))
-                else:
-                    s = n - r
-                    dp = lamb[0:r].copy()
-                    dp = dp.reshape(dp.size, 1)
-                    dn = lamb[r:n].copy()
-                    dn = dn.reshape((dn.size, 1))
-                    omega_12 = np.dot(dp, np.ones((1, s)))
-                    omega_12 = omega_12 / (np.dot(np.abs(dp), np.ones((1, s))) + np.dot(np.ones((r, 1)), abs(dn.transpose())))
-                    omega_12 = omega_12.reshape((r, s))
-
+        def my_omega_mat(p_input, lamb, n, workspace=None):
+            # with a workspace, 1 - omega_12 is stored there for the Jacobian and the preconditioner
+            lamb = np.asarray(lamb).reshape(n)
+            r = np.count_nonzero(lamb > 0)
+            if r == n:
+                omega_12 = np.ones((n, 0))  # only the shape (r, s) is used
+            elif r > 0:
+                dp = lamb[0:r].reshape((r, 1))
+                dn = lamb[r:n].reshape((1, n - r))
+                omega_12 = np.abs(dp) + np.abs(dn)
+                np.divide(dp, omega_12, out=omega_12)
+                if workspace is not None and r >= n / 2.0:
+                    np.subtract(1.0, omega_12, out=my_buffer(workspace, 'omega_complement', omega_12.shape))
             else:
-                omega_12 = np.array([])
+                omega_12 = np.zeros((0, n))
 
             return omega_12
 
 
+        def my_omega_complement(omega_12, workspace=None):
+            if workspace is not None and 'omega_complement' in workspace:
+                return my_buffer(workspace, 'omega_complement', omega_12.shape)
+            return 1.0 - omega_12
+
+
         # End of my_omega_mat
 
 
         # To generate Jacobian
 
 
-        def my_jacobian_matrix(x, omega_12, p_input, n):
+        def my_jacobian_matrix(x, omega_12, p_input, n, workspace=None):
+            # diag(P H) is taken as row sums of P_1 * (P M) (P_2 * (P M) when r >= n/2), M stacks the r (or s) wide
+            # products and the two equal off-diagonal contributions; the n x r (n x s) arrays are workspace buffers
             x_result = np.zeros((n, 1))
+            x = x.reshape((n, 1))
             [r, s] = omega_12.shape
             if r > 0:
-                hmat_1 = p_input[:, 0:r].copy()
+                p_1 = p_input[:, 0:r]
+                p_2 = p_input[:, r:n]
                 if r < n / 2.0:
-                    i = 0
-                    while i < n:
-                        hmat_1[i, :] = x[i] * hmat_1[i, :]
-                        i = i + 1
-
-                    omega_12 = omega_12 * (np.dot(hmat_1.transpose(), p_input[:, r:n]))
-                    hmat = np.dot(hmat_1.transpose(), np.dot(p_input[:, 0:r], p_input[:, 0:r].transpose()))
-                    hmat = hmat + np.dot(omega_12, p_input[:, r:n].transpose())
-                    hmat = np.vstack((hmat, np.dot(omega_12.transpose(), p_input[:, 0:r].transpose())))
-                    i = 0
-                    while i < n:
-                        x_result[i] = np.dot(p_input[i, :], hmat[:, i])
-                        x_result[i] = x_result[i] + 1.0e-10 * x[i]
-                        i = i + 1
+                    hmat_1 = np.multiply(x, p_1, out=my_buffer(workspace, 'hmat', (n, r)))
+                    mmat = my_buffer(workspace, 'mmat', (n, r))
+                    np.dot(p_1.transpose(), hmat_1, out=mmat[0:r])
+                    np.dot(p_2.transpose(), hmat_1, out=mmat[r:n])
+                    mmat[r:n] *= omega_12.transpose()
+                    mmat[r:n] *= 2.0
+                    hmat = np.dot(p_input, mmat, out=hmat_1)
+                    hmat *= p_1
+                    x_result = np.sum(hmat, axis=1).reshape((n, 1)) + 1.0e-10 * x
 
                 else:
                     if r == n:
-                        x_result = 1.0e-10 * x
+                        x_result = x + 1.0e-10 * x  # all eigenvalues positive: the Jacobian is the identity
                     else:
-                        hmat_2 = p_input[:, r:n].copy()
-                        i = 0
-                        while i < n:
-                            hmat_2[i, :] = x[i] * hmat_2[i, :]
-                            i = i + 1
-
-                        omega_12 = np.ones((r, s)) - omega_12
-                        omega_12 = omega_12 * (np.dot(p_input[:, 0:r].transpose(), hmat_2))
-                        hmat = np.dot(p_input[:, r:n].transpose(), hmat_2)
-                        hmat = np.dot(hmat, p_input[:, r:n].transpose())
-                        hmat = hmat + np.dot(omega_12.transpose(), p_input[:, 0:r].transpose())
-                        hmat = np.vstack((np.dot(omega_12, p_input[:, r:n].transpose()), hmat))
-                        i = 0
-                        while i < n:
-                            x_result[i] = np.dot(-p_input[i, :], hmat[:, i])
-                            x_result[i] = x[i] + x_result[i] + 1.0e-10 * x[i]
-                            i = i + 1
+                        hmat_2 = np.multiply(x, p_2, out=my_buffer(workspace, 'hmat', (n, s)))
+                        mmat = my_buffer(workspace, 'mmat', (n, s))
+                        np.dot(p_1.transpose(), hmat_2, out=mmat[0:r])
+                        mmat[0:r] *= my_omega_complement(omega_12, workspace)
+                        mmat[0:r] *= 2.0
+                        np.dot(p_2.transpose(), hmat_2, out=mmat[r:n])
+                        hmat = np.dot(p_input, mmat, out=hmat_2)
+                        hmat *= p_2
+                        x_result = x - np.sum(hmat, axis=1).reshape((n, 1)) + 1.0e-10 * x
 
             return x_result
 
@@ -321,7 +410,7 @@ class Nearest_Correlation_Matrix(knw):
         # PCG Method
 
 
-        def my_pre_cg(b, tol, maxit, c, omega_12, p_input, n):
+        def my_pre_cg(b, tol, maxit, c, omega_12, p_input, n, workspace=None):
             # Initializations
             r = b.copy()
             r = r.reshape(r.size, 1)
@@ -344,7 +433,7 @@ class Nearest_Correlation_Matrix(knw):
                     beta = rz_1 / rz_2
                     d = z + beta * d
 
-                w = my_jacobian_matrix(d, omega_12, p_input, n)
+                w = my_jacobian_matrix(d, omega_12, p_input, n, workspace)
                 denom = np.dot(d.transpose(), w)
                 iterk = k + 1
                 relres = np.linalg.norm(r) / n2b
@@ -375,40 +464,22 @@ class Nearest_Correlation_Matrix(knw):
         # to generate the diagonal preconditioner
 
 
-        def my_precond_matrix(omega_12, p_input, n):
+        def my_precond_matrix(omega_12, p_input, n, workspace=None):
+            # c_i = (sum_k P_ik^2)^2 + 2 sum_jk P_ij^2 Omega_jk P_ik^2 over the blocks, by blocks of rows of P * P
             [r, s] = omega_12.shape
             c = np.ones((n, 1))
-            if r > 0:
-                if r < n / 2.0:
-                    hmat = (p_input.copy()).transpose()
-                    hmat = hmat * hmat
-                    hmat_12 = np.dot(hmat[0:r, :].transpose(), omega_12)
-                    d = np.ones((r, 1))
-                    for i in range(0, n):
-                        c_temp = np.dot(d.transpose(), hmat[0:r, i])
-                        c_temp = c_temp * hmat[0:r, i]
-                        c[i] = np.sum(c_temp)
-                        c[i] = c[i] + 2.0 * np.dot(hmat_12[i, :], hmat[r:n, i])
-                        if c[i] < 1.0e-8:
-                            c[i] = 1.0e-8
-
-                else:
-                    if r < n:
-                        hmat = (p_input.copy()).transpose()
-                        hmat = hmat * hmat
-                        omega_12 = np.ones((r, s)) - omega_12
-                        hmat_12 = np.dot(omega_12, hmat[r:n, :])
-                        d = np.ones((s, 1))
-                        dd = np.ones((n, 1))
-
-                        for i in range(0, n):
-                            c_temp = np.dot(d.transpose(), hmat[r:n, i])
-                            c[i] = np.sum(c_temp * hmat[r:n, i])
-                            c[i] = c[i] + 2.0 * np.dot(hmat[0:r, i].transpose(), hmat_12[:, i])
-                            alpha = np.sum(hmat[:, i])
-                            c[i] = alpha * np.dot(hmat[:, i].transpose(), dd) - c[i]
-                            if c[i] < 1.0e-8:
-                                c[i] = 1.0e-8
+            if 0 < r < n:
+                omega_c = my_omega_complement(omega_12, workspace) if r >= n / 2.0 else None
+                for rows in my_row_blocks(n):
+                    hmat = p_input[rows] * p_input[rows]
+                    if r < n / 2.0:
+                        c_rows = np.sum(hmat[:, 0:r], axis=1) ** 2
+                        c_rows = c_rows + 2.0 * np.sum(np.dot(hmat[:, 0:r], omega_12) * hmat[:, r:n], axis=1)
+                    else:
+                        c_rows = np.sum(hmat[:, r:n], axis=1) ** 2
+                        c_rows = c_rows + 2.0 * np.sum(hmat[:, 0:r] * np.dot(hmat[:, r:n], omega_c.transpose()), axis=1)
+                        c_rows = np.sum(hmat, axis=1) ** 2 - c_rows
+                    c[rows, 0] = np.maximum(c_rows, 1.0e-8)
 
             return c
 
@@ -419,59 +490,107 @@ class Nearest_Correlation_Matrix(knw):
         # my_issorted()
 
         def my_issorted(x_input, flag):
-            n = x_input.size
-            tf_value = False
-            if n < 2:
-                tf_value = True
-            else:
-                if flag == 1:
-                    i = 0
-                    while i < n - 1:
-                        if x_input[i] <= x_input[i + 1]:
-                            i = i + 1
-                        else:
-                            break
-
-                    if i == n - 1:
-                        tf_value = True
-                    elif i < n - 1:
-                        tf_value = False
-
-                elif flag == -1:
-                    i = n - 1
-                    while i > 0:
-                        if x_input[i] <= x_input[i - 1]:
-                            i = i - 1
-                        else:
-                            break
-
-                    if i == 0:
-                        tf_value = True
-                    elif i > 0:
-                        tf_value = False
-
-            return tf_value
+            # flag 1: non-decreasing, flag -1: non-increasing
+            x_input = np.ravel(x_input)
+            if x_input.size < 2:
+                return True
+            if flag == 1:
+                return bool(np.all(x_input[:-1] <= x_input[1:]))
+            elif flag == -1:
+                return bool(np.all(x_input[1:] <= x_input[:-1]))
+            return False
 
 
         # end of my_issorted()
 
+        # eigen backends, each returns the eigenvalues in ascending order and the eigenvectors as columns
+
+
+        def eig_numpy(x_input, overwrite_a=False):
+            return np.linalg.eigh(x_input)
 
-        def my_mexeig(x_input):
+
+        def eig_scipy(x_input, overwrite_a=False):
+            # MRRR (evr) for small matrices and, for its O(n) workspace, for the very large ones; divide and
+            # conquer (evd) in between. The symmetric input is passed in Fortran order so that it can be overwritten
+            n = x_input.shape[0]
+            driver = 'evd' if EIG_SETTINGS['evr_max_n'] < n <= EIG_SETTINGS['evd_max_n'] else 'evr'
+            if x_input.flags['C_CONTIGUOUS']:
+                x_input = x_input.transpose()
+            return scipy.linalg.eigh(x_input, driver=driver, overwrite_a=overwrite_a, check_finite=False)
+
+
+        def my_norm2(m_input, steps=20):
+            # estimate of the spectral norm of a symmetric matrix by power iterations
+            v = np.ones(m_input.shape[0]) / np.sqrt(m_input.shape[0])
+            norm = 0.0
+            for _ in range(steps):
+                w = np.dot(m_input, v)
+                norm = np.linalg.norm(w)
+                if norm == 0:
+                    break
+                v = w / norm
+            return norm
+
+
+        def my_refine_eig(x_input, lamb, p_x):
+            # one step of the Ogita-Aishima refinement in float64, matrix products only
+            n = x_input.shape[0]
+            r = np.eye(n) - np.dot(p_x.transpose(), p_x)
+            s = np.dot(p_x.transpose(), np.dot(x_input, p_x))
+            lamb = np.diag(s) / (1.0 - np.diag(r))
+            delta = 2.0 * (my_norm2(s - np.diag(lamb)) + np.max(np.abs(lamb)) * my_norm2(r))
+            gaps = lamb[np.newaxis, :] - lamb[:, np.newaxis]
+            apart = np.abs(gaps) > delta  # (nearly) multiple eigenvalues are only orthogonalized
+            e = np.where(apart, (s + lamb[np.newaxis, :] * r) / np.where(apart, gaps, 1.0), r / 2.0)
+            return lamb, p_x + np.dot(p_x, e)
+
+
+        def eig_float32(x_input, overwrite_a=False):
+            # faster where matrix products scale better than the eigensolver (multi-threaded BLAS)
+            [lamb, p_x] = scipy.linalg.eigh(x_input.astype(np.float32), driver='evd', check_finite=False)
+            lamb, p_x = lamb.astype(float), p_x.astype(float)
+            for _ in range(EIG_SETTINGS['refine_steps']):
+                lamb, p_x = my_refine_eig(x_input, lamb, p_x)
+            return lamb, p_x
+
+
+        EIG_BACKENDS = {'numpy': eig_numpy, 'scipy': eig_scipy, 'float32': eig_float32}
+
+
+        def my_eig_backend(backend=None):
+            backend = EIG_SETTINGS['backend'] if backend is None else backend
+            if callable(backend):
+                return backend
+            if backend not in EIG_BACKENDS:
+                raise ValueError(f"Invalid eigen backend: {backend}, please choose from {list(EIG_BACKENDS)}.")
+            return EIG_BACKENDS[backend]
+
+
+        def my_reverse_columns(p_input):
+            # p = p[:, ::-1] in place, swapping blocks of columns
+            n = p_input.shape[1]
+            step = WORKSPACE_SETTINGS['block_rows']
+            for start in range(0, n // 2, step):
+                stop = min(start + step, n // 2)
+                left = p_input[:, start:stop].copy()
+                p_input[:, start:stop] = p_input[:, n - stop:n - start][:, ::-1]
+                p_input[:, n - stop:n - start] = left[:, ::-1]
+            return p_input
+
+
+        def my_mexeig(x_input, eig_function=eig_numpy, overwrite=False):
+            # overwrite=True lets the backend destroy x_input instead of copying it
             [n, m] = x_input.shape
-            [lamb, p_x] = np.linalg.eigh(x_input)
-            # lamb = lamb.reshape((lamb.size, 1))
+            [lamb, p_x] = eig_function(x_input, overwrite_a=True) if overwrite else eig_function(x_input)
             p_x = p_x.real
             lamb = lamb.real
             if my_issorted(lamb, 1):
-                lamb = lamb[::-1]
-                p_x = np.fliplr(p_x)
-            elif my_issorted(lamb, -1):
-                return p_x, lamb
-            else:
+                lamb = lamb[::-1].copy()
+                p_x = my_reverse_columns(p_x)
+            elif not my_issorted(lamb, -1):
                 idx = np.argsort(-lamb)
-                # lamb_old = lamb   # add for debug
                 lamb = lamb[idx]
-                # p_x_old = p_x   add for debug
                 p_x = p_x[:, idx]
 
             lamb = lamb.reshape((n, 1))
@@ -1,40 +1,95 @@
-import torch
 import sys
-from sentence_transformers import SentenceTransformer, util
+import threading
 import numpy as np
 # from knw import KNW_INJECTION, knowledge_injection
 from prompt_engineering.prompts import PMT_KNW_IN_CORE, PMT_KNW_IN_FULL
 # from config import rag_mode
-from knowledge_integration.ncm import Nearest_Correlation_Matrix
-from knowledge_integration.nn_network import nn_networks
-from knowledge_integration.pami import pattern_mining
-from kernel import execute
+from knw_index import KnowledgeIndex
+from knw_registry import discover_knowledge
 
 
 KNW_INJECTION = {}
+KNOWLEDGE_DIRS = []  # directories of knowledge plugins besides knowledge_integration/
+
 
 def knowledge_register():
-    ncm = Nearest_Correlation_Matrix()
-    ncm_key = ncm.name+ncm.description
-    KNW_INJECTION[ncm_key] = ncm
-    nnn = nn_networks()
-    nnn_key = nnn.name+nnn.description
-    KNW_INJECTION[nnn_key] = nnn
-    pami = pattern_mining()
-    pami_key = pami.name+pami.description
-    KNW_INJECTION[pami_key] = pami
-
-embeding_model = SentenceTransformer('all-MiniLM-L6-v2')
-
-def search_knowledge(user_input, knowledge_embeddings, knowledge_keys):
-    input_embedding = embeding_model.encode(user_input, convert_to_tensor=True)
-    similarities_list = util.pytorch_cos_sim(input_embedding, knowledge_embeddings)
-    if torch.max(similarities_list) > 0.5:
-        best_match_idx = np.argmax(similarities_list.cpu())
-        best_match_key = knowledge_keys[best_match_idx]
-    else:
-        best_match_key = False
-    return (best_match_key, KNW_INJECTION[best_match_key]) if best_match_key else (False, None)
+    # only the metadata of the knowledge modules is read here, their code is imported when retrieved
+    if KNW_INJECTION:  # registered once per process
+        return
+    for entry in discover_knowledge(KNOWLEDGE_DIRS):
+        KNW_INJECTION[entry.key] = entry
+
+
+def add_knowledge_dirs(directories):
+    for directory in directories:
+        if directory not in KNOWLEDGE_DIRS:
+            KNOWLEDGE_DIRS.append(directory)
+
+EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+KNOWLEDGE_INDEX_PATH = 'cache/knowledge_index.npz'
+KNOWLEDGE_THRESHOLD = 0.55  # minimum (hybrid) score of a retrieved entry, see eval_retrieval.py --thresholds
+EMBEDDING_WEIGHT = 1.0
+LEXICAL_WEIGHT = 0.3  # weight of the saturated BM25 score, 0 for embedding only
+LEXICAL_SATURATION = 3.0  # BM25 score counted as half a match
+embeding_model = None
+knowledge_index = None
+index_lock = threading.Lock()
+
+
+def knowledge_metadata(knw) -> dict:
+    return {"name": knw.name, "mode": knw.mode, "type": knw.class_name}
+
+
+def get_embedding_model():
+    # sentence_transformers (and torch) are imported on first use, deployments without retrieval never load them
+    global embeding_model
+    if embeding_model is None:
+        from sentence_transformers import SentenceTransformer
+        embeding_model = SentenceTransformer(EMBEDDING_MODEL)
+    return embeding_model
+
+
+def get_knowledge_index():
+    # the knowledge is registered and embedded once, the vectors are reused across messages and sessions
+    global knowledge_index
+    with index_lock:
+        if knowledge_index is None:
+            knowledge_register()
+            index = KnowledgeIndex(KNOWLEDGE_INDEX_PATH, get_embedding_model(), EMBEDDING_MODEL,
+                                   embedding_weight=EMBEDDING_WEIGHT, lexical_weight=LEXICAL_WEIGHT,
+                                   lexical_saturation=LEXICAL_SATURATION)
+            index.build(list(KNW_INJECTION.keys()), [knowledge_metadata(knw) for knw in KNW_INJECTION.values()])
+            knowledge_index = index
+    return knowledge_index
+
+
+def warm_up():
+    """
+    Load the embedding model and the knowledge index in a background thread, so that the first retrieval does
+    not wait for them.
+    """
+    def run():
+        try:
+            get_knowledge_index()
+            print("Knowledge retrieval warmed up.")
+        except Exception as e:
+            print(f"Error in warming up knowledge retrieval: {e}")
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def search_knowledge(user_input, index: KnowledgeIndex, where=None):
+    matches = index.search(user_input, k=1, where=where)
+    if not matches or matches[0][1] <= KNOWLEDGE_THRESHOLD:
+        return False, None
+    return matches[0][0], KNW_INJECTION[matches[0][0]]
+
+
+def search_knowledge_batch(user_inputs, k=5, where=None):
+    """
+    Top-k [(key, similarity)] of each input, in one embedding call and one vectorized search (validation runs).
+    """
+    return get_knowledge_index().search_batch(user_inputs, k=k, where=where)
 
 
 def format_code_snaps(knw, kernel):
@@ -45,7 +100,10 @@ def format_code_snaps(knw, kernel):
         return PMT_KNW_IN_FULL.format(desc=desc, code=knw.get_all_code())
     elif knw.mode == 'core':
         code_backend = knw.get_runnable_function()
-        print("Knowledge_integration: core mode, runnable result: ", execute(code_backend,kernel))
+        if kernel.load_module(knw.name, code_backend):
+            print(f"Knowledge_integration: core mode, {knw.name} defined in the kernel.")
+        else:
+            print(f"Knowledge_integration: core mode, {knw.name} already defined in the kernel.")
         retrieval_knw = PMT_KNW_IN_CORE.format(desc=desc, core=core_code, code_backend=code_backend)
         return retrieval_knw
     else:
@@ -53,12 +111,26 @@ def format_code_snaps(knw, kernel):
         raise ValueError(f"Invalid mode: {knw.mode}, please choose from ['full', 'core'].")
 
 
-def retrieval_knowledge(instruction, kernel): # return code_snaps and mode: 'full' or runnable code in 'core'. Nothing retrieval, return None
+def preload_knowledge(kernel, names=None):
+    """
+    Define the runnable code of the core-mode knowledge (all, or the given names) in the kernel at startup, so
+    that retrieval hits do not execute it. The kernel restores it after a restart.
+    """
     knowledge_register()
-    knowledge_keys = list(KNW_INJECTION.keys())
-    knowledge_embeddings = embeding_model.encode(knowledge_keys, convert_to_tensor=True)
-    best_key, best_knw_object = search_knowledge(instruction, knowledge_embeddings, knowledge_keys)
-    if best_key:
+    for knw in KNW_INJECTION.values():
+        if knw.mode == 'core' and (names is None or knw.name in names):
+            kernel.load_module(knw.name, knw.get_runnable_function())
+
+
+def find_knowledge(instruction):
+    # the search only (no kernel access), safe to run in a background thread
+    best_key, best_knw_object = search_knowledge(instruction, get_knowledge_index())
+    return best_knw_object if best_key else None
+
+
+def retrieval_knowledge(instruction, kernel): # return code_snaps and mode: 'full' or runnable code in 'core'. Nothing retrieval, return None
+    best_knw_object = find_knowledge(instruction)
+    if best_knw_object:
         return format_code_snaps(best_knw_object, kernel)
     else:
         return None
@@ -0,0 +1,288 @@
+import hashlib
+import os
+import re
+from collections import OrderedDict
+import numpy as np
+
+
+def content_hash(text, model_name) -> str:
+    # the vector of an entry depends on its text and on the embedding model
+    return hashlib.sha1(f"{model_name}\n{text}".encode('utf-8')).hexdigest()
+
+
+def metadata_mask(metadata: list, where) -> np.ndarray | None:
+    """
+    Boolean mask of the entries matching a filter: a dict of required metadata values (a list or tuple value
+    matches any of its items) or a function of the metadata. None for no filter.
+    """
+    if where is None:
+        return None
+    if callable(where):
+        return np.array([bool(where(meta)) for meta in metadata], dtype=bool)
+    def match(meta):
+        return all(meta.get(key) in value if isinstance(value, (list, tuple, set)) else meta.get(key) == value
+                   for key, value in where.items())
+    return np.array([match(meta) for meta in metadata], dtype=bool)
+
+
+def top_k(scores: np.ndarray, k) -> tuple:
+    # indices and scores of the k best columns of each row, best first
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.empty((len(scores), 0), dtype=np.int64), np.empty((len(scores), 0), dtype=scores.dtype)
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    best_scores = np.take_along_axis(scores, best, axis=1)
+    order = np.argsort(-best_scores, axis=1)
+    return np.take_along_axis(best, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+class ExactIndex:
+    """
+    Exact inner product search, vectorized over blocks of entries so that the score matrix of a query batch
+    stays bounded; the top-k of each block is merged with the running top-k.
+    """
+
+    def __init__(self, vectors: np.ndarray, block_size=65536):
+        self.vectors = vectors
+        self.block_size = block_size
+
+    def search(self, queries: np.ndarray, k=5, mask=None) -> tuple:
+        indices = np.empty((len(queries), 0), dtype=np.int64)
+        scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(self.vectors), self.block_size):
+            block = queries @ self.vectors[start:start + self.block_size].T
+            if mask is not None:
+                block[:, ~mask[start:start + self.block_size]] = -np.inf
+            block_indices, block_scores = top_k(block, k)
+            candidates = np.concatenate([indices, block_indices + start], axis=1)
+            best, scores = top_k(np.concatenate([scores, block_scores], axis=1), k)
+            indices = np.take_along_axis(candidates, best, axis=1)
+        return indices, scores
+
+
+class IVFIndex:
+    """
+    Approximate inverted file index: the vectors are clustered with spherical k-means (about sqrt(n) lists) and a
+    query only scores the entries of its nprobe closest lists, so the cost per query grows like sqrt(n).
+    """
+
+    def __init__(self, vectors: np.ndarray, nlist=None, nprobe=8, iterations=10, train_per_list=64, seed=0):
+        self.nprobe = nprobe
+        nlist = min(nlist or max(int(np.sqrt(len(vectors))), 1), len(vectors))
+        rng = np.random.default_rng(seed)
+        # k-means is trained on a sample of train_per_list vectors per list
+        train = vectors[rng.choice(len(vectors), min(len(vectors), nlist * train_per_list), replace=False)]
+        self.centroids = train[:nlist].copy()
+        for _ in range(iterations):
+            order, offsets = self.assign(train)
+            counts = np.diff(np.append(offsets, len(train)))
+            sums = np.add.reduceat(train[order], offsets[counts > 0], axis=0)
+            self.centroids[counts > 0] = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+        # the vectors of a list are stored contiguously
+        self.order, self.offsets = self.assign(vectors)
+        self.offsets = np.append(self.offsets, len(vectors))
+        self.vectors = vectors[self.order]
+
+    def assign(self, vectors) -> tuple:
+        # entries sorted by closest centroid, and the offset of each list in that order
+        assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+        order = np.argsort(assignment, kind='stable')
+        return order, np.searchsorted(assignment[order], np.arange(len(self.centroids)))
+
+    def search(self, queries: np.ndarray, k=5, mask=None) -> tuple:
+        probes = top_k(queries @ self.centroids.T, self.nprobe)[0]
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for i, query in enumerate(queries):
+            positions = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in probes[i]])
+            if mask is not None:
+                positions = positions[mask[self.order[positions]]]
+            best, best_scores = top_k((self.vectors[positions] @ query)[None, :], k)
+            indices[i, :best.shape[1]] = self.order[positions[best[0]]]
+            scores[i, :best.shape[1]] = best_scores[0]
+        return indices, scores
+
+
+STOPWORDS = frozenset("""
+a about above after again all also am an and any are as at be because been before being below between both but by
+can could did do does doing down during each few for from further had has have having he her here hers him his how
+i if in into is it its itself just me more most my myself no nor not now of off on once only or other our ours out
+over own please same she should so some such than that the their them then there these they this those through to
+too under until up very was we were what when where which while who whom why will with would you your yours
+""".split())
+
+
+def tokenize(text) -> list:
+    # words in lower case without stopwords; identifiers also give their parts, e.g. nearest_correlation_matrix and
+    # NearestCorrelation
+    tokens = []
+    for word in re.findall(r'[A-Za-z0-9_]+', text):
+        parts = [part for part in re.split(r'_|(?<=[a-z0-9])(?=[A-Z])', word) if part]
+        tokens.append(word.lower())
+        if len(parts) > 1:
+            tokens += [part.lower() for part in parts]
+    return [token for token in tokens if token not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Lexical scorer: BM25 over an inverted index (term -> entry ids and term frequencies), so a query only
+    touches the postings of its terms.
+    """
+
+    def __init__(self, texts, k1=1.5, b=0.75):
+        self.k1, self.b = k1, b
+        self.size = len(texts)
+        postings = {}
+        lengths = np.zeros(len(texts), dtype=np.float32)
+        for i, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths[i] = len(tokens)
+            for term in set(tokens):
+                postings.setdefault(term, []).append((i, tokens.count(term)))
+        average = max(lengths.mean(), 1.0) if len(texts) else 1.0
+        self.norms = k1 * (1 - b + b * lengths / average)
+        self.postings = {term: (np.array([i for i, _ in items]), np.array([tf for _, tf in items], dtype=np.float32))
+                         for term, items in postings.items()}
+
+    def scores(self, query) -> np.ndarray:
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term in self.postings:
+                ids, tf = self.postings[term]
+                idf = np.log(1 + (self.size - len(ids) + 0.5) / (len(ids) + 0.5))
+                scores[ids] += idf * tf * (self.k1 + 1) / (tf + self.norms[ids])
+        return scores
+
+
+def make_vector_index(vectors: np.ndarray, kind='auto', ivf_min_entries=20000, **kwargs):
+    # exact search for small knowledge bases, IVF beyond ivf_min_entries entries with kind='auto'
+    if kind == 'ivf' or (kind == 'auto' and len(vectors) >= ivf_min_entries):
+        return IVFIndex(vectors, **kwargs)
+    return ExactIndex(vectors)
+
+
+class KnowledgeIndex:
+    """
+    Embedding index of the knowledge entries, persisted on disk with a content hash per entry: only new or changed
+    entries are embedded again. Vectors are normalized, so a query is one embedding plus a matrix product.
+    """
+
+    def __init__(self, path, model, model_name, kind='auto', embedding_weight=1.0, lexical_weight=0.0,
+                 lexical_saturation=3.0, query_cache_size=1024, **index_settings):
+        self.path = path
+        self.model = model
+        self.model_name = model_name
+        self.kind = kind
+        self.index_settings = index_settings
+        # hybrid score = embedding_weight * cosine similarity + lexical_weight * s / (s + lexical_saturation) with s
+        # the BM25 score: an absolute score in [0, 1), so a weak match is not raised to 1 when it is the best one
+        self.embedding_weight = embedding_weight
+        self.lexical_weight = lexical_weight
+        self.lexical_saturation = lexical_saturation
+        self.lexical = None
+        self.query_cache = OrderedDict()  # LRU cache of query embeddings
+        self.query_cache_size = query_cache_size
+        self.keys = []
+        self.hashes = []
+        self.metadata = []
+        self.vectors = np.empty((0, 0), dtype=np.float32)
+        self.index = None
+
+    def load(self) -> dict:
+        # {hash: vector} of the entries stored on disk
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            stored = np.load(self.path, allow_pickle=False)
+            return dict(zip(stored["hashes"].tolist(), stored["vectors"]))
+        except Exception as e:
+            print(f"Error in loading the knowledge index {self.path}: {e}")
+            return {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        partial = self.path + '.partial.npz'
+        np.savez(partial, keys=np.array(self.keys), hashes=np.array(self.hashes), vectors=self.vectors)
+        os.replace(partial, self.path)
+
+    def embed(self, texts) -> np.ndarray:
+        return np.asarray(self.model.encode(texts, convert_to_numpy=True, normalize_embeddings=True),
+                          dtype=np.float32)
+
+    def build(self, keys, metadata: list = None):
+        """
+        Index the given entry keys (with a metadata dict per entry for filtering), embedding only those whose
+        content hash is not on disk.
+        """
+        stored = self.load()
+        hashes = [content_hash(key, self.model_name) for key in keys]
+        missing = [i for i, h in enumerate(hashes) if h not in stored]
+        if missing:
+            for i, vector in zip(missing, self.embed([keys[i] for i in missing])):
+                stored[hashes[i]] = vector
+        self.keys, self.hashes = list(keys), hashes
+        self.metadata = list(metadata) if metadata is not None else [{} for _ in keys]
+        self.vectors = np.stack([stored[h] for h in hashes]) if hashes else np.empty((0, 0), dtype=np.float32)
+        self.index = make_vector_index(self.vectors, self.kind, **self.index_settings) if hashes else None
+        self.lexical = BM25Index(self.keys) if self.lexical_weight else None
+        if missing or len(stored) != len(hashes):  # new, changed or removed entries
+            self.save()
+        print(f"Knowledge index: {len(keys)} entries, {len(missing)} embedded.")
+
+    def embed_queries(self, queries) -> np.ndarray:
+        missing = list(dict.fromkeys(query for query in queries if query not in self.query_cache))
+        if missing:
+            for query, vector in zip(missing, self.embed(missing)):
+                self.query_cache[query] = vector
+        vectors = []
+        for query in queries:
+            self.query_cache.move_to_end(query)
+            vectors.append(self.query_cache[query])
+        while len(self.query_cache) > self.query_cache_size:
+            self.query_cache.popitem(last=False)
+        return np.stack(vectors)
+
+    def search(self, query, k=1, where=None) -> list:
+        """
+        Return the k best matching [(key, cosine similarity)], best first, among the entries matching the
+        metadata filter where.
+        """
+        return self.search_batch([query], k, where)[0]
+
+    def search_batch(self, queries, k=1, where=None) -> list:
+        # one embedding call and one vectorized search for all the queries, e.g. in validation runs
+        if self.index is None or not len(queries):
+            return [[] for _ in queries]
+        mask = metadata_mask(self.metadata, where)
+        vectors = self.embed_queries(list(queries))
+        if self.lexical is None:
+            indices, scores = self.index.search(vectors, k, mask)
+            scores = scores * self.embedding_weight
+        else:
+            indices, scores = self.hybrid_search(queries, vectors, k, mask)
+        return [[(self.keys[i], float(score)) for i, score in zip(row, row_scores) if i >= 0 and np.isfinite(score)]
+                for row, row_scores in zip(indices, scores)]
+
+    def hybrid_search(self, queries, vectors, k, mask, candidates=4) -> tuple:
+        # the candidates of the embedding index and the best lexical matches are scored with the fused score
+        pool = candidates * k
+        dense = self.index.search(vectors, pool, mask)[0]
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for i, query in enumerate(queries):
+            lexical = self.lexical.scores(query)
+            if mask is not None:
+                lexical[~mask] = 0
+            lexical_ids = np.flatnonzero(lexical)
+            lexical_ids = lexical_ids[np.argsort(-lexical[lexical_ids])[:pool]]
+            ids = np.union1d(dense[i][dense[i] >= 0], lexical_ids)
+            if mask is not None:
+                ids = ids[mask[ids]]
+            if not len(ids):
+                continue
+            fused = self.embedding_weight * (self.vectors[ids] @ vectors[i])
+            fused = fused + self.lexical_weight * lexical[ids] / (lexical[ids] + self.lexical_saturation)
+            best, best_scores = top_k(fused[None, :].astype(np.float32), k)
+            indices[i, :best.shape[1]], scores[i, :best.shape[1]] = ids[best[0]], best_scores[0]
+        return indices, scores
@@ -0,0 +1,135 @@
+import ast
+import glob
+import importlib
+import importlib.metadata
+import importlib.util
+import os
+
+BUILTIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'knowledge_integration')
+BUILTIN_PACKAGE = 'knowledge_integration'
+ENTRY_POINT_GROUP = 'lambda.knowledge'
+METADATA_FIELDS = ('name', 'description', 'mode', 'core_function', 'runnable_function')
+
+
+class KnowledgeEntry:
+    """
+    A knowledge module known by its metadata (name, description, mode) read from the source without importing
+    it. The module is imported and the knw object created on first use.
+    """
+
+    def __init__(self, metadata: dict, class_name, module=None, file_path=None):
+        self.name = metadata['name']
+        self.description = metadata['description']
+        self.mode = metadata.get('mode', 'full')
+        self.class_name = class_name
+        self.module = module  # importable module name, or None to load file_path
+        self.file_path = file_path
+        self.instance = None
+
+    @property
+    def key(self) -> str:
+        return self.name + self.description
+
+    def load(self):
+        if self.instance is None:
+            if self.module:
+                module = importlib.import_module(self.module)
+            else:
+                spec = importlib.util.spec_from_file_location(
+                    f"lambda_knowledge_{os.path.splitext(os.path.basename(self.file_path))[0]}", self.file_path)
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+            self.instance = getattr(module, self.class_name)()
+        return self.instance
+
+    # the code of the knowledge is only built when it is retrieved
+    def get_core_function(self):
+        return self.load().get_core_function()
+
+    def get_runnable_function(self):
+        return self.load().get_runnable_function()
+
+    def get_all_code(self):
+        return self.load().get_all_code()
+
+
+def base_name(node) -> str:
+    return node.id if isinstance(node, ast.Name) else node.attr if isinstance(node, ast.Attribute) else ''
+
+
+def class_metadata(source) -> dict:
+    """
+    {class name: metadata} of the knw subclasses of a source file, from the literal self.<field> = ...
+    assignments of their __init__.
+    """
+    classes = {}
+    for node in ast.walk(ast.parse(source)):
+        if not isinstance(node, ast.ClassDef) or not any(base_name(base) == 'knw' for base in node.bases):
+            continue
+        metadata = {}
+        for item in node.body:
+            if isinstance(item, ast.FunctionDef) and item.name == '__init__':
+                for stmt in ast.walk(item):
+                    if isinstance(stmt, ast.Assign) and len(stmt.targets) == 1 \
+                            and isinstance(stmt.targets[0], ast.Attribute) \
+                            and base_name(stmt.targets[0].value) == 'self' and stmt.targets[0].attr in METADATA_FIELDS:
+                        try:
+                            metadata[stmt.targets[0].attr] = ast.literal_eval(stmt.value)
+                        except ValueError:
+                            pass
+        if isinstance(metadata.get('name'), str) and isinstance(metadata.get('description'), str):
+            classes[node.name] = metadata
+        else:
+            print(f"Knowledge {node.name} skipped: name and description must be literal strings in __init__.")
+    return classes
+
+
+def read_source(file_path) -> str:
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def discover_directory(directory) -> list:
+    # every .py file of the directory; the built-in folder is imported as a package for its relative imports
+    entries = []
+    package = os.path.abspath(directory) == BUILTIN_DIR
+    for file_path in sorted(glob.glob(os.path.join(directory, '*.py'))):
+        if os.path.basename(file_path).startswith('_'):
+            continue
+        try:
+            classes = class_metadata(read_source(file_path))
+        except (SyntaxError, UnicodeDecodeError) as e:
+            print(f"Error in reading knowledge from {file_path}: {e}")
+            continue
+        module = f"{BUILTIN_PACKAGE}.{os.path.splitext(os.path.basename(file_path))[0]}" if package else None
+        entries += [KnowledgeEntry(metadata, class_name, module=module, file_path=file_path)
+                    for class_name, metadata in classes.items()]
+    return entries
+
+
+def discover_entry_points(group=ENTRY_POINT_GROUP) -> list:
+    # installed packages declare knowledge as entry points "name = package.module:KnowledgeClass"
+    entries = []
+    for entry_point in importlib.metadata.entry_points(group=group):
+        module, _, class_name = entry_point.value.partition(':')
+        try:
+            spec = importlib.util.find_spec(module)
+            metadata = class_metadata(read_source(spec.origin)).get(class_name)
+        except Exception as e:
+            print(f"Error in reading knowledge entry point {entry_point.value}: {e}")
+            continue
+        if metadata:
+            entries.append(KnowledgeEntry(metadata, class_name, module=module))
+    return entries
+
+
+def discover_knowledge(directories=None) -> list:
+    """
+    Knowledge entries of the built-in folder, the given directories and the installed entry points, without
+    importing any of them.
+    """
+    entries = []
+    for directory in [BUILTIN_DIR] + list(directories or []):
+        entries += discover_directory(directory)
+    entries += discover_entry_points()
+    return entries
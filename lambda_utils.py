@@ -17,3 +17,100 @@ def extract_code(text: str) -> tuple[bool, Any]:
         return True, code_block[1]
     else:
         return False, ''
+
+
+def number_code_lines(code: str) -> str:
+    lines = code.split('\n')
+    width = len(str(len(lines)))
+    return '\n'.join(f"{i + 1:>{width}}| {line}" for i, line in enumerate(lines))
+
+
+def extract_patch(text: str) -> tuple[bool, str]:
+    pattern = r'```(?:diff|patch)[^\n]*\n(.*?)```'
+    matches = re.findall(pattern, text, re.DOTALL)
+    if matches:
+        return True, matches[-1]
+    return False, ''
+
+
+NUMBERED_LINE = re.compile(r'^\s*\d+\| ?')
+
+
+def strip_line_numbers(body: list) -> list:
+    # Hunks copied from the numbered code (number_code_lines) keep the "N| " prefixes, remove them.
+    lines = [line for tag, line in body if line]
+    if lines and all(NUMBERED_LINE.match(line) for line in lines):
+        return [(tag, NUMBERED_LINE.sub('', line, count=1)) for tag, line in body]
+    return body
+
+
+def parse_patch(patch: str) -> list:
+    # Return hunks as (start line in the old code, number of old lines, [(tag, line), ...]) with tag in ' ', '-', '+'.
+    hunks = []
+    header = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+    current = None
+    for line in patch.split('\n'):
+        if line.startswith('---') or line.startswith('+++'):
+            continue
+        match = header.match(line)
+        if match:
+            current = (int(match.group(1)), int(match.group(2) or 1), [])
+            hunks.append(current)
+        elif current is not None:
+            if line[:1] in (' ', '-', '+'):
+                current[2].append((line[0], line[1:]))
+            elif line == '':
+                current[2].append((' ', ''))
+    return [(start, count, strip_line_numbers(body)) for start, count, body in hunks]
+
+
+def apply_patch(code: str, patch: str) -> tuple[bool, str]:
+    """
+    Apply a unified diff to the code. The context and removed lines of each hunk must match the code;
+    if they do not match at the line given in the hunk header, the nearest matching position is used.
+    Return (False, '') if any hunk can not be applied.
+    """
+    hunks = parse_patch(patch)
+    if not hunks:
+        return False, ''
+    lines = code.split('\n')
+    result = []
+    cursor = 0
+    for start, count, body in hunks:
+        while body and body[-1] == (' ', ''):  # blank trailing context produced by the markdown block
+            body.pop()
+        old = [line for tag, line in body if tag in (' ', '-')]
+        new = [line for tag, line in body if tag in (' ', '+')]
+        # "-2,0" inserts after line 2, otherwise the hunk starts at line "start"
+        expected = start if count == 0 and not old else max(start - 1, 0)
+        position = _find_hunk(lines, old, expected, cursor)
+        if position is None:
+            return False, ''
+        result.extend(lines[cursor:position])
+        result.extend(new)
+        cursor = position + len(old)
+    result.extend(lines[cursor:])
+    return True, '\n'.join(result)
+
+
+def _find_hunk(lines: list, old: list, expected: int, lower: int):
+    def matches(pos):
+        return pos + len(old) <= len(lines) and \
+            all(lines[pos + i].rstrip() == old[i].rstrip() for i in range(len(old)))
+
+    expected = max(expected, lower)
+    for offset in range(max(expected, len(lines)) + 1):
+        for pos in (expected - offset, expected + offset):
+            if lower <= pos <= len(lines) and matches(pos):
+                return pos
+    return None
+
+
+def check_syntax(code: str) -> bool:
+    # Shell and magic commands (e.g. "!pip install") are valid in the kernel but not in Python.
+    source = '\n'.join('' if line.lstrip().startswith(('!', '%')) else line for line in code.split('\n'))
+    try:
+        compile(source, '<patched code>', 'exec')
+        return True
+    except SyntaxError:
+        return False
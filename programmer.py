@@ -1,7 +1,7 @@
 import openai
-from prompt_engineering.prompts import PROGRAMMER_PROMPT
-from knw_in import retrieval_knowledge
+from prompt_engineering.prompts import PROGRAMMER_PROMPT, PMT_KNW_IN_EARLIER
 import os
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
 
@@ -13,12 +13,55 @@ class Programmer:
         self.messages = []
         self.function_repository = {}
         self.last_snaps = None
+        self.retrieval_budget = 0.3  # seconds the request waits for the knowledge search
+        self.retrieval_pool = None
+        self.pending_retrieval = None  # (message, future) of the search started when the message arrived
+        self.late_retrieval = None  # future of a search that missed the budget, its result goes to the next request
 
     def add_functions(self, function_lib: dict) -> None:
         self.function_repository = function_lib
 
-    def _call_chat_model(self, functions=None, include_functions=False, retrieval=False):
+    def start_retrieval(self, message, kernel):
+        """
+        Start the knowledge search of a user message in the background, as soon as the message arrives.
+        """
+        if self.retrieval_pool is None:
+            self.retrieval_pool = ThreadPoolExecutor(max_workers=1)
+        self.pending_retrieval = (message, self.retrieval_pool.submit(self.retrieve, message, kernel))
+
+    @staticmethod
+    def retrieve(message, kernel):
+        # the search and the definition of core-mode code in the kernel, both off the request path
+        from knw_in import find_knowledge, format_code_snaps  # the retrieval stack is loaded on first use
+        knw = find_knowledge(message)
+        return format_code_snaps(knw, kernel) if knw is not None else None
+
+    def collect_retrieval(self, message, kernel):
+        """
+        Snippet of the knowledge found for the message within the latency budget, preceded by the late result of
+        the previous message if it missed its own budget and is ready now. None if nothing is retrieved.
+        """
+        if self.pending_retrieval is None or self.pending_retrieval[0] != message:
+            self.start_retrieval(message, kernel)
+        future = self.pending_retrieval[1]
+        late, self.late_retrieval = self.late_retrieval, None
+        self.pending_retrieval = None
+        snaps = None
+        try:
+            snaps = future.result(timeout=self.retrieval_budget)
+        except FutureTimeout:
+            print(f"Knowledge retrieval missed the budget of {self.retrieval_budget}s, the request is sent without it.")
+            self.late_retrieval = future
+        except Exception as e:
+            print(f"Error in knowledge retrieval: {e}")
+        if late is not None and late.done() and late.exception() is None and late.result():
+            print("Knowledge retrieval: late result of the previous message added.")
+            snaps = PMT_KNW_IN_EARLIER + late.result() + (snaps or '')
+        return snaps
+
+    def _call_chat_model(self, functions=None, include_functions=False, retrieval=False, model=None):
         if retrieval:
+            from knw_in import retrieval_knowledge  # the retrieval stack is loaded on first use
             snaps = retrieval_knowledge(self.messages[-1]["content"])
             if snaps:
                 self.last_snaps = snaps
@@ -27,7 +70,7 @@ class Programmer:
                 self.last_snaps = None
 
         params = {
-            "model": self.model,
+            "model": model or self.model,
             "messages": self.messages,
         }
 
@@ -44,10 +87,10 @@ class Programmer:
             print(f"Error calling chat model: {e}")
             return None
 
-    def _call_chat_model_streaming(self, functions=None, include_functions=False, retrieval=False, kernel=None):
+    def _call_chat_model_streaming(self, functions=None, include_functions=False, retrieval=False, kernel=None, model=None):
         temp = self.messages[-1]["content"]
         if retrieval:
-            snaps = retrieval_knowledge(self.messages[-1]["content"], kernel=kernel)
+            snaps = self.collect_retrieval(self.messages[-1]["content"], kernel)
             if snaps:
                 for chunk in snaps:
                     yield chunk
@@ -57,7 +100,7 @@ class Programmer:
                 self.last_snaps = None
 
         params = {
-            "model": self.model,
+            "model": model or self.model,
             "messages": self.messages,
             "stream": True
         }
@@ -46,6 +46,17 @@ User: 'This is the executing result by computer (If nothing is printed, it maybe
 Assistant: "The dataset appears to be the famous Iris dataset, which is a classic multiclass classification problem. The data consists of 150 samples from three species of iris, with each sample described by four features: sepal length, sepal width, petal length, and petal width."
 '''
 
+DATA_LOADER_PROMPT = "\nThe dataset is also cached in a columnar format. To read it, use the function load_data('{filename}') defined in the back-end, which is much faster than pd.read_csv. It returns a pandas DataFrame, and load_data('{filename}', columns=[...]) reads only the given columns."
+
+COMPACT_PROMPT = " load_data returns compact dtypes (integer columns may be narrowed to int32 and floats to float32, categoricals, parsed dates), so cast to int64 or float64 before arithmetic that can exceed that range; call compact(df) on other large DataFrames you build to reduce their memory."
+
+OUT_OF_CORE_PROMPT = """
+The dataset {filename} ({size_mb} MB) is larger than memory, so NEVER load it whole with pd.read_csv or load_data. It is registered as the table "{table}" of an embedded DuckDB database, query it with the function sql(query) defined in the back-end, which returns the result as a pandas DataFrame, e.g. sql('SELECT col_a, AVG(col_b) FROM {table} WHERE col_c > 0 GROUP BY col_a').
+Push column selection, filters, joins and aggregations into the SQL query so that only small results come back to pandas, and use SELECT * FROM {table} USING SAMPLE 100000 ROWS to get a sample for plots or models.
+"""
+
+SHARED_DATA_PROMPT = " The DataFrame returned by load_data shares read-only memory with the system, so use load_data('{filename}', writable=True) if you will modify it in place (e.g. with inplace=True or .loc assignment)."
+
 RESULT_PROMPT = "This is the executing result by computer:\n{}.\n\nNow: You should reformat the tabular result (if any) in MarkDown format. Then, you should use 1-3 sentences to explain the results. Finally, You should give suggestions for next step based on the chat history. You should list at least 3 points with format like:\n Next, you can:\n[1]Standardize the data in the next step.\n[2]Do outlier detection for the data.\n[3]Train a neural network model."
 
 # RECOMMEND_PROMPT = "You should give suggestions for next step based on the chat history. You should list at least 3 points with format like:\n Next, you can:\n[1]Standardize the data in the next step.\n[2]Do outlier detection for the data.\n[3]Train a neural network model."
@@ -77,6 +88,33 @@ The code you modified (should be wrapped in ```python```):
 
 """
 
+CODE_FIX_PATCH = """You should attempt to fix the bugs in the bellow code based on the provided error information and the method for modification. Please make sure to carefully check every potentially problematic area and make appropriate adjustments and corrections.
+If the error is due to missing packages, you can install packages in the environment by “!pip install package_name”.
+
+- bug code (each line is prefixed by its line number and "| ", which are not part of the code):
+{bug_code}
+
+When executing above code, errors occurred: {error_message}.
+Please check and fix the code based on the modification method.
+
+- modification method:
+{fix_method}
+
+Do not repeat the whole code. Give only your modification as a unified diff against the bug code (should be wrapped in ```diff```), for example:
+```diff
+@@ -3,2 +3,2 @@
+ data = pd.read_csv(path)
+-data.groupby('class').mean()
++data.groupby('class').mean(numeric_only=True)
+```
+Each hunk header gives the line numbers of the bug code, context lines start with a space, removed lines start with "-" and added lines start with "+". Keep the original indentation of every line.
+
+Your modification (unified diff wrapped in ```diff```):
+
+"""
+
+CODE_FIX_FALLBACK = "Your modification can not be applied to the bug code. Please give the whole modified code instead (should be wrapped in ```python```)."
+
 HUMAN_LOOP = "I write or repair the code for you:\n```python\n{code}\n```"
 
 Academic_Report = """You need to write a academic report in markdown format based on what is within the dialog history. The report needs to contain the following (if present):
@@ -272,6 +310,11 @@ Your modified code:
 """
 
 
+PMT_KNW_IN_EARLIER = """
+\n📝 Earlier retrieval:\nThe following knowledge was retrieved for the previous message of the user after that answer had started. Use it only if it is relevant to the current message.
+"""
+
+
 PMT_KNW_IN_CORE = """
 \n📝 Retrieval:\nThe retriever found the following pieces of code cloud address the problem. All functions and classes have been defined and executed in the back-end.
 Retrieval code in 'core' mode:
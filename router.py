@@ -0,0 +1,81 @@
+import json
+
+FAST = 'fast'
+STRONG = 'strong'
+
+
+def estimate_tokens(text: str) -> int:
+    # Rough estimation (about 4 characters per token), good enough for routing and cost accounting.
+    return len(text) // 4 + 1
+
+
+def messages_tokens(messages: list) -> int:
+    return sum(estimate_tokens(str(message.get("content") or "")) for message in messages)
+
+
+class ModelRouter:
+    """
+    Route each LLM request to a fast tier or a strong tier. Requests go to the fast tier first and are
+    escalated to the strong tier on failure, on long context or on user request.
+    Latency, success rate, tokens and cost are recorded per tier.
+    """
+
+    def __init__(self, config):
+        routing = config.get('routing') or {}
+        self.enable = routing.get('enable', False)
+        self.fast_model = routing.get('fast_model')
+        self.strong_models = {"programmer": config['programmer_model'], "inspector": config['inspector_model']}
+        self.fast_tasks = routing.get('fast_tasks', ['code', 'hint', 'summary'])
+        self.max_fast_context_tokens = routing.get('max_fast_context_tokens', 8000)
+        self.escalate_after_errors = routing.get('escalate_after_errors', 1)
+        self.escalate_keywords = [k.lower() for k in routing.get('escalate_keywords', [])]
+        self.cost_per_1k_tokens = routing.get('cost_per_1k_tokens', {})
+        self.user_escalation = False
+        self.stats = {tier: self.empty_stats() for tier in (FAST, STRONG)}
+
+    @staticmethod
+    def empty_stats():
+        return {"calls": 0, "latency": 0.0, "tokens": 0, "cost": 0.0, "success": 0, "failure": 0}
+
+    def begin_turn(self, user_message: str):
+        text = user_message.lower()
+        self.user_escalation = any(keyword in text for keyword in self.escalate_keywords)
+
+    def route(self, task: str, messages: list, attempt=0) -> str:
+        if not self.enable or not self.fast_model:
+            return STRONG
+        if self.user_escalation or task not in self.fast_tasks:
+            return STRONG
+        if attempt >= self.escalate_after_errors:
+            return STRONG
+        if messages_tokens(messages) > self.max_fast_context_tokens:
+            return STRONG
+        return FAST
+
+    def model(self, role: str, tier: str) -> str:
+        return self.fast_model if tier == FAST else self.strong_models[role]
+
+    def record_call(self, tier: str, latency: float, messages: list, response: str):
+        tokens = messages_tokens(messages) + estimate_tokens(response)
+        stats = self.stats[tier]
+        stats["calls"] += 1
+        stats["latency"] += latency
+        stats["tokens"] += tokens
+        stats["cost"] += tokens / 1000 * self.cost_per_1k_tokens.get(tier, 0.0)
+
+    def record_outcome(self, tier: str, success: bool):
+        self.stats[tier]["success" if success else "failure"] += 1
+
+    def report(self) -> dict:
+        report = {}
+        for tier, stats in self.stats.items():
+            outcomes = stats["success"] + stats["failure"]
+            report[tier] = dict(stats,
+                                avg_latency=stats["latency"] / stats["calls"] if stats["calls"] else 0.0,
+                                success_rate=stats["success"] / outcomes if outcomes else None)
+        return report
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=4)
+
@@ -0,0 +1,138 @@
+import copy
+import os
+import threading
+import time
+from kernel import CodeKernel, execute
+from lambda_utils import extract_code
+from prompt_engineering.prompts import RESULT_PROMPT
+
+
+class Speculator:
+    """
+    Pre-compute the suggested next steps while the user reads the answer.
+
+    For the top suggestions, the programmer writes the code and the code runs in a separate speculation kernel,
+    which works in its own folder, so the session is not touched. Before each suggestion the kernel is reset and
+    replays the successful cells of the session (the bootstrap cells included), so that a suggestion never sees the
+    changes of another one; the replay is limited to max_replay_cells cells and max_replay_time seconds.
+    Results are cached under the suggestion text; starting a new turn drops all unused speculation.
+    """
+
+    def __init__(self, config, programmer, session_cache_path):
+        speculation = config.get('speculation') or {}
+        self.enable = speculation.get('enable', False)
+        self.max_suggestions = speculation.get('max_suggestions', 2)
+        self.max_replay_cells = speculation.get('max_replay_cells', 20)
+        self.max_replay_time = speculation.get('max_replay_time', 60)
+        self.max_exe_time = speculation.get('max_exe_time', 120)
+        self.programmer = programmer
+        self.session_cache_path = os.path.normpath(session_cache_path)
+        self.speculation_path = self.session_cache_path + '_speculation'
+        self.kernel = None
+        self.cache = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.kernel_lock = threading.Lock()
+
+    def add_file(self, file_path):
+        # uploaded files are linked into the speculation folder, outputs of speculation stay there
+        os.makedirs(self.speculation_path, exist_ok=True)
+        link = os.path.join(self.speculation_path, os.path.basename(file_path))
+        if not os.path.exists(link):
+            os.symlink(os.path.abspath(file_path), link)
+
+    def start(self, messages: list, suggestions: list, executed_cells: list, model=None, modules: dict = None):
+        if not self.enable or len(executed_cells) > self.max_replay_cells:
+            return
+        with self.lock:
+            self.generation += 1
+            self.cache = {}
+            generation = self.generation
+        thread = threading.Thread(target=self.run, daemon=True,
+                                  args=(generation, copy.deepcopy(messages), suggestions[:self.max_suggestions],
+                                        list(executed_cells), model, dict(modules or {})))
+        thread.start()
+
+    def pop(self, suggestion: str):
+        """
+        Return the cached result of the suggestion (or None) and drop all other speculation.
+        """
+        with self.lock:
+            result = self.cache.get(suggestion.strip())
+            self.generation += 1
+            self.cache = {}
+        if result is None:
+            return None
+        return {key: self.to_session_path(value) for key, value in result.items()}
+
+    def run(self, generation, messages, suggestions, executed_cells, model, modules):
+        with self.kernel_lock:
+            if generation != self.generation:
+                return
+            for suggestion in suggestions:
+                if generation != self.generation:
+                    return
+                try:  # each suggestion starts from the state of the session
+                    self.reset_kernel(executed_cells, modules)
+                except Exception as e:
+                    print(f"Speculation kernel could not be prepared: {e}")
+                    return
+                try:
+                    result = self.speculate(messages, suggestion, model)
+                except Exception as e:
+                    print(f"Speculation of '{suggestion}' failed: {e}")
+                    continue
+                with self.lock:
+                    if result and generation == self.generation:
+                        self.cache[suggestion.strip()] = result
+                        print(f"Speculation of '{suggestion}' is ready.")
+
+    def speculate(self, messages, suggestion, model):
+        messages = [dict(message, content=self.to_speculation_path(message["content"])) for message in messages]
+        messages.append({"role": "user", "content": suggestion})
+        response = self.complete(messages, model)
+        is_python, code = extract_code(response)
+        if not is_python:
+            return None
+        sign, msg_llm, exe_res = execute(code, self.kernel)
+        if not sign or 'error' in sign:
+            return None
+        messages.append({"role": "assistant", "content": response})
+        messages.append({"role": "user", "content": RESULT_PROMPT.format(msg_llm)})
+        summary = self.complete(messages, model)
+        return {"response": response, "code": code, "exe_res": exe_res, "summary": summary}
+
+    def complete(self, messages, model):
+        response = self.programmer.client.chat.completions.create(model=model or self.programmer.model,
+                                                                  messages=messages)
+        return response.choices[0].message.content
+
+    def reset_kernel(self, executed_cells, modules: dict = None):
+        if self.kernel is None:
+            os.makedirs(self.speculation_path, exist_ok=True)
+            self.kernel = CodeKernel(session_cache_path=self.speculation_path, max_exe_time=self.max_exe_time,
+                                     verbose=0)
+        else:
+            self.kernel.restart()
+        start = time.time()
+        for cell in executed_cells:
+            if time.time() - start > self.max_replay_time:  # a partial replay would give a wrong state
+                raise TimeoutError(f"replay of the session cells took more than {self.max_replay_time}s")
+            execute(self.to_speculation_path(cell), self.kernel)
+        # knowledge code loaded in the session kernel, skipped when already restored after the restart
+        for name, (_, code) in (modules or {}).items():
+            self.kernel.load_module(name, code)
+
+    def to_speculation_path(self, text):
+        return text.replace(self.session_cache_path, self.speculation_path)
+
+    def to_session_path(self, text):
+        return text.replace(self.speculation_path, self.session_cache_path)
+
+    def shutdown(self):
+        with self.lock:
+            self.generation += 1
+            self.cache = {}
+        if self.kernel is not None:
+            self.kernel.shutdown()
+            self.kernel = None
@@ -0,0 +1,50 @@
+import time
+
+
+class ChatStream:
+    """
+    Build the last message of the chat history from streamed tokens and emit it in frames.
+
+    Tokens are collected in a list and only the tokens pending since the last frame are joined and appended to
+    the message text, a frame is ready when `interval` seconds have passed or `max_chars` characters are pending.
+    Frames usually append to the message, so Gradio sends the appended text as a diff to the client; set()
+    replaces the whole message instead.
+    """
+
+    def __init__(self, chat_history, interval=0.05, max_chars=512):
+        self.chat_history = chat_history
+        self.interval = interval
+        self.max_chars = max_chars
+        self.text = chat_history[-1][1] or ''
+        self.pending = []
+        self.pending_chars = 0
+        self.last_flush = time.time()
+
+    def append(self, text: str) -> bool:
+        self.pending.append(text)
+        self.pending_chars += len(text)
+        return self.pending_chars >= self.max_chars or time.time() - self.last_flush >= self.interval
+
+    def set(self, text: str):
+        self.text = text
+        self.pending = []
+        self.pending_chars += len(text)
+
+    def flush(self):
+        if self.pending:
+            self.text += ''.join(self.pending)
+            self.pending = []
+        self.chat_history[-1][1] = self.text
+        self.pending_chars = 0
+        self.last_flush = time.time()
+        return self.chat_history
+
+    def stream(self, messages, response: list):
+        """
+        Append every message of the generator to the chat and to `response`, yield the chat history per frame.
+        """
+        for message in messages:
+            response.append(message)
+            if self.append(message):
+                yield self.flush()
+        yield self.flush()
@@ -0,0 +1,52 @@
+from lambda_utils import apply_patch, number_code_lines, parse_patch
+
+CODE = "import pandas as pd\ndata = pd.read_csv(path)\nprint(data.mean())\nprint('done')"
+
+
+def test_parse_patch_hunks():
+    hunks = parse_patch("--- a\n+++ b\n@@ -2,1 +2,1 @@\n-data = 1\n+data = 2\n@@ -5,0 +6,1 @@\n+x = 9\n")
+    assert hunks == [(2, 1, [('-', 'data = 1'), ('+', 'data = 2')]), (5, 0, [('+', 'x = 9'), (' ', '')])]
+
+
+def test_insertion_with_zero_length_hunk():
+    applied, code = apply_patch(CODE, "@@ -2,0 +3,1 @@\n+x = 9")
+    assert applied
+    assert code.split('\n') == ["import pandas as pd", "data = pd.read_csv(path)", "x = 9",
+                                "print(data.mean())", "print('done')"]
+
+
+def test_insertion_at_the_top():
+    applied, code = apply_patch(CODE, "@@ -0,0 +1,1 @@\n+import numpy as np")
+    assert applied
+    assert code.split('\n')[:2] == ["import numpy as np", "import pandas as pd"]
+
+
+def test_deletion():
+    applied, code = apply_patch(CODE, "@@ -3,2 +3,1 @@\n-print(data.mean())\n print('done')")
+    assert applied
+    assert code == "import pandas as pd\ndata = pd.read_csv(path)\nprint('done')"
+
+
+def test_replacement_with_context_drift():
+    # the header points two lines too early, the context still locates the hunk
+    patch = "@@ -1,2 +1,2 @@\n data = pd.read_csv(path)\n-print(data.mean())\n+print(data.mean(numeric_only=True))"
+    applied, code = apply_patch(CODE, patch)
+    assert applied
+    assert code.split('\n')[2] == "print(data.mean(numeric_only=True))"
+
+
+def test_numbered_lines_are_stripped():
+    numbered = number_code_lines(CODE).split('\n')
+    patch = "@@ -2,2 +2,2 @@\n " + numbered[1] + "\n-" + numbered[2] + "\n+3| print(data.describe())"
+    applied, code = apply_patch(CODE, patch)
+    assert applied
+    assert code.split('\n')[1:3] == ["data = pd.read_csv(path)", "print(data.describe())"]
+
+
+def test_rejected_hunk():
+    applied, code = apply_patch(CODE, "@@ -2,1 +2,1 @@\n-data = pd.read_excel(path)\n+data = None")
+    assert not applied and code == ''
+
+
+def test_no_hunk():
+    assert apply_patch(CODE, "no diff here") == (False, '')
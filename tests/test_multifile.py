@@ -0,0 +1,35 @@
+import os
+import pandas as pd
+import pyarrow.parquet as pq
+from cache.multifile import expand_files, read_partitions, write_partitioned
+
+
+def make_folder(root):
+    # the same columns with different dtypes: integers and floats, integers and text
+    os.makedirs(os.path.join(root, 'year=2023'))
+    os.makedirs(os.path.join(root, 'year=2024'))
+    pd.DataFrame({'id': [1, 2], 'price': [10, 20], 'code': [100, 200]}).to_csv(
+        os.path.join(root, 'year=2023', 'part.csv'), index=False)
+    pd.DataFrame({'id': [3, 4], 'price': [1.5, None], 'code': ['A7', None]}).to_csv(
+        os.path.join(root, 'year=2024', 'part.csv'), index=False)
+
+
+def test_mixed_dtypes_are_cast(tmp_path):
+    make_folder(str(tmp_path / 'sales'))
+    root, files = expand_files(str(tmp_path / 'sales'))
+    data, partition_columns, issues = read_partitions(root, files, workers=1)
+    assert partition_columns == ['year']
+    assert data['price'].dtype == float
+    assert data['code'].tolist()[:3] == ['100', '200', 'A7'] and pd.isna(data['code'].iloc[3])
+    assert any("'code'" in issue and 'cast to text' in issue for issue in issues)
+    assert any("'price'" in issue and 'cast to float64' in issue for issue in issues)
+
+
+def test_mixed_dtypes_are_written(tmp_path):
+    make_folder(str(tmp_path / 'sales'))
+    root, files = expand_files(str(tmp_path / 'sales'))
+    data, partition_columns, _ = read_partitions(root, files, workers=1)
+    target = write_partitioned(data, str(tmp_path / 'sales_parquet'), partition_columns)
+    table = pq.read_table(target)
+    assert table.num_rows == 4
+    assert sorted(table.column('code').to_pylist(), key=str) == ['100', '200', 'A7', None]